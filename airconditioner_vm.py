@@ -1,8 +1,283 @@
+import difflib
+import io
+import operator
+import re
+from array import array
+from collections.abc import MutableMapping
 from dataclasses import dataclass
-from typing import List, Dict, Tuple, Optional
+from typing import Callable, Iterable, Iterator, List, Dict, Set, Tuple, Optional, Union
+
+from output_vm import OutputSink, StateRecord, TextSink
 
 Register = str
 
+MODE_MAP: Dict[str, int] = {"COOL": 0, "HEAT": 1, "DRY": 2, "FAN": 3, "AUTO": 4}
+FAN_MAP: Dict[str, int] = {"OFF": 0, "LOW": 1, "MID": 2, "HIGH": 3}
+
+# Operand kinds per opcode, checked once by the loader
+OPERAND_KINDS: Dict[str, Tuple[str, ...]] = {
+    "LOAD_IMM": ("reg", "imm"),
+    "STORE": ("var", "reg"),
+    "LOAD": ("reg", "var"),
+    "ADD": ("reg", "reg", "reg"),
+    "SUB": ("reg", "reg", "reg"),
+    "MUL": ("reg", "reg", "reg"),
+    "DIV": ("reg", "reg", "reg"),
+    "INC": ("reg",),
+    "DEC": ("reg",),
+    "NEG": ("reg", "reg"),
+    "CMP_EQ": ("reg", "reg", "reg"),
+    "CMP_NE": ("reg", "reg", "reg"),
+    "CMP_LT": ("reg", "reg", "reg"),
+    "CMP_LE": ("reg", "reg", "reg"),
+    "CMP_GT": ("reg", "reg", "reg"),
+    "CMP_GE": ("reg", "reg", "reg"),
+    "JZ": ("label",),
+    "JNZ": ("label",),
+    "JMP": ("label",),
+    "READ_SENSOR": ("reg", "sensor"),
+    "WAIT": ("reg",),
+    "POWER": ("switch",),
+    "SET_MODE": ("mode",),
+    "SET_TEMP": ("reg",),
+    "SET_FAN": ("fan",),
+    "SET_SWING": ("switch",),
+    "PRINT": (),
+    "HALT": (),
+}
+
+# Operand positions an opcode writes (defs) and reads (uses) as registers
+REGISTER_EFFECTS: Dict[str, Tuple[Tuple[int, ...], Tuple[int, ...]]] = {
+    "LOAD_IMM": ((0,), ()),
+    "STORE": ((), (1,)),
+    "LOAD": ((0,), ()),
+    "ADD": ((0,), (1, 2)),
+    "SUB": ((0,), (1, 2)),
+    "MUL": ((0,), (1, 2)),
+    "DIV": ((0,), (1, 2)),
+    "INC": ((0,), (0,)),
+    "DEC": ((0,), (0,)),
+    "NEG": ((0,), (1,)),
+    "CMP_EQ": ((0,), (1, 2)),
+    "CMP_NE": ((0,), (1, 2)),
+    "CMP_LT": ((0,), (1, 2)),
+    "CMP_LE": ((0,), (1, 2)),
+    "CMP_GT": ((0,), (1, 2)),
+    "CMP_GE": ((0,), (1, 2)),
+    "READ_SENSOR": ((0,), ()),
+    "WAIT": ((), (0,)),
+    "SET_TEMP": ((), (0,)),
+}
+
+# Operand positions holding register / variable names, per opcode
+REG_OPERANDS: Dict[str, Tuple[int, ...]] = {
+    op: tuple(i for i, kind in enumerate(kinds) if kind == "reg")
+    for op, kinds in OPERAND_KINDS.items()
+}
+VAR_OPERANDS: Dict[str, Tuple[int, ...]] = {
+    op: tuple(i for i, kind in enumerate(kinds) if kind == "var")
+    for op, kinds in OPERAND_KINDS.items()
+}
+
+# Thermal model parameters (rates are per tick, one tick = one second)
+AMBIENT_TEMP = 25.0     # Temperature the room drifts toward
+DRIFT_RATE = 0.01       # Fraction of the gap to ambient closed per tick
+COOL_HEAT_RATE = 0.1    # Degrees per tick in COOL/HEAT at fan OFF
+FAN_BOOST = 0.5         # Extra COOL/HEAT rate per fan level
+DRY_COOLING = 0.05      # Degrees per tick while DRY is dehumidifying
+DRY_FLOOR = 40.0        # Humidity DRY mode stops at
+TEMP_RANGE = (0.0, 50.0)
+
+# Sensors the thermal model drives; reads of these bring it up to date first
+THERMAL_SENSORS = ("TEMP", "HUMIDITY")
+
+_REGISTER_RE = re.compile(r"T\d+")
+
+# A verified instruction: opcode plus resolved operands (registers and
+# variables still by name, labels as instruction indices)
+Op = Tuple[str, tuple]
+
+
+def is_register(name: str) -> bool:
+    """Check whether an operand names a temp register (Tn)"""
+    return _REGISTER_RE.fullmatch(name) is not None
+
+
+def successors(pc: int, op: Op) -> Tuple[int, ...]:
+    """Instruction indices control can reach after op (past the end means exit)"""
+    name, args = op
+    if name == "JMP":
+        return (args[0],)
+    if name in ("JZ", "JNZ"):
+        return (args[0], pc + 1)
+    if name == "HALT":
+        return ()
+    return (pc + 1,)
+
+
+def register_effects(op: Op) -> Tuple[Tuple[Register, ...], Tuple[Register, ...]]:
+    """Registers written and read by a verified instruction"""
+    name, args = op
+    defs, uses = REGISTER_EFFECTS.get(name, ((), ()))
+    return tuple(args[i] for i in defs), tuple(args[i] for i in uses)
+
+
+def live_registers(ops: List[Op]) -> Tuple[List[Set[Register]], Set[Register]]:
+    """
+    Backward liveness analysis over the instruction-level control flow graph.
+    Returns the registers live after each instruction and those live on entry
+    (read before any write on some path).
+    """
+    size = len(ops)
+    effects = [register_effects(op) for op in ops]
+    succs = [
+        [s for s in successors(i, op) if s < size]
+        for i, op in enumerate(ops)
+    ]
+    live_in: List[Set[Register]] = [set() for _ in ops]
+    live_out: List[Set[Register]] = [set() for _ in ops]
+    changed = True
+    while changed:
+        changed = False
+        for i in reversed(range(size)):
+            out: Set[Register] = set()
+            for s in succs[i]:
+                out |= live_in[s]
+            defs, uses = effects[i]
+            new_in = out.difference(defs)
+            new_in.update(uses)
+            if new_in != live_in[i] or out != live_out[i]:
+                live_in[i], live_out[i] = new_in, out
+                changed = True
+    return live_out, (live_in[0] if ops else set())
+
+
+def allocate_registers(ops: List[Op]) -> Dict[Register, int]:
+    """
+    Map every register named in ops onto a dense slot index so that registers
+    with overlapping live ranges never share a slot.
+    """
+    live_out, entry = live_registers(ops)
+    interference: Dict[Register, Set[Register]] = {}
+    for op in ops:
+        defs, uses = register_effects(op)
+        for reg in defs + uses:
+            interference.setdefault(reg, set())
+    for op, out in zip(ops, live_out):
+        defs, _ = register_effects(op)
+        for reg in defs:
+            for other in out:
+                if other != reg:
+                    interference[reg].add(other)
+                    interference[other].add(reg)
+    # Registers live on entry all start out holding their own value
+    for reg in entry:
+        interference[reg].update(entry - {reg})
+
+    slots: Dict[Register, int] = {}
+    for reg in interference:
+        taken = {slots[n] for n in interference[reg] if n in slots}
+        slot = 0
+        while slot in taken:
+            slot += 1
+        slots[reg] = slot
+    return slots
+
+
+class _Unwritten(int):
+    """The 0 a register beyond T0-T9 reads as until something writes it"""
+
+    def __repr__(self) -> str:
+        return "UNWRITTEN"
+
+
+# Like the dict-based register file, T0-T9 always exist and any other
+# register exists once written. Until then its slot holds UNWRITTEN: reads
+# see 0, every write stores a plain int, and registers/state() leave it out.
+UNWRITTEN = _Unwritten(0)
+BASE_REGISTERS = frozenset(f"T{i}" for i in range(10))
+
+
+def _blank_registers(slots: Dict[Register, int], size: int) -> List[int]:
+    """A register file before any write: 0 in the slots of T0-T9, UNWRITTEN elsewhere"""
+    regs: List[int] = [UNWRITTEN] * size
+    for name, slot in slots.items():
+        if name in BASE_REGISTERS:
+            regs[slot] = 0
+    return regs
+
+
+class SlotView(MutableMapping):
+    """Name-keyed view over a slot-indexed store (None or UNWRITTEN marks an empty slot)"""
+
+    def __init__(self, slots: Dict[str, int], values: List[Optional[int]]):
+        self._slots = slots
+        self._values = values
+
+    def __getitem__(self, name: str) -> int:
+        slot = self._slots[name]
+        value = self._values[slot]
+        if value is None or value is UNWRITTEN:
+            raise KeyError(name)
+        return value
+
+    def __setitem__(self, name: str, value: int):
+        slot = self._slots.get(name)
+        if slot is None:
+            self._slots[name] = len(self._values)
+            self._values.append(value)
+        else:
+            self._values[slot] = value
+
+    def __delitem__(self, name: str):
+        self[name]  # raise KeyError for unknown or empty names
+        self._values[self._slots[name]] = None
+
+    def __iter__(self) -> Iterator[str]:
+        values = self._values
+        return (name for name, slot in self._slots.items()
+                if values[slot] is not None and values[slot] is not UNWRITTEN)
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def clear(self):
+        self._values[:] = [None] * len(self._values)
+
+    def __repr__(self) -> str:
+        return repr(dict(self))
+
+
+class Snapshot:
+    """
+    Execution state at one point of a loaded program. Registers and variables
+    are immutable tuples, so every restore and fork from the same checkpoint
+    shares them; the thermal model is kept unsynced, exactly as it was.
+    """
+    __slots__ = ("ops", "pc", "halted", "steps", "ticks", "last_cmp_result",
+                 "regs", "vars", "sensors", "device", "temperature", "humidity",
+                 "thermal_ticks")
+
+    def __init__(self, vm: "AirConditionerVM"):
+        self.ops = vm.ops  # Identifies the program the slots belong to
+        self.pc = vm.pc
+        self.halted = vm.halted
+        self.steps = vm.steps
+        self.ticks = vm.ticks
+        self.last_cmp_result = vm.last_cmp_result
+        self.regs = tuple(vm.regs)
+        self.vars = tuple(vm.vars)
+        self.sensors = tuple(vm.sensors.items())
+        self.device = tuple(vm.device_state.items())
+        self.temperature = vm.temperature
+        self.humidity = vm.humidity
+        self.thermal_ticks = vm.thermal_ticks
+
+
+class StepLimitError(RuntimeError):
+    """run() used up its max_steps budget"""
+
+
 @dataclass
 class Instr:
     op: str
@@ -10,10 +285,47 @@ class Instr:
 
 class AirConditionerVM:
 
-    def __init__(self):
-        self.registers: Dict[Register, int] = {f"T{i}": 0 for i in range(10)}
-        
-        self.variables: Dict[str, int] = {}
+    def __init__(self, allocate_registers: bool = False, optimize: bool = False,
+                 jit: bool = False, output: Optional[OutputSink] = None,
+                 park_on_wait: bool = False, memo_size: int = 0, skip_cycles: bool = False,
+                 fuse: bool = True):
+        # Where PRINT and HALT go (see output_vm); flushed when run() or step() returns
+        self.output: OutputSink = output if output is not None else TextSink()
+        # Dense register file: register names resolve to slots at load time.
+        # With allocate_registers, temps whose live ranges don't overlap share
+        # a slot, so state() reports them with the value of their shared slot.
+        self.allocate_registers = allocate_registers
+        # With optimize, programs go through optimizer_vm at load time
+        self.optimize = optimize
+        # With jit, run() compiles hot basic blocks (see jit_vm); clear it to
+        # compare against the plain interpreter
+        self.jit = jit
+        self._compiled = None  # jit_vm.BlockCompiler for the loaded program
+        # With park_on_wait, run() returns right after each WAIT (pc on the
+        # next instruction) so a scheduler can resume the VM at wake-up time
+        self.park_on_wait = park_on_wait
+        # With memo_size, pure programs (see memo_vm) remember up to that many
+        # results by input values and skip execution on a hit
+        self.memo_size = memo_size
+        self.memo = None  # memo_vm.ResultMemo, when the loaded program is pure
+        # With skip_cycles, a run with a step budget jumps over repeated
+        # cycles of a settled loop (see cycle_vm)
+        self.skip_cycles = skip_cycles
+        # With fuse, the interpreter runs the compiler's compare-and-branch
+        # sequences as superinstructions (see fusion_vm); clear it to
+        # dispatch every instruction on its own
+        self.fuse = fuse
+        self.fused = None  # fusion_vm.FusedProgram for the loaded program
+        self.profiler = None  # profiler_vm.Profiler, see enable_profiler
+        self.tracer = None  # trace_vm.Tracer, see enable_trace
+        # zones_vm.Zone when a Building's zone replaces the room model
+        self.zone = None
+        self.reg_slots: Dict[Register, int] = {f"T{i}": i for i in range(10)}
+        self.regs: List[int] = [0] * 10
+
+        # Variable store, also resolved to slots (None = never stored)
+        self.var_slots: Dict[str, int] = {}
+        self.vars: List[Optional[int]] = []
         
         self.sensors: Dict[Register, int] = {
             "TEMP": 25,      # Current room temperature (Celsius)
@@ -33,7 +345,17 @@ class AirConditionerVM:
         
         # Program execution state
         self.program: List[Instr] = []
+        self.ops: List[Op] = []
+        self.code: List[Callable[[], int]] = []
         self.labels: Dict[str, int] = {}
+        # Ticks each instruction accounts for (None = one each); an optimized
+        # instruction also covers the ticks of the ones removed before it
+        self.weights: Optional[List[int]] = None
+        self.optimization = None  # optimizer_vm.OptimizationReport
+        # ThermoLang rules (outermost first) each instruction was compiled from
+        self.rules: List[Tuple[str, ...]] = []
+        # Source line of each instruction, when assembled from source
+        self.lines: Optional[array] = None
         self.pc: int = 0
         self.halted: bool = False
         self.steps: int = 0
@@ -41,310 +363,714 @@ class AirConditionerVM:
         
         self.last_cmp_result: int = 0
 
+        # Thermal model: float state advanced lazily, in closed form, up to
+        # thermal_ticks whenever a sensor is read or the device changes
+        self.temperature: float = float(self.sensors["TEMP"])
+        self.humidity: float = float(self.sensors["HUMIDITY"])
+        self.thermal_ticks: int = 0
+
+    @property
+    def registers(self) -> SlotView:
+        """Registers by their original names"""
+        return SlotView(self.reg_slots, self.regs)
+
+    @property
+    def variables(self) -> SlotView:
+        """Variables by name"""
+        return SlotView(self.var_slots, self.vars)
+
     # --- Assembler / Loader ---
-    def load_program(self, source: str):
-        """Load and parse assembly program"""
-        self.program.clear()
-        self.labels.clear()
-        self.pc = 0
-        self.halted = False
-        self.steps = 0
-        self.ticks = 0
+    def load_program(self, source: Union[str, Iterable[str]]):
+        """
+        Assemble and load a program in a single pass over its lines: a string,
+        or a file object / any iterable of lines, read as a stream
+        """
+        self._load_verified(*self._assemble(source, self._verify))
 
-        lines = source.splitlines()
-        # First pass: collect labels
-        idx = 0
-        for raw in lines:
-            line = raw.split(';', 1)[0].strip()
+    def reload_program(self, source: Union[str, Iterable[str]]) -> int:
+        """
+        Hot-swap an edited version of the loaded program without stopping it.
+        Only instructions the loaded program doesn't have are verified again;
+        labels are re-resolved, and registers, variables, sensors, device,
+        ticks and the thermal model carry over. The pc moves to the same
+        instruction in the new code, or else to the label it was under.
+        Returns the new pc; on an assembly error the old program stays.
+        """
+        # Verified ops of the loaded instructions, reused as they are unless
+        # they jump (label positions may have moved)
+        known: Dict[Tuple[str, Tuple[str, ...]], Op] = {}
+        for instr, op in zip(self.program, self.ops):
+            if "label" not in OPERAND_KINDS[op[0]]:
+                known.setdefault((instr.op, instr.args), op)
+
+        def verify(instr: Instr, labels: Dict[str, int], unresolved: List[Tuple[int, str]]) -> Op:
+            op = known.get((instr.op, instr.args))
+            return op if op is not None else self._verify(instr, labels, unresolved)
+
+        self._load_verified(*self._assemble(source, verify), keep_state=True)
+        return self.pc
+
+    def _assemble(self, source: Union[str, Iterable[str]],
+                  verify: Callable[[Instr, Dict[str, int], List[Tuple[int, str]]], Op]):
+        """The single assembly pass: (program, labels, ops, rules, lines)"""
+        if isinstance(source, str):
+            source = io.StringIO(source)
+        program: List[Instr] = []
+        ops: List[Op] = []
+        labels: Dict[str, int] = {}
+        lines = array('I')  # Source line of each instruction
+        # Jumps to labels not seen yet, patched at the end:
+        # (instruction, operand, label, source line)
+        forward: List[Tuple[int, int, str, int]] = []
+        unresolved: List[Tuple[int, str]] = []
+        # The "; RULE: name" / "; END RULE" comments the compiler emits are
+        # kept as per-instruction metadata
+        rules: List[Tuple[str, ...]] = []
+        rule: Tuple[str, ...] = ()
+        nested = False
+
+        for number, raw in enumerate(source, 1):
+            line, _, comment = raw.partition(';')
+            line, comment = line.strip(), comment.strip()
+            if comment.startswith("RULE:"):
+                rule = rule + (comment[5:].strip(),)
+            elif comment == "END RULE":
+                rule = rule[:-1]
+                nested = True
             if not line:
                 continue
-            if line.endswith(':'):
-                label = line[:-1].strip()
-                if not label:
-                    raise ValueError("Empty label definition.")
-                if label in self.labels:
-                    raise ValueError(f"Duplicate label: {label}")
-                self.labels[label] = idx
-            else:
-                idx += 1
-
-        # Second pass: parse instructions
-        for raw in lines:
-            line = raw.split(';', 1)[0].strip()
-            if not line or line.endswith(':'):
-                continue
-            tokens = line.replace(',', ' ').split()
-            op = tokens[0].upper()
-            args = tuple(tokens[1:])
-            self.program.append(Instr(op, args))
+            try:
+                if line.endswith(':'):
+                    label = line[:-1].strip()
+                    if not label:
+                        raise ValueError("Empty label definition.")
+                    if label in labels:
+                        raise ValueError(f"Duplicate label: {label}")
+                    labels[label] = len(ops)
+                    continue
+                tokens = line.replace(',', ' ').split()
+                instr = Instr(tokens[0].upper(), tuple(tokens[1:]))
+                ops.append(verify(instr, labels, unresolved))
+            except ValueError as e:
+                raise ValueError(f"{e} (line {number})") from None
+            if unresolved:
+                forward.extend((len(ops) - 1, i, label, number) for i, label in unresolved)
+                unresolved.clear()
+            program.append(instr)
+            rules.append(rule)
+            lines.append(number)
+
+        for index, position, label, number in forward:
+            if label not in labels:
+                raise ValueError(f"Unknown label: {label} (line {number})")
+            name, args = ops[index]
+            ops[index] = (name, args[:position] + (labels[label],) + args[position + 1:])
+        if not nested:
+            # Older compilers never close a rule, so rules can't nest: each
+            # one lasts until the next
+            legacy: Dict[Tuple[str, ...], Tuple[str, ...]] = {}
+            rules = [legacy.setdefault(stack, stack[-1:]) for stack in rules]
+        return program, labels, ops, rules, lines
+
+    def load_instructions(self, program: List[Instr], labels: Dict[str, int],
+                          rules: Optional[List[Tuple[str, ...]]] = None):
+        """Load an already parsed program (e.g. one shipped to a worker process)"""
+        ops = [self._verify(instr, labels) for instr in program]
+        self._load_verified(program, labels, ops, rules)
+
+    def _load_verified(self, program: List[Instr], labels: Dict[str, int], ops: List[Op],
+                       rules: Optional[List[Tuple[str, ...]]] = None,
+                       lines: Optional[Iterable[int]] = None, keep_state: bool = False):
+        """Optimize (if enabled) and install freshly verified ops"""
+        weights = None
+        self.optimization = None
+        if self.optimize:
+            from optimizer_vm import optimize, to_instructions
+            ops, labels, weights, self.optimization = optimize(ops, labels)
+            program = to_instructions(ops, labels)
+            origins = self.optimization.origins
+            if rules is not None:
+                rules = [rules[i] for i in origins]
+            if lines is not None:
+                lines = [lines[i] for i in origins]
+        self.install(program, labels, ops, weights, rules, lines, keep_state)
+
+    def install(self, program: List[Instr], labels: Dict[str, int], ops: List[Op],
+                weights: Optional[List[int]] = None,
+                rules: Optional[List[Tuple[str, ...]]] = None,
+                lines: Optional[Iterable[int]] = None, keep_state: bool = False):
+        """
+        Install an already verified program and reset execution state, or
+        with keep_state carry on from the matching pc (see reload_program)
+        """
+        if keep_state:
+            pc = self._carry_pc(program, labels)
+        else:
+            # Settle the thermal model before the tick counter restarts
+            self._sync_thermal()
+            pc = 0
+            self.halted = False
+            self.steps = 0
+            self.ticks = 0
+            self.thermal_ticks = 0
+            if self.zone is not None:
+                self.zone.rebase()
+        self.program = list(program)
+        self.labels = dict(labels)
+        self.weights = list(weights) if weights is not None else None
+        self.rules = list(rules) if rules is not None else [()] * len(ops)
+        self.lines = array('I', lines) if lines is not None else None
+        self.pc = pc
+
+        if self.tracer is not None:
+            # The buffered steps belong to the old program
+            self.tracer.spill()
+        # Lay out registers and variables, then resolve every instruction to
+        # a handler
+        self.ops = list(ops)
+        self._layout(pc)
+        if self.profiler is not None:
+            self.profiler = type(self.profiler)(self)
+        self.code = [self._bind(i, op) for i, op in enumerate(self.ops)]
+        self._fuse()
+        self._compiled = None
+        self.memo = None
+        if self.memo_size:
+            from memo_vm import ResultMemo, is_pure
+            if is_pure(self.ops):
+                self.memo = ResultMemo(self, self.memo_size)
+
+    def _carry_pc(self, program: List[Instr], labels: Dict[str, int]) -> int:
+        """Where the pc of the installed program continues in `program`"""
+        pc = self.pc
+        if pc >= len(self.program):
+            return len(program)
+        old = [(instr.op, instr.args) for instr in self.program]
+        new = [(instr.op, instr.args) for instr in program]
+        matcher = difflib.SequenceMatcher(None, old, new, autojunk=False)
+        for a, b, size in matcher.get_matching_blocks():
+            if a <= pc < a + size:
+                return b + pc - a
+        # The instruction changed: start over from the closest label before
+        # it that the new code still has
+        under = [(start, name) for name, start in self.labels.items()
+                 if start <= pc and name in labels]
+        return labels[max(under)[1]] if under else 0
+
+    def _fuse(self):
+        """Build the superinstruction table for the bound program"""
+        self.fused = None
+        if self.fuse:
+            from fusion_vm import superinstructions
+            self.fused = superinstructions(self)
+
+    def enable_profiler(self):
+        """
+        Start recording counts and wall time per instruction; returns the
+        profiler_vm.Profiler. A new program gets a fresh profile.
+        """
+        if self.profiler is None:
+            from profiler_vm import Profiler
+            self.profiler = Profiler(self)
+            self.code = [self._bind(i, op) for i, op in enumerate(self.ops)]
+        return self.profiler
+
+    def disable_profiler(self):
+        """Stop profiling and go back to the unwrapped handlers"""
+        if self.profiler is not None:
+            self.profiler = None
+            self.code = [self._bind(i, op) for i, op in enumerate(self.ops)]
+
+    def enable_trace(self, path: str, chunk_rows: Optional[int] = None):
+        """
+        Record every executed step to a columnar trace file; returns the
+        trace_vm.Tracer. Programs loaded later keep recording to the same file.
+        """
+        if self.tracer is None:
+            from trace_vm import DEFAULT_CHUNK_ROWS, Tracer
+            self.tracer = Tracer(self, path, chunk_rows or DEFAULT_CHUNK_ROWS)
+            self.code = [self._bind(i, op) for i, op in enumerate(self.ops)]
+        return self.tracer
+
+    def disable_trace(self):
+        """Stop tracing, write out the buffered steps and close the file"""
+        if self.tracer is not None:
+            self.tracer.close()
+            self.tracer = None
+            self.code = [self._bind(i, op) for i, op in enumerate(self.ops)]
+
+    def save_bytecode(self, path: str):
+        """Write the loaded program in the binary bytecode format"""
+        from bytecode_vm import write_bytecode
+        write_bytecode(path, self.labels, self.ops, self.weights, self.rules, self.lines)
+
+    def load_bytecode(self, path: str):
+        """Load a bytecode file through mmap, skipping assembly entirely"""
+        from bytecode_vm import read_bytecode
+        program, labels, ops, weights, rules, lines = read_bytecode(path)
+        self.install(program, labels, ops, weights, rules, lines)
+
+    def load_file(self, path: str, cache_dir: Optional[str] = None):
+        """
+        Load a bytecode file, or an assembly or .thermo file through the cache
+        (see bytecode_vm.default_cache_dir) so unchanged sources skip the
+        compiler and assembler
+        """
+        from bytecode_vm import ProgramCache, is_bytecode
+        if path.endswith(".thermo"):
+            ProgramCache(cache_dir).load_thermo(self, path)
+        elif is_bytecode(path):
+            self.load_bytecode(path)
+        else:
+            ProgramCache(cache_dir).load_path(self, path)
+
+    def _verify(self, instr: Instr, labels: Dict[str, int],
+                unresolved: Optional[List[Tuple[int, str]]] = None) -> Op:
+        """
+        Check opcode, arity and operands of one instruction, resolving jumps
+        against `labels`. With `unresolved`, unknown labels are left as -1 and
+        reported there as (operand, label) for the caller to patch.
+        """
+        kinds = OPERAND_KINDS.get(instr.op)
+        if kinds is None:
+            raise ValueError(f"Unknown instruction: {instr.op}")
+        args = instr.args
+        if len(args) != len(kinds):
+            raise ValueError(
+                f"{instr.op} expects {len(kinds)} operand(s), got {len(args)}"
+            )
+        if instr.op == "LOAD" and not is_register(args[0]):
+            # Format: LOAD var, Tn (alternative format)
+            args = (args[1], args[0])
+
+        operands = []
+        for kind, arg in zip(kinds, args):
+            if kind == "reg":
+                if not is_register(arg):
+                    raise ValueError(f"Invalid register: {arg}")
+                operands.append(arg)
+            elif kind == "imm":
+                try:
+                    operands.append(int(arg))
+                except ValueError:
+                    raise ValueError(f"Invalid immediate: {arg}") from None
+            elif kind == "label":
+                if arg in labels:
+                    operands.append(labels[arg])
+                elif unresolved is not None:
+                    unresolved.append((len(operands), arg))
+                    operands.append(-1)
+                else:
+                    raise ValueError(f"Unknown label: {arg}")
+            elif kind == "sensor":
+                sensor = arg.upper()
+                if sensor not in self.sensors:
+                    raise ValueError(f"Unknown sensor: {sensor}")
+                operands.append(sensor)
+            elif kind == "mode":
+                mode = arg.upper()
+                if mode not in MODE_MAP:
+                    raise ValueError(f"Unknown mode: {mode}")
+                operands.append(MODE_MAP[mode])
+            elif kind == "fan":
+                level = arg.upper()
+                if level not in FAN_MAP:
+                    raise ValueError(f"Unknown fan level: {level}")
+                operands.append(FAN_MAP[level])
+            elif kind == "switch":
+                operands.append(1 if arg.upper() == "ON" else 0)
+            else:  # "var"
+                operands.append(arg)
+        return instr.op, tuple(operands)
+
+    def _layout(self, pc: int = 0):
+        """Assign register and variable slots for the verified program, starting at pc"""
+        var_slots = self.var_slots
+        for name, args in self.ops:
+            for i in VAR_OPERANDS[name]:
+                if args[i] not in var_slots:
+                    var_slots[args[i]] = len(self.vars)
+                    self.vars.append(None)
+
+        if self.allocate_registers:
+            slots = allocate_registers(self.ops)
+            regs = _blank_registers(slots, max(slots.values()) + 1 if slots else 0)
+            # Carry over values the new program may read before writing
+            old = self.registers
+            live_out, live = live_registers(self.ops)
+            if 0 < pc < len(self.ops):
+                defs, uses = register_effects(self.ops[pc])
+                live = live_out[pc].difference(defs).union(uses)
+            for reg in live:
+                if reg in old:
+                    regs[slots[reg]] = old[reg]
+        else:
+            slots = dict(self.reg_slots)
+            for name, args in self.ops:
+                for i in REG_OPERANDS[name]:
+                    if args[i] not in slots:
+                        slots[args[i]] = len(slots)
+            regs = self.regs + [UNWRITTEN] * (len(slots) - len(self.regs))
+        self.reg_slots, self.regs = slots, regs
+
+    def _bind(self, index: int, op: Op) -> Callable[[], int]:
+        """Resolve register and variable operands to slots and build the handler"""
+        name, args = op
+        operands = list(args)
+        for i in REG_OPERANDS[name]:
+            operands[i] = self.reg_slots[operands[i]]
+        for i in VAR_OPERANDS[name]:
+            operands[i] = self.var_slots[operands[i]]
+        build = getattr(self, "_op_" + name.lower())
+        handler = build(index, *operands)
+        if self.weights is not None and self.weights[index] > 1:
+            handler = self._charge(handler, self.weights[index] - 1)
+        if self.profiler is not None:
+            handler = self.profiler.wrap(index, handler)
+        if self.tracer is not None:
+            handler = self.tracer.wrap(index, handler)
+        return handler
+
+    def _charge(self, handler: Callable[[], int], extra: int) -> Callable[[], int]:
+        """Account for the ticks of instructions the optimizer removed"""
+        def op():
+            self.ticks += extra
+            return handler()
+        return op
+
+    # --- Instruction handlers ---
+    # Each builder runs once at load time and returns a closure that executes
+    # the instruction and returns the next pc.
+    def _op_load_imm(self, pc, reg, val):
+        regs, nxt = self.regs, pc + 1
+        def op():
+            regs[reg] = val
+            return nxt
+        return op
+
+    def _op_store(self, pc, var, reg):
+        regs, variables, nxt = self.regs, self.vars, pc + 1
+        def op():
+            # `or 0` stores a plain 0 for an UNWRITTEN register
+            variables[var] = regs[reg] or 0
+            return nxt
+        return op
+
+    def _op_load(self, pc, reg, var):
+        regs, variables, nxt = self.regs, self.vars, pc + 1
+        def op():
+            value = variables[var]
+            regs[reg] = 0 if value is None else value
+            return nxt
+        return op
+
+    def _op_add(self, pc, rd, r1, r2):
+        regs, nxt = self.regs, pc + 1
+        def op():
+            regs[rd] = regs[r1] + regs[r2]
+            return nxt
+        return op
+
+    def _op_sub(self, pc, rd, r1, r2):
+        regs, nxt = self.regs, pc + 1
+        def op():
+            regs[rd] = regs[r1] - regs[r2]
+            return nxt
+        return op
+
+    def _op_mul(self, pc, rd, r1, r2):
+        regs, nxt = self.regs, pc + 1
+        def op():
+            regs[rd] = regs[r1] * regs[r2]
+            return nxt
+        return op
+
+    def _op_div(self, pc, rd, r1, r2):
+        regs, nxt = self.regs, pc + 1
+        def op():
+            if regs[r2] == 0:
+                raise RuntimeError("Division by zero" + self._where(pc))
+            regs[rd] = regs[r1] // regs[r2]
+            return nxt
+        return op
+
+    def _op_inc(self, pc, reg):
+        regs, nxt = self.regs, pc + 1
+        def op():
+            regs[reg] += 1
+            return nxt
+        return op
+
+    def _op_dec(self, pc, reg):
+        regs, nxt = self.regs, pc + 1
+        def op():
+            regs[reg] -= 1
+            return nxt
+        return op
+
+    def _op_neg(self, pc, rd, r1):
+        regs, nxt = self.regs, pc + 1
+        def op():
+            regs[rd] = -regs[r1]
+            return nxt
+        return op
+
+    def _compare(self, pc, rd, r1, r2, test):
+        regs, nxt = self.regs, pc + 1
+        def op():
+            result = 1 if test(regs[r1], regs[r2]) else 0
+            regs[rd] = result
+            self.last_cmp_result = result
+            return nxt
+        return op
+
+    def _op_cmp_eq(self, pc, rd, r1, r2):
+        return self._compare(pc, rd, r1, r2, operator.eq)
+
+    def _op_cmp_ne(self, pc, rd, r1, r2):
+        return self._compare(pc, rd, r1, r2, operator.ne)
+
+    def _op_cmp_lt(self, pc, rd, r1, r2):
+        return self._compare(pc, rd, r1, r2, operator.lt)
+
+    def _op_cmp_le(self, pc, rd, r1, r2):
+        return self._compare(pc, rd, r1, r2, operator.le)
+
+    def _op_cmp_gt(self, pc, rd, r1, r2):
+        return self._compare(pc, rd, r1, r2, operator.gt)
+
+    def _op_cmp_ge(self, pc, rd, r1, r2):
+        return self._compare(pc, rd, r1, r2, operator.ge)
+
+    def _op_jz(self, pc, target):
+        nxt = pc + 1
+        def op():
+            return target if self.last_cmp_result == 0 else nxt
+        return op
+
+    def _op_jnz(self, pc, target):
+        nxt = pc + 1
+        def op():
+            return target if self.last_cmp_result != 0 else nxt
+        return op
+
+    def _op_jmp(self, pc, target):
+        def op():
+            return target
+        return op
+
+    def _op_read_sensor(self, pc, reg, sensor):
+        regs, nxt = self.regs, pc + 1
+        if sensor in THERMAL_SENSORS:
+            def op():
+                self._sync_thermal()
+                regs[reg] = self.sensors[sensor]
+                return nxt
+        else:
+            def op():
+                regs[reg] = self.sensors[sensor]
+                return nxt
+        return op
+
+    def _op_wait(self, pc, reg):
+        regs, nxt = self.regs, pc + 1
+        # A negative pc (~next) stops run() without halting; see park_on_wait
+        resume = ~nxt if self.park_on_wait else nxt
+        def op():
+            wait_time = regs[reg]
+            # Simulate waiting by advancing time
+            self.sensors["TIME"] = (self.sensors["TIME"] + wait_time) % 86400
+            self.ticks += wait_time
+            return resume
+        return op
+
+    def _op_power(self, pc, state):
+        nxt = pc + 1
+        def op():
+            self._sync_thermal()
+            self.device_state["POWER_STATE"] = state
+            return nxt
+        return op
+
+    def _op_set_mode(self, pc, mode):
+        nxt = pc + 1
+        def op():
+            self._sync_thermal()
+            self.device_state["MODE"] = mode
+            return nxt
+        return op
+
+    def _op_set_temp(self, pc, reg):
+        regs, nxt = self.regs, pc + 1
+        def op():
+            self._sync_thermal()
+            # `or 0`: a plain 0 for an UNWRITTEN register, as STORE does
+            self.device_state["TARGET_TEMP"] = regs[reg] or 0
+            return nxt
+        return op
+
+    def _op_set_fan(self, pc, level):
+        nxt = pc + 1
+        def op():
+            self._sync_thermal()
+            self.device_state["FAN_SPEED"] = level
+            return nxt
+        return op
+
+    def _op_set_swing(self, pc, state):
+        nxt = pc + 1
+        def op():
+            self.device_state["SWING_STATE"] = state
+            return nxt
+        return op
+
+    def _op_print(self, pc):
+        nxt = pc + 1
+        def op():
+            self._emit_state(pc)
+            return nxt
+        return op
+
+    def _op_halt(self, pc):
+        def op():
+            self.output.halt(self.ticks)
+            self.halted = True
+            return pc
+        return op
 
     # --- Execution ---
     def step(self):
         """Execute one instruction"""
         if self.halted:
             return
-        if not (0 <= self.pc < len(self.program)):
+        if not (0 <= self.pc < len(self.code)):
             self.halted = True
             return
 
-        instr = self.program[self.pc]
         self.steps += 1
         self.ticks += 1
-        
-        # Update thermal model after each instruction
-        self._update_thermal_model()
-
-        # Execute instruction
-        if instr.op == "LOAD_IMM":
-            reg, val = instr.args[0], int(instr.args[1])
-            self.registers[reg] = val
-            self.pc += 1
-
-        elif instr.op == "STORE":
-            var, reg = instr.args[0], instr.args[1]
-            self.variables[var] = self.registers[reg]
-            self.pc += 1
-
-        elif instr.op == "LOAD":
-            # Handle both: "LOAD var, Tn" and "LOAD Tn, var"
-            arg1, arg2 = instr.args[0], instr.args[1]
-            if arg1.startswith('T') and arg1[1:].isdigit():
-                # Format: LOAD Tn, var (compiler's format)
-                reg, var = arg1, arg2
-            else:
-                # Format: LOAD var, Tn (alternative format)
-                var, reg = arg1, arg2
-            self.registers[reg] = self.variables.get(var, 0)
-            self.pc += 1
-
-        elif instr.op == "ADD":
-            rd, r1, r2 = instr.args[0], instr.args[1], instr.args[2]
-            self.registers[rd] = self.registers[r1] + self.registers[r2]
-            self.pc += 1
-
-        elif instr.op == "SUB":
-            rd, r1, r2 = instr.args[0], instr.args[1], instr.args[2]
-            self.registers[rd] = self.registers[r1] - self.registers[r2]
-            self.pc += 1
-
-        elif instr.op == "MUL":
-            rd, r1, r2 = instr.args[0], instr.args[1], instr.args[2]
-            self.registers[rd] = self.registers[r1] * self.registers[r2]
-            self.pc += 1
-
-        elif instr.op == "DIV":
-            rd, r1, r2 = instr.args[0], instr.args[1], instr.args[2]
-            if self.registers[r2] == 0:
-                raise RuntimeError("Division by zero")
-            self.registers[rd] = self.registers[r1] // self.registers[r2]
-            self.pc += 1
-
-        elif instr.op == "INC":
-            reg = instr.args[0]
-            self.registers[reg] += 1
-            self.pc += 1
-
-        elif instr.op == "DEC":
-            reg = instr.args[0]
-            self.registers[reg] -= 1
-            self.pc += 1
-
-        elif instr.op == "NEG":
-            rd, r1 = instr.args[0], instr.args[1]
-            self.registers[rd] = -self.registers[r1]
-            self.pc += 1
-
-        elif instr.op == "CMP_EQ":
-            rd, r1, r2 = instr.args[0], instr.args[1], instr.args[2]
-            result = 1 if self.registers[r1] == self.registers[r2] else 0
-            self.registers[rd] = result
-            self.last_cmp_result = result
-            self.pc += 1
-
-        elif instr.op == "CMP_NE":
-            rd, r1, r2 = instr.args[0], instr.args[1], instr.args[2]
-            result = 1 if self.registers[r1] != self.registers[r2] else 0
-            self.registers[rd] = result
-            self.last_cmp_result = result
-            self.pc += 1
-
-        elif instr.op == "CMP_LT":
-            rd, r1, r2 = instr.args[0], instr.args[1], instr.args[2]
-            result = 1 if self.registers[r1] < self.registers[r2] else 0
-            self.registers[rd] = result
-            self.last_cmp_result = result
-            self.pc += 1
-
-        elif instr.op == "CMP_LE":
-            rd, r1, r2 = instr.args[0], instr.args[1], instr.args[2]
-            result = 1 if self.registers[r1] <= self.registers[r2] else 0
-            self.registers[rd] = result
-            self.last_cmp_result = result
-            self.pc += 1
-
-        elif instr.op == "CMP_GT":
-            rd, r1, r2 = instr.args[0], instr.args[1], instr.args[2]
-            result = 1 if self.registers[r1] > self.registers[r2] else 0
-            self.registers[rd] = result
-            self.last_cmp_result = result
-            self.pc += 1
-
-        elif instr.op == "CMP_GE":
-            rd, r1, r2 = instr.args[0], instr.args[1], instr.args[2]
-            result = 1 if self.registers[r1] >= self.registers[r2] else 0
-            self.registers[rd] = result
-            self.last_cmp_result = result
-            self.pc += 1
-
-        elif instr.op == "JZ":
-            label = instr.args[0]
-            if self.last_cmp_result == 0:
-                if label not in self.labels:
-                    raise ValueError(f"Unknown label: {label}")
-                self.pc = self.labels[label]
-            else:
-                self.pc += 1
-
-        elif instr.op == "JNZ":
-            label = instr.args[0]
-            if self.last_cmp_result != 0:
-                if label not in self.labels:
-                    raise ValueError(f"Unknown label: {label}")
-                self.pc = self.labels[label]
-            else:
-                self.pc += 1
-
-        elif instr.op == "JMP":
-            label = instr.args[0]
-            if label not in self.labels:
-                raise ValueError(f"Unknown label: {label}")
-            self.pc = self.labels[label]
-
-        elif instr.op == "READ_SENSOR":
-            reg, sensor = instr.args[0], instr.args[1].upper()
-            if sensor not in self.sensors:
-                raise ValueError(f"Unknown sensor: {sensor}")
-            self.registers[reg] = self.sensors[sensor]
-            self.pc += 1
-
-        elif instr.op == "WAIT":
-            reg = instr.args[0]
-            wait_time = self.registers[reg]
-            # Simulate waiting by advancing time
-            self.sensors["TIME"] = (self.sensors["TIME"] + wait_time) % 86400
-            self.ticks += wait_time
-            self.pc += 1
-
-        elif instr.op == "POWER":
-            state = instr.args[0].upper()
-            self.device_state["POWER_STATE"] = 1 if state == "ON" else 0
-            self.pc += 1
-
-        elif instr.op == "SET_MODE":
-            mode_str = instr.args[0].upper()
-            mode_map = {"COOL": 0, "HEAT": 1, "DRY": 2, "FAN": 3, "AUTO": 4}
-            if mode_str not in mode_map:
-                raise ValueError(f"Unknown mode: {mode_str}")
-            self.device_state["MODE"] = mode_map[mode_str]
-            self.pc += 1
-
-        elif instr.op == "SET_TEMP":
-            reg = instr.args[0]
-            self.device_state["TARGET_TEMP"] = self.registers[reg]
-            self.pc += 1
-
-        elif instr.op == "SET_FAN":
-            level_str = instr.args[0].upper()
-            level_map = {"OFF": 0, "LOW": 1, "MID": 2, "HIGH": 3}
-            if level_str not in level_map:
-                raise ValueError(f"Unknown fan level: {level_str}")
-            self.device_state["FAN_SPEED"] = level_map[level_str]
-            self.pc += 1
-
-        elif instr.op == "SET_SWING":
-            state = instr.args[0].upper()
-            self.device_state["SWING_STATE"] = 1 if state == "ON" else 0
-            self.pc += 1
-
-        elif instr.op == "PRINT":
-            self._print_state()
-            self.pc += 1
-
-        elif instr.op == "HALT":
-            print("*** Air Conditioner Program Halted ***")
-            self.halted = True
-
-        else:
-            raise ValueError(f"Unknown instruction: {instr.op}")
+        pc = self.code[self.pc]()
+        self.pc = ~pc if pc < 0 else pc
+        # A no-op unless this was PRINT or HALT
+        self.output.flush()
+
+    def _where(self, pc: int) -> str:
+        """" (line N)" for error messages, when pc's source line is known"""
+        if self.lines is not None and 0 <= pc < len(self.lines):
+            return f" (line {self.lines[pc]})"
+        return ""
+
+    def _sync_thermal(self):
+        """Bring the thermal model up to the current tick"""
+        if self.zone is not None:
+            self.zone.sync()
+            return
+        elapsed = self.ticks - self.thermal_ticks
+        self.thermal_ticks = self.ticks
+        if elapsed > 0:
+            self._advance_thermal(elapsed)
 
-    def _update_thermal_model(self):
+    def _advance_thermal(self, seconds: int):
         """
-        Simple thermal model for air conditioning:
-        - Temperature changes based on AC mode, power state, and fan speed
-        - Cooling: temp decreases toward target
-        - Heating: temp increases toward target
-        - Natural drift toward ambient (assumed 25C)
+        Integrate the thermal model over `seconds` ticks with the current
+        device settings, in closed form:
+        - Off (or FAN mode): exponential drift toward ambient
+        - COOL/HEAT: linear toward target at a fan-dependent rate, then hold
+        - DRY: humidity drops 1%/tick down to the floor, cooling slightly
+          while it does
         """
-        if self.device_state["POWER_STATE"] == 0:
-            # AC is off, natural drift toward ambient
-            ambient = 25
-            current = self.sensors["TEMP"]
-            drift = (ambient - current) * 0.01
-            self.sensors["TEMP"] = max(0, min(50, int(current + drift)))
-            return
-
-        mode = self.device_state["MODE"]
-        target = self.device_state["TARGET_TEMP"]
-        fan_speed = self.device_state["FAN_SPEED"]
-        current = self.sensors["TEMP"]
-
-        # Calculate temperature change rate
-        rate = 0.0
-        if mode == 0:  # COOL
-            if current > target:
-                rate = -0.1 * (1 + fan_speed * 0.5)
+        device = self.device_state
+        temp, humidity = self.temperature, self.humidity
+        mode = device["MODE"]
+
+        if device["POWER_STATE"] == 0 or mode == 3:
+            temp = AMBIENT_TEMP + (temp - AMBIENT_TEMP) * (1 - DRIFT_RATE) ** seconds
+        elif mode == 0:  # COOL
+            target = device["TARGET_TEMP"]
+            if temp > target:
+                rate = COOL_HEAT_RATE * (1 + device["FAN_SPEED"] * FAN_BOOST)
+                temp = max(target, temp - rate * seconds)
         elif mode == 1:  # HEAT
-            if current < target:
-                rate = 0.1 * (1 + fan_speed * 0.5)
+            target = device["TARGET_TEMP"]
+            if temp < target:
+                rate = COOL_HEAT_RATE * (1 + device["FAN_SPEED"] * FAN_BOOST)
+                temp = min(target, temp + rate * seconds)
         elif mode == 2:  # DRY
-            # Dehumidification with slight cooling
-            if self.sensors["HUMIDITY"] > 40:
-                self.sensors["HUMIDITY"] = max(0, self.sensors["HUMIDITY"] - 1)
-                rate = -0.05
-        elif mode == 3:  # FAN
-            # Just circulation, slight drift toward ambient
-            rate = (25 - current) * 0.01
-
-        # Update temperature (clamp to reasonable range)
-        new_temp = current + int(rate)
-        self.sensors["TEMP"] = max(0, min(50, new_temp))
-
-    def _print_state(self):
-        """Print current system state"""
-        mode_names = ["COOL", "HEAT", "DRY", "FAN", "AUTO"]
-        fan_names = ["OFF", "LOW", "MID", "HIGH"]
-        print(f"=== Air Conditioner State ===")
-        print(f"Power: {'ON' if self.device_state['POWER_STATE'] else 'OFF'}")
-        print(f"Mode: {mode_names[self.device_state['MODE']]}")
-        print(f"Target Temp: {self.device_state['TARGET_TEMP']}°C")
-        print(f"Current Temp: {self.sensors['TEMP']}°C")
-        print(f"Fan: {fan_names[self.device_state['FAN_SPEED']]}")
-        print(f"Swing: {'ON' if self.device_state['SWING_STATE'] else 'OFF'}")
-        print(f"Humidity: {self.sensors['HUMIDITY']}%")
-        print(f"Occupied: {'YES' if self.sensors['OCCUPIED'] else 'NO'}")
-        print(f"Time: {self.sensors['TIME']//3600:02d}:{(self.sensors['TIME']%3600)//60:02d}")
-        print(f"============================")
+            if humidity > DRY_FLOOR:
+                drying = min(seconds, humidity - DRY_FLOOR)
+                humidity -= drying
+                temp -= DRY_COOLING * drying
+
+        low, high = TEMP_RANGE
+        self.temperature = max(low, min(high, temp))
+        self.humidity = humidity
+        self.sensors["TEMP"] = round(self.temperature)
+        self.sensors["HUMIDITY"] = round(self.humidity)
+
+    def _emit_state(self, pc: int):
+        """Hand the current system state to the output sink"""
+        self._sync_thermal()
+        device, sensors = self.device_state, self.sensors
+        self.output.state(StateRecord(
+            self.ticks, pc, device["POWER_STATE"], device["MODE"],
+            device["TARGET_TEMP"], sensors["TEMP"], device["FAN_SPEED"],
+            device["SWING_STATE"], sensors["HUMIDITY"], sensors["OCCUPIED"],
+            sensors["TIME"]))
 
     def run(self, max_steps: Optional[int] = None):
         """Run program until halt or max_steps reached"""
-        while not self.halted:
-            if max_steps is not None and self.steps >= max_steps:
-                raise RuntimeError("Step limit reached (possible infinite loop).")
-            self.step()
+        code = self.code
+        size = len(code)
+        # -1 never matches, so an unlimited run skips the budget check
+        limit = -1 if max_steps is None else max(max_steps - self.steps, 0)
+        observed = self.profiler is not None or self.tracer is not None
+        # The memo, cycle skipping and the JIT assume the room model
+        modeled = not observed and self.zone is None
+        if self.memo is not None and self.pc == 0 and not self.halted and modeled:
+            self.memo.run(self, limit)
+            return
+        if self.skip_cycles and limit != -1 and modeled:
+            from cycle_vm import run_cycles
+            run_cycles(self, limit)
+            return
+        # Profiling and tracing observe the interpreter's handlers, so they
+        # bypass the JIT
+        if self.jit and modeled:
+            if self._compiled is None:
+                from jit_vm import BlockCompiler
+                self._compiled = BlockCompiler(self)
+            try:
+                self._compiled.run(limit)
+            finally:
+                self.output.flush()
+            return
+        if self.fused is not None and not observed:
+            self.fused.run(limit)
+            return
+        pc = self.pc
+        executed = 0
+        try:
+            while not self.halted:
+                if executed == limit:
+                    raise StepLimitError("Step limit reached (possible infinite loop).")
+                if not (0 <= pc < size):
+                    if pc < 0:  # Parked after a WAIT
+                        pc = ~pc
+                        break
+                    self.halted = True
+                    break
+                executed += 1
+                self.ticks += 1
+                pc = code[pc]()
+        finally:
+            self.pc = ~pc if pc < 0 else pc
+            self.steps += executed
+            self.output.flush()
 
     # --- Helpers ---
     def state(self) -> Dict:
         """Get current VM state"""
+        self._sync_thermal()
         return {
             "registers": dict(self.registers),
             "variables": dict(self.variables),
@@ -358,9 +1084,9 @@ class AirConditionerVM:
 
     def reset(self):
         """Reset VM to initial state"""
-        for reg in self.registers:
-            self.registers[reg] = 0
-        self.variables.clear()
+        # Clear in place: the loaded handlers hold on to these lists
+        self.regs[:] = _blank_registers(self.reg_slots, len(self.regs))
+        self.vars[:] = [None] * len(self.vars)
         self.sensors = {
             "TEMP": 25,
             "HUMIDITY": 60,
@@ -379,13 +1105,69 @@ class AirConditionerVM:
         self.steps = 0
         self.ticks = 0
         self.last_cmp_result = 0
+        self.temperature = float(self.sensors["TEMP"])
+        self.humidity = float(self.sensors["HUMIDITY"])
+        self.thermal_ticks = 0
+        if self.zone is not None:
+            self.zone.rebase()
+
+    def snapshot(self) -> Snapshot:
+        """Capture the execution state, for restore() or fork()"""
+        return Snapshot(self)
+
+    def restore(self, snapshot: Snapshot):
+        """Return to a snapshot taken with the same program loaded"""
+        if snapshot.ops is not self.ops:
+            raise ValueError("Snapshot was taken with a different program loaded")
+        # In place: the loaded handlers hold on to these containers
+        # (slots added after the snapshot, through registers/variables, go empty)
+        for values, saved, empty in ((self.regs, snapshot.regs, UNWRITTEN),
+                                     (self.vars, snapshot.vars, None)):
+            values[:] = saved + (empty,) * (len(values) - len(saved))
+        self.sensors.update(snapshot.sensors)
+        self.device_state.update(snapshot.device)
+        self.pc = snapshot.pc
+        self.halted = snapshot.halted
+        self.steps = snapshot.steps
+        self.ticks = snapshot.ticks
+        self.last_cmp_result = snapshot.last_cmp_result
+        self.temperature = snapshot.temperature
+        self.humidity = snapshot.humidity
+        self.thermal_ticks = snapshot.thermal_ticks
+        if self.zone is not None:
+            self.zone.rebase()
+
+    def fork(self, snapshot: Optional[Snapshot] = None) -> "AirConditionerVM":
+        """
+        A new VM running the same program from snapshot (default: now),
+        sharing the decoded program and the output sink but no state
+        """
+        other = type(self)(self.allocate_registers, self.optimize, self.jit, self.output,
+                           self.park_on_wait, self.memo_size, self.skip_cycles, self.fuse)
+        other.program, other.ops, other.labels = self.program, self.ops, self.labels
+        other.weights, other.rules, other.lines = self.weights, self.rules, self.lines
+        other.optimization, other.memo = self.optimization, self.memo
+        other.reg_slots, other.var_slots = dict(self.reg_slots), dict(self.var_slots)
+        other.regs = _blank_registers(other.reg_slots, len(self.regs))
+        other.vars = [None] * len(self.vars)
+        other.code = [other._bind(i, op) for i, op in enumerate(other.ops)]
+        other._fuse()
+        other.restore(snapshot if snapshot is not None else self.snapshot())
+        return other
 
     def set_sensor(self, sensor: str, value: int):
         """Manually set a sensor value (for testing)"""
         sensor = sensor.upper()
         if sensor not in self.sensors:
             raise ValueError(f"Unknown sensor: {sensor}")
+        self._sync_thermal()
         self.sensors[sensor] = value
+        if sensor == "TEMP":
+            self.temperature = float(value)
+        elif sensor == "HUMIDITY":
+            self.humidity = float(value)
+        if self.zone is not None:
+            self.zone.store()
 
 
 # --------- Demo programs ---------
@@ -536,9 +1318,8 @@ if __name__ == "__main__":
         # Load program from file
         filename = sys.argv[1]
         try:
-            with open(filename, 'r') as f:
-                program_content = f.read()
-            vm.load_program(program_content)
+            # Accepts assembly (.asm), ThermoLang (.thermo) or bytecode written by save_bytecode
+            vm.load_file(filename)
             print(f"Loaded program from: {filename}")
             print()
             vm.run(max_steps=10000)
@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for the AirConditioner VM, with regression baselines.
+
+Workloads are the demo programs plus synthetic ones:
+- counted_loop: a tight ADD/CMP/JNZ loop
+- nested_ifs: a deep if/else nest inside a loop
+- compiler_temps: compiler-style straight-line code with thousands of temps
+- wait_day: a control loop that reads sensors and WAITs through a whole day
+
+Each workload runs under each engine (plain interpreter, the same without
+superinstructions, optimize, jit) and
+records load_program time, run time, steps per second, ns per step, peak
+traced memory and, for the plain engine, per-opcode latency from the
+profiler. Timings are the best of `repeat` runs. Results go to a JSON
+baseline; comparing against one flags every metric that got worse by more
+than the threshold.
+"""
+
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import airconditioner_vm
+from airconditioner_vm import AirConditionerVM
+from output_vm import QuietSink
+
+Workload = Tuple[str, Dict[str, int], Optional[int]]  # source, sensors, max_steps
+
+ENGINES: Dict[str, Dict[str, bool]] = {
+    "plain": {},
+    "unfused": {"fuse": False},
+    "optimize": {"optimize": True},
+    "jit": {"jit": True},
+}
+# Metric -> +1 if higher is worse, -1 if lower is worse
+METRICS = {"load_s": 1, "ns_per_step": 1, "steps_per_s": -1, "peak_kb": 1}
+DEFAULT_THRESHOLD = 0.10
+DEMOS = ("BASIC_TEMP_PROGRAM", "CONDITIONAL_PROGRAM", "LOOP_PROGRAM",
+         "PRESENCE_TIME_PROGRAM", "DEHUMIDIFY_PROGRAM")
+
+
+# --- Synthetic programs ---
+def counted_loop(iterations: int = 200000) -> str:
+    return "\n".join([
+        "LOAD_IMM T0, 0",
+        f"LOAD_IMM T1, {iterations}",
+        "LOAD_IMM T2, 1",
+        "loop:",
+        "ADD T0, T0, T2",
+        "CMP_LT T3, T0, T1",
+        "JNZ loop",
+        "HALT",
+    ]) + "\n"
+
+
+def nested_ifs(depth: int = 8, iterations: int = 2000) -> str:
+    """A 2**depth-leaf if/else tree on bits of the loop counter"""
+    lines = ["LOAD_IMM T0, 0", f"LOAD_IMM T1, {iterations}", "LOAD_IMM T2, 1", "loop:"]
+    labels = iter(range(1 << (depth + 1)))
+
+    def nest(level: int, bit: int):
+        if level == depth:
+            lines.append(f"LOAD_IMM T4, {bit}")
+            lines.append("SET_TEMP T4")
+            return
+        label = next(labels)
+        lines.extend([
+            f"LOAD_IMM T5, {1 << level}",
+            "DIV T6, T0, T5",
+            "LOAD_IMM T7, 2",
+            "DIV T8, T6, T7",
+            "MUL T8, T8, T7",
+            "CMP_EQ T9, T6, T8",
+            f"JZ odd{label}",
+        ])
+        nest(level + 1, bit)
+        lines.extend([f"JMP end{label}", f"odd{label}:"])
+        nest(level + 1, bit | (1 << level))
+        lines.append(f"end{label}:")
+
+    nest(0, 0)
+    lines.extend(["ADD T0, T0, T2", "CMP_LT T3, T0, T1", "JNZ loop", "HALT"])
+    return "\n".join(lines) + "\n"
+
+
+def compiler_temps(temps: int = 3000, iterations: int = 20) -> str:
+    """x = x + k statements the way the compiler emits them, each with fresh temps"""
+    lines = ["LOAD_IMM T0, 0", f"LOAD_IMM T1, {iterations}", "LOAD_IMM T2, 1",
+             "STORE x, T0", "loop:"]
+    reg = 10
+    for k in range(temps // 3):
+        lines.extend([
+            f"LOAD T{reg}, x",
+            f"LOAD_IMM T{reg + 1}, {k % 7}",
+            f"ADD T{reg + 2}, T{reg}, T{reg + 1}",
+            f"STORE x, T{reg + 2}",
+        ])
+        reg += 3
+    lines.extend(["ADD T0, T0, T2", "CMP_LT T3, T0, T1", "JNZ loop", "HALT"])
+    return "\n".join(lines) + "\n"
+
+
+def wait_day(interval: int = 60) -> str:
+    """Poll sensors and adjust the device every `interval` seconds for a day"""
+    return "\n".join([
+        "POWER ON",
+        "SET_MODE COOL",
+        "LOAD_IMM T0, 0",
+        f"LOAD_IMM T1, {86400 // interval}",
+        "LOAD_IMM T2, 1",
+        f"LOAD_IMM T3, {interval}",
+        "loop:",
+        "READ_SENSOR T4, OCCUPIED",
+        "LOAD_IMM T5, 0",
+        "CMP_NE T6, T4, T5",
+        "JZ empty",
+        "READ_SENSOR T7, TEMP",
+        "LOAD_IMM T8, 24",
+        "CMP_GT T9, T7, T8",
+        "JZ mild",
+        "SET_FAN HIGH",
+        "JMP next",
+        "mild:",
+        "SET_FAN MID",
+        "JMP next",
+        "empty:",
+        "SET_FAN LOW",
+        "next:",
+        "WAIT T3",
+        "ADD T0, T0, T2",
+        "CMP_LT T6, T0, T1",
+        "JNZ loop",
+        "HALT",
+    ]) + "\n"
+
+
+def workloads() -> Dict[str, Workload]:
+    """Every benchmark workload by name"""
+    suite: Dict[str, Workload] = {
+        name.lower(): (getattr(airconditioner_vm, name), {"TEMP": 28, "OCCUPIED": 1,
+                                                        "TIME": 79200, "HUMIDITY": 75}, None)
+        for name in DEMOS
+    }
+    suite["counted_loop"] = (counted_loop(), {}, None)
+    suite["nested_ifs"] = (nested_ifs(), {"TEMP": 27}, None)
+    suite["compiler_temps"] = (compiler_temps(), {}, None)
+    suite["wait_day"] = (wait_day(), {"TEMP": 30, "OCCUPIED": 1}, None)
+    return suite
+
+
+# --- Measurement ---
+def _load(source: str, options: Dict[str, bool]) -> AirConditionerVM:
+    vm = AirConditionerVM(output=QuietSink(), **options)
+    vm.load_program(source)
+    return vm
+
+
+def _run(vm: AirConditionerVM, sensors: Dict[str, int], max_steps: Optional[int]) -> float:
+    vm.reset()
+    for sensor, value in sensors.items():
+        vm.set_sensor(sensor, value)
+    start = time.perf_counter()
+    vm.run(max_steps=max_steps)
+    return time.perf_counter() - start
+
+
+def measure(workload: Workload, engine: str, repeat: int = 5) -> Dict:
+    """Metrics for one workload under one engine"""
+    source, sensors, max_steps = workload
+    options = ENGINES[engine]
+
+    load_s = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        vm = _load(source, options)
+        load_s = min(load_s, time.perf_counter() - start)
+    run_s = min(_run(vm, sensors, max_steps) for _ in range(repeat))
+    steps = vm.steps
+
+    tracemalloc.start()
+    try:
+        _run(_load(source, options), sensors, max_steps)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    result = {
+        "instructions": len(vm.ops),
+        "steps": steps,
+        "load_s": load_s,
+        "run_s": run_s,
+        "steps_per_s": steps / run_s if run_s else 0.0,
+        "ns_per_step": run_s * 1e9 / steps if steps else 0.0,
+        "peak_kb": peak / 1024,
+    }
+    if engine == "plain":
+        profiler = vm.enable_profiler()
+        _run(vm, sensors, max_steps)
+        # Includes the profiler's own wrapper, so compare these only with each other
+        result["opcode_ns"] = {name: stats["time_ns"] / stats["count"]
+                               for name, stats in sorted(profiler.by_opcode().items())
+                               if stats["count"]}
+        vm.disable_profiler()
+    return result
+
+
+def run_suite(names: Optional[List[str]] = None, engines: Optional[List[str]] = None,
+              repeat: int = 5) -> Dict:
+    """Measure the selected workloads (default: all) under the selected engines"""
+    suite = workloads()
+    results: Dict[str, Dict] = {}
+    for name in names or list(suite):
+        if name not in suite:
+            raise ValueError(f"Unknown workload: {name}")
+        results[name] = {engine: measure(suite[name], engine, repeat)
+                         for engine in engines or list(ENGINES)}
+    return {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "workloads": results,
+    }
+
+
+def regressions(current: Dict, baseline: Dict,
+                threshold: float = DEFAULT_THRESHOLD) -> Iterator[str]:
+    """Describe each metric worse than the baseline by more than threshold"""
+    for name, engines in current["workloads"].items():
+        for engine, metrics in engines.items():
+            base = baseline.get("workloads", {}).get(name, {}).get(engine)
+            if base is None:
+                continue
+            for metric, direction in METRICS.items():
+                old, new = base.get(metric), metrics.get(metric)
+                if not old or new is None:
+                    continue
+                change = (new - old) / old * direction
+                if change > threshold:
+                    yield (f"{name}/{engine} {metric}: {old:.4g} -> {new:.4g} "
+                           f"({change:+.1%} worse)")
+
+
+def format_results(results: Dict) -> str:
+    lines = [f"{'workload':<22}{'engine':<10}{'instrs':>8}{'steps':>10}"
+             f"{'load ms':>10}{'Msteps/s':>10}{'ns/step':>9}{'peak KB':>10}"]
+    for name, engines in results["workloads"].items():
+        for engine, m in engines.items():
+            lines.append(f"{name:<22}{engine:<10}{m['instructions']:>8}{m['steps']:>10}"
+                         f"{m['load_s'] * 1e3:>10.2f}{m['steps_per_s'] / 1e6:>10.2f}"
+                         f"{m['ns_per_step']:>9.0f}{m['peak_kb']:>10.0f}")
+    return "\n".join(lines)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the AirConditioner VM.")
+    parser.add_argument("--only", help="comma-separated workloads (default: all)")
+    parser.add_argument("--engines", help=f"comma-separated engines ({', '.join(ENGINES)})")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per measurement, best kept")
+    parser.add_argument("--save", help="write the results as a JSON baseline")
+    parser.add_argument("--compare", help="JSON baseline to check for regressions")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="relative change that counts as a regression (default: 0.10)")
+    parser.add_argument("--list", action="store_true", help="list workloads and exit")
+    args = parser.parse_args(argv)
+
+    if args.list:
+        print("\n".join(workloads()))
+        return 0
+    results = run_suite(args.only.split(",") if args.only else None,
+                        args.engines.split(",") if args.engines else None, args.repeat)
+    print(format_results(results))
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Baseline written to {args.save}")
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)
+        found = list(regressions(results, baseline, args.threshold))
+        for line in found:
+            print(f"REGRESSION {line}")
+        if found:
+            return 1
+        print(f"No regressions beyond {args.threshold:.0%}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,498 @@
+#!/usr/bin/env python3
+"""
+Binary bytecode format for AirConditioner VM programs, plus an on-disk cache.
+
+Layout (little-endian):
+    header      magic "ACVM", version, flags, symbol/constant/label/instruction counts
+    symbols     u16 length + UTF-8 bytes each (registers, variables, sensors, labels)
+    constants   i64 each (LOAD_IMM immediates)
+    labels      (u32 symbol index, u32 instruction index) each
+    code        (u8 opcode, 3 x i32 operands) per instruction
+    weights     u32 ticks per instruction, only with FLAG_WEIGHTS (optimized programs)
+    rules       only with FLAG_RULES: u32 count of rule stacks, each a u16 depth
+                + u32 symbol index per rule name, then a u32 stack index per
+                instruction (the ThermoLang rules it was compiled from)
+    lines       u32 source line per instruction, only with FLAG_LINES
+
+Operands are symbol indices for registers, variables and sensors, constant
+indices for immediates, label-table indices for jumps and the encoded value
+for mode/fan/switch operands. Files are read through mmap and decoded
+straight out of the mapping.
+
+The cache also holds ThermoLang compiler output: a .thermo source is
+compiled once into <hash>.asm, keyed by the source and the compiler binary,
+and that assembly gets its own bytecode entry like any other. Entries are
+evicted least recently used first once the directory exceeds its size cap.
+"""
+
+import hashlib
+import mmap
+import os
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from airconditioner_vm import (
+    AirConditionerVM, FAN_MAP, Instr, MODE_MAP, OPERAND_KINDS, Op,
+)
+
+MAGIC = b"ACVM"
+VERSION = 1
+SUFFIX = ".acb"
+ASM_SUFFIX = ".asm"
+COMPILER = "thermolang"
+# Bison/Flex output the compiler is built from (see README, "Como Compilar")
+COMPILER_SOURCES = ("thermolang.tab.c", "lex.yy.c")
+DEFAULT_CACHE_BYTES = 256 << 20
+
+HEADER = struct.Struct("<4sHHIIII")
+SYMBOL_LENGTH = struct.Struct("<H")
+CONSTANT = struct.Struct("<q")
+LABEL = struct.Struct("<II")
+CODE = struct.Struct("<B3i")
+WEIGHT = struct.Struct("<I")
+DEPTH = struct.Struct("<H")
+
+FLAG_WEIGHTS = 1
+FLAG_RULES = 2
+FLAG_LINES = 4
+
+# Bumped whenever cached files gain metadata older ones lack
+CACHE_REVISION = 3
+
+# Opcode byte = position in this table
+OPCODES: Tuple[str, ...] = tuple(OPERAND_KINDS)
+OPCODE_IDS: Dict[str, int] = {name: i for i, name in enumerate(OPCODES)}
+
+MODE_NAMES = {value: name for name, value in MODE_MAP.items()}
+FAN_NAMES = {value: name for name, value in FAN_MAP.items()}
+SWITCH_NAMES = {0: "OFF", 1: "ON"}
+
+
+def encode(labels: Dict[str, int], ops: List[Op],
+           weights: Optional[List[int]] = None,
+           rules: Optional[List[Tuple[str, ...]]] = None,
+           lines: Optional[Sequence[int]] = None) -> bytes:
+    """Serialise a verified program, its tick weights if optimized, and its rule and source-line metadata"""
+    symbols: Dict[str, int] = {}
+    constants: Dict[int, int] = {}
+
+    def symbol(name: str) -> int:
+        return symbols.setdefault(name, len(symbols))
+
+    label_table = [(symbol(name), target) for name, target in labels.items()]
+    # Jumps refer to the first label naming their target
+    label_ids: Dict[int, int] = {}
+    for i, (_, target) in enumerate(label_table):
+        label_ids.setdefault(target, i)
+
+    code = bytearray()
+    for name, args in ops:
+        operands = [0, 0, 0]
+        for i, (kind, arg) in enumerate(zip(OPERAND_KINDS[name], args)):
+            if kind in ("reg", "var", "sensor"):
+                operands[i] = symbol(arg)
+            elif kind == "imm":
+                if not -2**63 <= arg < 2**63:
+                    raise ValueError(f"Immediate out of range: {arg}")
+                operands[i] = constants.setdefault(arg, len(constants))
+            elif kind == "label":
+                operands[i] = label_ids[arg]
+            else:
+                operands[i] = arg
+        code += CODE.pack(OPCODE_IDS[name], *operands)
+
+    rule_section = bytearray()
+    if rules is not None and any(rules):
+        stacks: Dict[Tuple[str, ...], int] = {}
+        for stack in rules:
+            stacks.setdefault(stack, len(stacks))
+        rule_section += WEIGHT.pack(len(stacks))
+        for stack in stacks:
+            rule_section += DEPTH.pack(len(stack))
+            rule_section += struct.pack(f"<{len(stack)}I", *map(symbol, stack))
+        rule_section += struct.pack(f"<{len(rules)}I", *(stacks[stack] for stack in rules))
+
+    flags = ((FLAG_WEIGHTS if weights is not None else 0)
+             | (FLAG_RULES if rule_section else 0)
+             | (FLAG_LINES if lines is not None else 0))
+    out = bytearray(HEADER.pack(MAGIC, VERSION, flags, len(symbols), len(constants),
+                                len(label_table), len(ops)))
+    for name in symbols:
+        raw = name.encode('utf-8')
+        out += SYMBOL_LENGTH.pack(len(raw)) + raw
+    for value in constants:
+        out += CONSTANT.pack(value)
+    for entry in label_table:
+        out += LABEL.pack(*entry)
+    out += code
+    if weights is not None:
+        out += struct.pack(f"<{len(weights)}I", *weights)
+    out += rule_section
+    if lines is not None:
+        out += struct.pack(f"<{len(lines)}I", *lines)
+    return bytes(out)
+
+
+def decode(buffer) -> Tuple[List[Instr], Dict[str, int], List[Op], Optional[List[int]],
+                          Optional[List[Tuple[str, ...]]], Optional[List[int]]]:
+    """
+    Decode a bytecode buffer (bytes, mmap or memoryview) without copying it.
+    Returns (program, labels, ops, weights, rules, lines); weights is None
+    unless optimized, rules and lines are None when the file doesn't carry them.
+    """
+    view = memoryview(buffer)
+    try:
+        if len(view) < HEADER.size:
+            raise ValueError("Not an AirConditioner bytecode file")
+        magic, version, flags, n_symbols, n_constants, n_labels, n_code = HEADER.unpack_from(view)
+        if magic != MAGIC:
+            raise ValueError("Not an AirConditioner bytecode file")
+        if version != VERSION:
+            raise ValueError(f"Unsupported bytecode version: {version}")
+
+        offset = HEADER.size
+        symbols: List[str] = []
+        for _ in range(n_symbols):
+            (length,) = SYMBOL_LENGTH.unpack_from(view, offset)
+            offset += SYMBOL_LENGTH.size
+            symbols.append(str(view[offset:offset + length], 'utf-8'))
+            offset += length
+
+        constants = [CONSTANT.unpack_from(view, offset + i * CONSTANT.size)[0]
+                     for i in range(n_constants)]
+        offset += n_constants * CONSTANT.size
+
+        label_table = [LABEL.unpack_from(view, offset + i * LABEL.size)
+                       for i in range(n_labels)]
+        offset += n_labels * LABEL.size
+        labels = {symbols[name]: target for name, target in label_table}
+
+        end = offset + n_code * CODE.size
+        if end > len(view):
+            raise ValueError("Truncated bytecode file")
+        with view[offset:end] as code:
+            records = list(CODE.iter_unpack(code))
+        offset = end
+        weights = None
+        if flags & FLAG_WEIGHTS:
+            weights = list(struct.unpack_from(f"<{n_code}I", view, offset))
+            offset += n_code * WEIGHT.size
+        rules = None
+        if flags & FLAG_RULES:
+            (n_stacks,) = WEIGHT.unpack_from(view, offset)
+            offset += WEIGHT.size
+            stacks: List[Tuple[str, ...]] = []
+            for _ in range(n_stacks):
+                (depth,) = DEPTH.unpack_from(view, offset)
+                offset += DEPTH.size
+                ids = struct.unpack_from(f"<{depth}I", view, offset)
+                offset += depth * WEIGHT.size
+                stacks.append(tuple(symbols[i] for i in ids))
+            rules = [stacks[i] for i in struct.unpack_from(f"<{n_code}I", view, offset)]
+            offset += n_code * WEIGHT.size
+        lines = None
+        if flags & FLAG_LINES:
+            lines = list(struct.unpack_from(f"<{n_code}I", view, offset))
+    except (IndexError, struct.error, UnicodeDecodeError):
+        raise ValueError("Corrupt bytecode file") from None
+    finally:
+        view.release()
+
+    switch_like = {"mode": MODE_NAMES, "fan": FAN_NAMES, "switch": SWITCH_NAMES}
+    program: List[Instr] = []
+    ops: List[Op] = []
+    try:
+        for opcode, *operands in records:
+            name = OPCODES[opcode]
+            args, text = [], []
+            for kind, value in zip(OPERAND_KINDS[name], operands):
+                if kind == "imm":
+                    value = constants[value]
+                    args.append(value)
+                    text.append(str(value))
+                elif kind == "label":
+                    label, target = label_table[value]
+                    if target > n_code:
+                        raise ValueError("Corrupt bytecode file")
+                    args.append(target)
+                    text.append(symbols[label])
+                elif kind in switch_like:
+                    args.append(value)
+                    text.append(switch_like[kind][value])
+                else:  # register, variable or sensor name
+                    value = symbols[value]
+                    args.append(value)
+                    text.append(value)
+            ops.append((name, tuple(args)))
+            program.append(Instr(name, tuple(text)))
+    except (IndexError, KeyError):
+        raise ValueError("Corrupt bytecode file") from None
+    return program, labels, ops, weights, rules, lines
+
+
+def write_bytecode(path: str, labels: Dict[str, int], ops: List[Op],
+                   weights: Optional[List[int]] = None,
+                   rules: Optional[List[Tuple[str, ...]]] = None,
+                   lines: Optional[Sequence[int]] = None):
+    """Write bytecode atomically, so readers never map a half-written file"""
+    data = encode(labels, ops, weights, rules, lines)
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def read_bytecode(path: str) -> Tuple[List[Instr], Dict[str, int], List[Op], Optional[List[int]],
+                                      Optional[List[Tuple[str, ...]]], Optional[List[int]]]:
+    """Memory-map a bytecode file and decode it"""
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            raise ValueError("Not an AirConditioner bytecode file")
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            return decode(mapped)
+
+
+def is_bytecode(path: str) -> bool:
+    """Check a file's magic number"""
+    with open(path, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def default_cache_dir() -> str:
+    """$ACVM_CACHE_DIR, else ~/.cache/airconditioner_vm"""
+    return os.environ.get("ACVM_CACHE_DIR") or os.path.join(
+        os.path.expanduser("~"), ".cache", "airconditioner_vm")
+
+
+def default_cache_bytes() -> int:
+    """$ACVM_CACHE_MAX_BYTES, else DEFAULT_CACHE_BYTES"""
+    return int(os.environ.get("ACVM_CACHE_MAX_BYTES") or DEFAULT_CACHE_BYTES)
+
+
+def find_compiler(cache_dir: Optional[str] = None) -> str:
+    """
+    $THERMOLANG, else one built from the C sources next to this module into
+    the cache directory (default_cache_dir), else a thermolang binary next
+    to this module or on PATH
+    """
+    if os.environ.get("THERMOLANG"):
+        return os.environ["THERMOLANG"]
+    here = os.path.dirname(os.path.abspath(__file__))
+    try:
+        return build_compiler(here, cache_dir or default_cache_dir())
+    except RuntimeError as e:
+        problem = e
+    local = os.path.join(here, COMPILER)
+    found = local if os.access(local, os.X_OK) else shutil.which(COMPILER)
+    if found is None:
+        raise RuntimeError(f"ThermoLang compiler not found ({problem}); set $THERMOLANG")
+    return found
+
+
+def build_compiler(source_dir: str, build_dir: str) -> str:
+    """
+    The thermolang binary built from the C sources in source_dir with $CC
+    (default cc), kept in build_dir under the hash of the sources so each
+    version is built once
+    """
+    sources = [os.path.join(source_dir, name) for name in COMPILER_SOURCES]
+    digest = hashlib.sha256()
+    try:
+        for path in sources:
+            _hash_file(path, digest)
+    except OSError:
+        raise RuntimeError(f"no {COMPILER} sources in {source_dir}") from None
+    binary = os.path.join(build_dir, f"{COMPILER}-{digest.hexdigest()[:16]}")
+    if os.access(binary, os.X_OK):
+        return binary
+    try:
+        os.makedirs(build_dir, exist_ok=True)
+        # Build under a temporary name, so concurrent callers never run half a binary
+        fd, partial = tempfile.mkstemp(prefix=COMPILER + ".", dir=build_dir)
+        os.close(fd)
+    except OSError as e:
+        raise RuntimeError(f"building {COMPILER} failed: {e}") from None
+    try:
+        cc = os.environ.get("CC", "cc")
+        result = subprocess.run([cc, "-O2", "-o", partial] + sources,
+                                capture_output=True, text=True)
+        if result.returncode != 0:
+            detail = result.stderr.strip() or f"{cc} exited with status {result.returncode}"
+            raise RuntimeError(f"building {COMPILER} failed: {detail}")
+        os.chmod(partial, 0o755)
+        os.replace(partial, binary)
+    except OSError as e:
+        raise RuntimeError(f"building {COMPILER} failed: {e}") from None
+    finally:
+        if os.path.exists(partial):
+            os.unlink(partial)
+    return binary
+
+
+def _hash_file(path: str, digest=None):
+    digest = digest or hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            digest.update(chunk)
+    return digest
+
+
+class ProgramCache:
+    """
+    Bytecode files keyed by the SHA-256 of the assembly source, and compiled
+    assembly keyed by the SHA-256 of ThermoLang source and compiler
+    """
+
+    def __init__(self, directory: Optional[str] = None, max_bytes: Optional[int] = None):
+        self.directory = directory or default_cache_dir()
+        self.max_bytes = default_cache_bytes() if max_bytes is None else max_bytes
+        self._compilers: Dict[Tuple[str, int, int], str] = {}  # (path, size, mtime) -> hash
+
+    def _digest(self, optimize: bool):
+        return hashlib.sha256(b"ACVM%d.%d%s\0" % (VERSION, CACHE_REVISION,
+                                                 b"O" if optimize else b""))
+
+    def key(self, source: str, optimize: bool = False) -> str:
+        digest = self._digest(optimize)
+        digest.update(source.encode('utf-8'))
+        return digest.hexdigest()
+
+    def path(self, source: str, optimize: bool = False) -> str:
+        return os.path.join(self.directory, self.key(source, optimize) + SUFFIX)
+
+    def load(self, vm: AirConditionerVM, source: str) -> bool:
+        """Load source into vm, from the cache when possible; returns True on a hit"""
+        return self._load(vm, self.path(source, vm.optimize), lambda: vm.load_program(source))
+
+    def file_key(self, path: str, optimize: bool = False) -> str:
+        """key() of an assembly file, hashed in chunks"""
+        return _hash_file(path, self._digest(optimize)).hexdigest()
+
+    def load_path(self, vm: AirConditionerVM, path: str) -> bool:
+        """
+        load() for an assembly file, hashed in chunks and streamed into the
+        assembler on a miss. A bytecode file is cached under its own
+        file_key(), so that key finds the program without the file
+        """
+        cached = os.path.join(self.directory, self.file_key(path, vm.optimize) + SUFFIX)
+
+        def assemble():
+            if is_bytecode(path):
+                vm.load_bytecode(path)
+                return
+            with open(path, 'r') as f:
+                vm.load_program(f)
+        return self._load(vm, cached, assemble)
+
+    def _load(self, vm: AirConditionerVM, path: str, assemble) -> bool:
+        try:
+            vm.load_bytecode(path)
+            self._touch(path)
+            return True
+        except (OSError, ValueError):
+            pass
+        assemble()
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            vm.save_bytecode(path)
+            self.evict(keep=path)
+        except OSError:
+            pass  # A read-only cache only costs the speedup
+        return False
+
+    # --- ThermoLang sources ---
+    def _compiler_hash(self, compiler: str) -> str:
+        info = os.stat(compiler)
+        key = (compiler, info.st_size, info.st_mtime_ns)
+        if key not in self._compilers:
+            self._compilers[key] = _hash_file(compiler).hexdigest()
+        return self._compilers[key]
+
+    def compile(self, path: str, compiler: Optional[str] = None) -> str:
+        """
+        Path of the cached assembly for a .thermo file, running the compiler
+        only when this source hasn't been compiled by this compiler before
+        """
+        compiler = compiler or find_compiler(self.directory)
+        digest = hashlib.sha256(b"THERMO\0%s\0" % self._compiler_hash(compiler).encode())
+        cached = os.path.join(self.directory, _hash_file(path, digest).hexdigest() + ASM_SUFFIX)
+        if os.path.exists(cached):
+            self._touch(cached)
+            return cached
+
+        os.makedirs(self.directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        os.close(fd)
+        try:
+            result = subprocess.run([compiler, path, tmp], capture_output=True, text=True)
+            # The compiler reports syntax errors on stderr but still exits 0
+            error = result.stderr.strip()
+            if result.returncode != 0 or error:
+                raise ValueError(f"{path}: {error or f'compiler exited with status {result.returncode}'}")
+            os.replace(tmp, cached)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        self.evict(keep=cached)
+        return cached
+
+    def load_thermo(self, vm: AirConditionerVM, path: str, compiler: Optional[str] = None) -> bool:
+        """Compile (or reuse) a .thermo file and load it; True when the bytecode was a hit"""
+        return self.load_path(vm, self.compile(path, compiler))
+
+    # --- Eviction ---
+    @staticmethod
+    def _touch(path: str):
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    def evict(self, keep: Optional[str] = None) -> int:
+        """Delete least recently used entries but `keep` until the cache fits max_bytes; returns how many"""
+        entries = []
+        try:
+            with os.scandir(self.directory) as it:
+                for entry in it:
+                    if entry.name.endswith((SUFFIX, ASM_SUFFIX)) and entry.is_file():
+                        info = entry.stat()
+                        entries.append((info.st_mtime_ns, info.st_size, entry.path))
+        except OSError:
+            return 0
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.unlink(path)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+        return removed
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("Usage: python3 bytecode_vm.py <input.asm|input.thermo> <output.acb>")
+        sys.exit(1)
+    vm = AirConditionerVM()
+    if sys.argv[1].endswith(".thermo"):
+        ProgramCache().load_thermo(vm, sys.argv[1])
+    else:
+        with open(sys.argv[1], 'r') as f:
+            vm.load_program(f)
+    vm.save_bytecode(sys.argv[2])
+    print(f"Wrote {len(vm.ops)} instructions to {sys.argv[2]}")
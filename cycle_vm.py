@@ -0,0 +1,136 @@
+"""
+Cycle skipping for settled control loops.
+
+A controller is a loop that reads sensors, adjusts the device and WAITs.
+Once the room settles, every trip around the loop starts from the same
+machine state, so the rest of a bounded run is that trip repeated. With
+AirConditionerVM(skip_cycles=True), run(max_steps) keys the full state at
+every loop head (the target of a backward jump): pc, registers, variables,
+compare flag, sensors, device, and the thermal model (exact temperature and
+humidity, and how many ticks it is behind). The key leaves out TIME unless
+the program reads TIME, because WAIT alone only moves the clock.
+
+When a key repeats, the trip since its first sighting is a cycle. As many
+whole cycles as fit in the step budget are applied at once:
+- steps and ticks advance by the cycle's total times the count
+- the thermal model keeps its lag, and TIME moves by the cycle's WAITs
+- the cycle's PRINT records are emitted again for every skipped cycle,
+  shifted in tick and TIME (unless the sink drops them anyway)
+Stepping then carries on normally. The result, output included, is exactly
+what stepping all the way would give, StepLimitError at the end included.
+
+Nothing outside the VM changes during run(). A sensor set between runs just
+changes the state, so each run() starts detecting afresh. Without a step
+budget (max_steps=None), run() never skips, as there is no horizon to skip
+to.
+"""
+
+from typing import Dict, List, Set, Tuple
+
+from airconditioner_vm import AirConditionerVM, StepLimitError
+from output_vm import OutputSink, StateRecord
+
+# States remembered per run before detection starts over, bounding memory for
+# loops that never repeat (a counter, a sensor that keeps drifting)
+MAX_STATES = 4096
+
+JUMPS = ("JZ", "JNZ", "JMP")
+DAY = 86400
+
+
+def loop_heads(ops) -> Set[int]:
+    """Targets of backward jumps"""
+    return {args[0] for pc, (name, args) in enumerate(ops) if name in JUMPS and args[0] <= pc}
+
+
+class _Tee(OutputSink):
+    """Passes events on, keeping the PRINT records of the current run"""
+
+    def __init__(self, sink: OutputSink):
+        self.sink = sink
+        self.records: List[StateRecord] = []
+
+    def state(self, record: StateRecord):
+        self.records.append(record)
+        self.sink.state(record)
+
+    def halt(self, tick: int):
+        self.sink.halt(tick)
+
+    def flush(self):
+        self.sink.flush()
+
+
+def run_cycles(vm: AirConditionerVM, limit: int):
+    """The interpreter loop of run(), skipping repeated cycles; limit is the step budget"""
+    code = vm.code
+    size = len(code)
+    heads = loop_heads(vm.ops)
+    with_time = any(name == "READ_SENSOR" and args[1] == "TIME" for name, args in vm.ops)
+    # key -> (steps, ticks, TIME, records) when the state was seen
+    seen: Dict[tuple, Tuple[int, int, int, int]] = {}
+    skipped = False
+    output = vm.output
+    tee = vm.output = _Tee(output)
+    pc = vm.pc
+    executed = 0
+    try:
+        while not vm.halted:
+            if executed == limit:
+                raise StepLimitError("Step limit reached (possible infinite loop).")
+            if not (0 <= pc < size):
+                if pc < 0:  # Parked after a WAIT
+                    pc = ~pc
+                    break
+                vm.halted = True
+                break
+            if pc in heads and not skipped:
+                sensors = vm.sensors
+                key = (pc, tuple(vm.regs), tuple(vm.vars), vm.last_cmp_result,
+                       sensors["TEMP"], sensors["HUMIDITY"], sensors["OCCUPIED"],
+                       sensors["TIME"] if with_time else None,
+                       tuple(vm.device_state.values()),
+                       vm.temperature, vm.humidity, vm.ticks - vm.thermal_ticks)
+                first = seen.get(key)
+                if first is None:
+                    if len(seen) == MAX_STATES:
+                        seen.clear()
+                        del tee.records[:]
+                    seen[key] = (executed, vm.ticks, sensors["TIME"], len(tee.records))
+                else:
+                    steps, ticks, time, printed = first
+                    cycle_steps = executed - steps
+                    count = (limit - executed) // cycle_steps
+                    if count:
+                        _skip(vm, output, tee.records[printed:], count,
+                              vm.ticks - ticks, (sensors["TIME"] - time) % DAY)
+                        executed += count * cycle_steps
+                    # One skip covers the budget; what is left is under a cycle
+                    skipped = True
+                    seen.clear()
+                    del tee.records[:]
+                    # The skip may have used up the budget exactly
+                    continue
+            executed += 1
+            vm.ticks += 1
+            pc = code[pc]()
+    finally:
+        vm.output = output
+        vm.pc = ~pc if pc < 0 else pc
+        vm.steps += executed
+        output.flush()
+
+
+def _skip(vm: AirConditionerVM, output: OutputSink, records: List[StateRecord],
+          count: int, ticks: int, time: int):
+    """Apply count more cycles of `ticks` ticks that move TIME by `time`"""
+    # A sink that drops records (QuietSink) doesn't need them rebuilt
+    if type(output).state is OutputSink.state:
+        records = ()
+    for n in range(1, count + 1):
+        for record in records:
+            output.state(record._replace(tick=record.tick + n * ticks,
+                                         time=(record.time + n * time) % DAY))
+    vm.ticks += count * ticks
+    vm.thermal_ticks += count * ticks
+    vm.sensors["TIME"] = (vm.sensors["TIME"] + count * time) % DAY
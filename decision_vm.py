@@ -0,0 +1,607 @@
+#!/usr/bin/env python3
+"""
+Symbolic compilation of branch-only programs into sensor decision tables.
+
+A program with only forward jumps and no WAIT (see memo_vm.is_pure) is
+executed symbolically from a reset VM: registers hold linear forms over the
+sensors read (constants folded), every CMP against a constant becomes an
+interval test on one sensor, and each JZ/JNZ on such a test explores both
+sides under the narrowed sensor ranges, dropping the infeasible ones. The
+result is a decision tree whose leaves are the device settings (and any
+division by zero) of that path, also flattened into disjoint rules such as
+
+    TEMP >= 26 ∧ TIME >= 79200 → POWER ON, MODE COOL, TARGET_TEMP 24, FAN LOW
+
+lookup() walks the tree with a few comparisons; evaluate() applies the rules
+as NumPy masks over arrays of readings. Either gives the device state a run
+from a reset VM with those sensor values ends in.
+
+The thermal model moves while the program runs, so what a TEMP/HUMIDITY
+read returns depends on the tick of the read and on the device changes
+before it. Such a read becomes its own symbol (TEMP@13) whose value is a
+monotone function of the sensor's starting value, computed with the VM's
+own thermal code; a test on it is turned back into an interval of the
+starting value by binary search.
+
+Programs the analysis doesn't cover (loops, WAIT, comparisons between two
+sensors, non-linear arithmetic on readings, TEMP read while drying) raise
+UnsupportedProgram; evaluate_program() then falls back to running the VM
+once per reading.
+"""
+
+import argparse
+import sys
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple, Union
+
+from airconditioner_vm import AirConditionerVM, FAN_MAP, MODE_MAP, TEMP_RANGE, THERMAL_SENSORS
+from memo_vm import DEVICE_WRITES, THERMAL_WRITES, is_pure
+from output_vm import QuietSink
+
+DEFAULT_MAX_LEAVES = 4096
+SEARCH_RANGE = 1 << 40  # Starting values a thermal read is inverted over
+
+# A linear form: (constant, ((sensor, coefficient), ...)) with sensors sorted
+Linear = Tuple[int, Tuple[Tuple[str, int], ...]]
+Value = Union[int, Linear]
+Interval = Tuple[Optional[int], Optional[int]]  # inclusive, None = unbounded
+
+SETTING_NAMES = {
+    "POWER_STATE": {0: "OFF", 1: "ON"},
+    "MODE": {value: name for name, value in MODE_MAP.items()},
+    "FAN_SPEED": {value: name for name, value in FAN_MAP.items()},
+    "SWING_STATE": {0: "OFF", 1: "ON"},
+}
+SETTING_LABELS = {"POWER_STATE": "POWER", "MODE": "MODE", "TARGET_TEMP": "TARGET_TEMP",
+                  "FAN_SPEED": "FAN", "SWING_STATE": "SWING"}
+
+
+class UnsupportedProgram(ValueError):
+    """The program can't be compiled into a decision table"""
+
+
+class Test(NamedTuple):
+    """lo <= sensor <= hi"""
+    sensor: str
+    lo: Optional[int]
+    hi: Optional[int]
+
+
+class Leaf(NamedTuple):
+    settings: Tuple[Tuple[str, Value], ...]  # device fields written, in field order
+    error: Optional[str]                     # runtime error the path ends in
+
+
+class Branch(NamedTuple):
+    test: Test
+    inside: "Node"
+    outside: "Node"
+
+
+Node = Union[Leaf, Branch]
+
+
+class Rule(NamedTuple):
+    bounds: Tuple[Tuple[str, Optional[int], Optional[int]], ...]  # (sensor, lo, hi)
+    excluded: Tuple[Test, ...]  # ranges ruled out inside the bounds
+    leaf: Leaf
+
+
+# --- Linear forms ---
+def _linear(value: Optional[Value]) -> Linear:
+    if value is None:
+        raise UnsupportedProgram("Comparison result used as a value")
+    return (value, ()) if isinstance(value, int) else value
+
+
+def _simplify(const: int, terms: Dict[str, int]) -> Value:
+    terms = tuple(sorted((s, c) for s, c in terms.items() if c))
+    return (const, terms) if terms else const
+
+
+def _combine(a: Value, b: Value, sign: int) -> Value:
+    (ca, ta), (cb, tb) = _linear(a), _linear(b)
+    terms = dict(ta)
+    for sensor, coeff in tb:
+        terms[sensor] = terms.get(sensor, 0) + sign * coeff
+    return _simplify(ca + sign * cb, terms)
+
+
+def _scale(a: Value, k: int) -> Value:
+    const, terms = _linear(a)
+    return _simplify(const * k, {s: c * k for s, c in terms})
+
+
+def _ceil_div(a: int, b: int) -> int:
+    return -(-a // b)
+
+
+def _compare(name: str, diff: Value) -> Union[bool, Tuple[Test, bool]]:
+    """
+    `diff OP 0` as a constant or as (interval test, whether true means inside)
+    """
+    const, terms = _linear(diff)
+    if not terms:
+        return {"CMP_EQ": const == 0, "CMP_NE": const != 0, "CMP_LT": const < 0,
+                "CMP_LE": const <= 0, "CMP_GT": const > 0, "CMP_GE": const >= 0}[name]
+    if len(terms) > 1:
+        raise UnsupportedProgram("Comparison depends on more than one sensor")
+    (sensor, a), = terms
+    if a < 0:
+        a, const = -a, -const
+        name = {"CMP_LT": "CMP_GT", "CMP_LE": "CMP_GE", "CMP_GT": "CMP_LT",
+                "CMP_GE": "CMP_LE"}.get(name, name)
+    # a * sensor OP -const, a > 0
+    k = -const
+    if name in ("CMP_EQ", "CMP_NE"):
+        if k % a:
+            return name == "CMP_NE"
+        return Test(sensor, k // a, k // a), name == "CMP_EQ"
+    if name == "CMP_LT":
+        return Test(sensor, None, _ceil_div(k, a) - 1), True
+    if name == "CMP_LE":
+        return Test(sensor, None, k // a), True
+    if name == "CMP_GT":
+        return Test(sensor, k // a + 1, None), True
+    return Test(sensor, _ceil_div(k, a), None), True  # CMP_GE
+
+
+def _intersect(bounds: Interval, test: Test) -> Interval:
+    lo, hi = bounds
+    if test.lo is not None:
+        lo = test.lo if lo is None else max(lo, test.lo)
+    if test.hi is not None:
+        hi = test.hi if hi is None else min(hi, test.hi)
+    return lo, hi
+
+
+def _empty(bounds: Interval) -> bool:
+    lo, hi = bounds
+    return lo is not None and hi is not None and lo > hi
+
+
+def _covers(test: Test, bounds: Interval) -> bool:
+    """Whether the test's interval contains all of bounds"""
+    lo, hi = bounds
+    return ((test.lo is None or (lo is not None and lo >= test.lo))
+            and (test.hi is None or (hi is not None and hi <= test.hi)))
+
+
+def _outside(bounds: Interval, test: Test) -> Optional[Interval]:
+    """The part of bounds outside the test, or None when that isn't one interval"""
+    lo, hi = bounds
+    if test.lo is None or (lo is not None and lo >= test.lo):
+        return test.hi + 1, hi
+    if test.hi is None or (hi is not None and hi <= test.hi):
+        return lo, test.lo - 1
+    return None
+
+
+# --- Thermal reads ---
+class _Reading:
+    """
+    A TEMP/HUMIDITY read at `ticks` after the thermal syncs in `events`
+    ((tick, device field or None, value) each), as a function of the
+    sensor's starting value
+    """
+
+    def __init__(self, sensor: str, ticks: int, events: Tuple[Tuple[int, Optional[str], int], ...]):
+        self.sensor = sensor
+        self.ticks = ticks
+        self.events = events
+        self._vm = AirConditionerVM()
+        self._values: Dict[int, int] = {}
+        self._breaks = None
+
+    def value(self, start: int) -> int:
+        if start not in self._values:
+            vm = self._vm
+            vm.reset()
+            vm.set_sensor(self.sensor, start)
+            for tick, field, value in self.events:
+                vm.ticks = tick
+                vm._sync_thermal()
+                if field is not None:
+                    vm.device_state[field] = value
+            vm.ticks = self.ticks
+            vm._sync_thermal()
+            self._values[start] = vm.sensors[self.sensor]
+        return self._values[start]
+
+    def _first_at_least(self, target: int) -> Optional[int]:
+        """Smallest starting value reading at least target (None: none does)"""
+        lo, hi = -SEARCH_RANGE, SEARCH_RANGE
+        if self.value(hi) < target:
+            return None
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.value(mid) >= target:
+                hi = mid
+            else:
+                lo = mid + 1
+        return lo
+
+    def invert(self, test: Test) -> Test:
+        """The test on this reading as a test on the starting value"""
+        lo = hi = None
+        if test.lo is not None:
+            lo = self._first_at_least(test.lo)
+            if lo is None:
+                return Test(self.sensor, 1, 0)  # Never
+            if lo == -SEARCH_RANGE:
+                lo = None
+        if test.hi is not None:
+            above = self._first_at_least(test.hi + 1)
+            if above is not None:
+                hi = above - 1
+                if hi < -SEARCH_RANGE:
+                    return Test(self.sensor, 1, 0)
+        return Test(self.sensor, lo, hi)
+
+    def identity(self) -> bool:
+        """Humidity only moves while drying"""
+        return self.sensor == "HUMIDITY" and all(
+            not (field == "MODE" and value == 2) for _, field, value in self.events)
+
+    def array(self, starts):
+        """value() over a NumPy array of starting values"""
+        import numpy as np
+
+        if self.identity():
+            return starts
+        if self._breaks is None:
+            # A TEMP read is a step function onto the clamped range. Levels
+            # no start reaches break past every int64 start, levels every
+            # start in the search range reaches break before all of them
+            low, high = (int(bound) for bound in TEMP_RANGE)
+            limits = np.iinfo(np.int64)
+            breaks = []
+            for level in range(low + 1, high + 1):
+                start = self._first_at_least(level)
+                if start is None:
+                    start = limits.max
+                elif start == -SEARCH_RANGE:
+                    start = limits.min
+                breaks.append(start)
+            self._breaks = np.array(breaks, dtype=np.int64)
+        return np.searchsorted(self._breaks, starts, side='right') + int(TEMP_RANGE[0])
+
+
+# --- Symbolic execution ---
+class _State:
+    __slots__ = ("regs", "vars", "flag", "settings", "ticks", "events")
+
+    def __init__(self, regs, variables, flag, settings, ticks, events):
+        self.regs: Dict[str, Value] = regs
+        self.vars: Dict[str, Value] = variables
+        self.flag: Union[int, Tuple[Test, bool]] = flag
+        self.settings: Dict[str, Value] = settings
+        self.ticks: int = ticks  # as vm.ticks at the current instruction
+        self.events: Tuple = events  # thermal syncs so far, see _Reading
+
+    def copy(self) -> "_State":
+        return _State(dict(self.regs), dict(self.vars), self.flag, dict(self.settings),
+                      self.ticks, self.events)
+
+
+class DecisionTable:
+    """A pure program's device settings as a function of its sensor readings"""
+
+    def __init__(self, vm: AirConditionerVM, max_leaves: int = DEFAULT_MAX_LEAVES):
+        if not is_pure(vm.ops):
+            raise UnsupportedProgram("Program has loops or WAIT")
+        self.ops = vm.ops
+        self.weights = vm.weights
+        self.max_leaves = max_leaves
+        self._where = vm._where
+        self._leaves = 0
+        self.reset_state = AirConditionerVM()  # Sensor and device values at reset
+        self.readings: Dict[str, _Reading] = {}  # symbol -> thermal read
+        self._symbols: Dict[tuple, str] = {}
+        self.root: Node = self._explore(0, _State({}, {}, 0, {}, 0, ()), {})
+        self.rules: List[Rule] = list(self._flatten(self.root, {}, []))
+        # Sensors the table depends on
+        self.sensors = tuple(sorted(
+            {sensor for rule in self.rules for sensor, _, _ in rule.bounds}
+            | {test.sensor for rule in self.rules for test in rule.excluded}
+            | {self._sensor(symbol) for rule in self.rules for _, value in rule.leaf.settings
+               for symbol, _ in _linear(value)[1]}))
+
+    def _sensor(self, symbol: str) -> str:
+        return self.readings[symbol].sensor if symbol in self.readings else symbol
+
+    def _read(self, sensor: str, state: _State, pc: int) -> str:
+        """Symbol for a thermal read in this state"""
+        if any(isinstance(value, tuple) for _, _, value in state.events):
+            raise UnsupportedProgram(f"Thermal read after a computed SET_TEMP{self._where(pc)}")
+        if sensor == "TEMP" and any(field == "MODE" and value == 2
+                                    for _, field, value in state.events):
+            raise UnsupportedProgram(f"TEMP read while drying depends on HUMIDITY{self._where(pc)}")
+        key = (sensor, state.ticks, state.events)
+        if key not in self._symbols:
+            symbol = f"{sensor}@{state.ticks}"
+            while symbol in self.readings:
+                symbol += "'"
+            self._symbols[key] = symbol
+            self.readings[symbol] = _Reading(sensor, state.ticks, state.events)
+        return self._symbols[key]
+
+    def _explore(self, pc: int, state: _State, bounds: Dict[str, Interval]) -> Node:
+        ops = self.ops
+        regs = state.regs
+        while pc < len(ops):
+            name, args = ops[pc]
+            nxt = pc + 1
+            state.ticks += 1 if self.weights is None else self.weights[pc]
+            if name == "LOAD_IMM":
+                regs[args[0]] = args[1]
+            elif name == "LOAD":
+                regs[args[0]] = state.vars.get(args[1], 0)
+            elif name == "STORE":
+                state.vars[args[0]] = regs.get(args[1], 0)
+            elif name == "READ_SENSOR":
+                symbol = args[1]
+                if symbol in THERMAL_SENSORS:
+                    symbol = self._read(symbol, state, pc)
+                    state.events += ((state.ticks, None, None),)
+                regs[args[0]] = (0, ((symbol, 1),))
+            elif name in ("ADD", "SUB"):
+                regs[args[0]] = _combine(regs.get(args[1], 0), regs.get(args[2], 0),
+                                         1 if name == "ADD" else -1)
+            elif name == "INC":
+                regs[args[0]] = _combine(regs.get(args[0], 0), 1, 1)
+            elif name == "DEC":
+                regs[args[0]] = _combine(regs.get(args[0], 0), 1, -1)
+            elif name == "NEG":
+                regs[args[0]] = _scale(regs.get(args[1], 0), -1)
+            elif name == "MUL":
+                a, b = regs.get(args[1], 0), regs.get(args[2], 0)
+                if isinstance(a, int):
+                    regs[args[0]] = _scale(b, a)
+                elif isinstance(b, int):
+                    regs[args[0]] = _scale(a, b)
+                else:
+                    raise UnsupportedProgram(f"Product of two sensor readings{self._where(pc)}")
+            elif name == "DIV":
+                a, b = regs.get(args[1], 0), regs.get(args[2], 0)
+                if not (isinstance(a, int) and isinstance(b, int)):
+                    raise UnsupportedProgram(f"Division of a sensor reading{self._where(pc)}")
+                if b == 0:
+                    return self._leaf(state, "Division by zero" + self._where(pc))
+                regs[args[0]] = a // b
+            elif name.startswith("CMP_"):
+                result = _compare(name, _combine(regs.get(args[1], 0), regs.get(args[2], 0), -1))
+                if isinstance(result, bool):
+                    state.flag = regs[args[0]] = int(result)
+                else:
+                    # Only JZ/JNZ can use a symbolic result
+                    state.flag, regs[args[0]] = result, None
+            elif name in ("JZ", "JNZ"):
+                flag = state.flag
+                if isinstance(flag, int):
+                    taken = (flag == 0) == (name == "JZ")
+                    nxt = args[0] if taken else nxt
+                else:
+                    test, truth = flag
+                    # Where the flag is 1, JNZ jumps and JZ falls through
+                    on_true, on_false = (args[0], nxt) if name == "JNZ" else (nxt, args[0])
+                    inside, outside = (on_true, on_false) if truth else (on_false, on_true)
+                    return self._branch(test, inside, outside, state, bounds)
+            elif name == "JMP":
+                nxt = args[0]
+            elif name in DEVICE_WRITES:
+                field = DEVICE_WRITES[name]
+                value = regs.get(args[0], 0) if name == "SET_TEMP" else args[0]
+                _linear(value)
+                state.settings[field] = value
+                if name in THERMAL_WRITES:
+                    state.events += ((state.ticks, field, value),)
+            elif name == "PRINT":
+                state.events += ((state.ticks, None, None),)  # Syncs the thermal model
+            elif name == "HALT":
+                break
+            else:
+                raise UnsupportedProgram(f"Unsupported instruction: {name}{self._where(pc)}")
+            pc = nxt
+        return self._leaf(state, None)
+
+    def _branch(self, test: Test, inside_pc: int, outside_pc: int, state: _State,
+                bounds: Dict[str, Interval]) -> Node:
+        if test.sensor in self.readings:
+            test = self.readings[test.sensor].invert(test)
+        current = bounds.get(test.sensor, (None, None))
+        narrowed = _intersect(current, test)
+        if _empty(narrowed):
+            return self._explore(outside_pc, state, bounds)
+        if _covers(test, current):
+            return self._explore(inside_pc, state, bounds)
+        inside = self._explore(inside_pc, state.copy(), dict(bounds, **{test.sensor: narrowed}))
+        rest = _outside(current, test)
+        outside_bounds = bounds if rest is None else dict(bounds, **{test.sensor: rest})
+        outside = self._explore(outside_pc, state, outside_bounds)
+        return Branch(test, inside, outside)
+
+    def _leaf(self, state: _State, error: Optional[str]) -> Leaf:
+        self._leaves += 1
+        if self._leaves > self.max_leaves:
+            raise UnsupportedProgram(f"More than {self.max_leaves} paths")
+        settings = tuple((field, state.settings[field]) for field in SETTING_LABELS
+                         if field in state.settings)
+        for _, value in settings:
+            for symbol, _ in _linear(value)[1]:
+                reading = self.readings.get(symbol)
+                if reading is not None and reading.sensor == "HUMIDITY" and not reading.identity():
+                    raise UnsupportedProgram("Setting computed from HUMIDITY read while drying")
+        return Leaf(settings, error)
+
+    def _flatten(self, node: Node, bounds: Dict[str, Interval],
+                 excluded: List[Test]) -> Iterator[Rule]:
+        if isinstance(node, Leaf):
+            yield Rule(tuple((s, lo, hi) for s, (lo, hi) in sorted(bounds.items())
+                             if lo is not None or hi is not None),
+                       tuple(test for test in excluded
+                             if not _empty(_intersect(bounds.get(test.sensor, (None, None)), test))),
+                       node)
+            return
+        test = node.test
+        current = bounds.get(test.sensor, (None, None))
+        yield from self._flatten(node.inside, dict(bounds, **{test.sensor: _intersect(current, test)}),
+                                 excluded)
+        rest = _outside(current, test)
+        if rest is None:
+            yield from self._flatten(node.outside, bounds, excluded + [test])
+        else:
+            yield from self._flatten(node.outside, dict(bounds, **{test.sensor: rest}), excluded)
+
+    # --- Evaluation ---
+    def lookup(self, sensors: Dict[str, int]) -> Dict[str, int]:
+        """Device fields the program sets for one set of readings (others keep their reset value)"""
+        sensors = dict(self.reset_state.sensors, **sensors)
+        node = self.root
+        while isinstance(node, Branch):
+            test = node.test
+            value = sensors[test.sensor]
+            inside = ((test.lo is None or value >= test.lo)
+                      and (test.hi is None or value <= test.hi))
+            node = node.inside if inside else node.outside
+        if node.error is not None:
+            raise RuntimeError(node.error)
+        settings = {}
+        for field, value in node.settings:
+            const, terms = _linear(value)
+            for symbol, coeff in terms:
+                reading = self.readings.get(symbol)
+                const += coeff * (sensors[symbol] if reading is None
+                                  else reading.value(sensors[reading.sensor]))
+            settings[field] = const
+        return settings
+
+    def evaluate(self, readings: Dict[str, "object"],
+                 device: Optional[Dict[str, int]] = None) -> Dict[str, "object"]:
+        """
+        Device state arrays for arrays of readings (requires NumPy). Fields a
+        reading's rule doesn't set keep their value in `device` (default: a
+        reset VM's); sensors missing from readings take their reset value.
+        """
+        import numpy as np
+
+        defaults = self.reset_state
+        arrays = {name: np.asarray(values) for name, values in readings.items()}
+        size = len(next(iter(arrays.values()))) if arrays else 1
+        sensors = {name: arrays.get(name, np.full(size, defaults.sensors[name]))
+                   for name in self.sensors}
+        device = defaults.device_state if device is None else device
+        result = {field: np.full(size, value, dtype=np.int64) for field, value in device.items()}
+
+        for rule in self.rules:
+            mask = np.ones(size, dtype=bool)
+            for sensor, lo, hi in rule.bounds:
+                if lo is not None:
+                    mask &= sensors[sensor] >= lo
+                if hi is not None:
+                    mask &= sensors[sensor] <= hi
+            for test in rule.excluded:
+                values = sensors[test.sensor]
+                inside = np.ones(size, dtype=bool)
+                if test.lo is not None:
+                    inside &= values >= test.lo
+                if test.hi is not None:
+                    inside &= values <= test.hi
+                mask &= ~inside
+            if not mask.any():
+                continue
+            if rule.leaf.error is not None:
+                raise RuntimeError(rule.leaf.error)
+            for field, value in rule.leaf.settings:
+                const, terms = _linear(value)
+                computed = const
+                for symbol, coeff in terms:
+                    reading = self.readings.get(symbol)
+                    computed = computed + coeff * (
+                        sensors[symbol][mask] if reading is None
+                        else reading.array(sensors[reading.sensor][mask]))
+                result[field][mask] = computed
+        return result
+
+    # --- Display ---
+    def __str__(self) -> str:
+        return "\n".join(_format_rule(rule) for rule in self.rules)
+
+
+def _format_interval(sensor: str, lo: Optional[int], hi: Optional[int]) -> str:
+    if lo is not None and hi is not None:
+        return f"{sensor} = {lo}" if lo == hi else f"{lo} <= {sensor} <= {hi}"
+    return f"{sensor} >= {lo}" if lo is not None else f"{sensor} <= {hi}"
+
+
+def _format_value(field: str, value: Value) -> str:
+    if isinstance(value, int):
+        return SETTING_NAMES.get(field, {}).get(value, str(value))
+    const, terms = value
+    parts = [f"{'' if coeff == 1 else '-' if coeff == -1 else f'{coeff}*'}{sensor}"
+             for sensor, coeff in terms]
+    text = " + ".join(parts).replace("+ -", "- ")
+    return f"{text} + {const}".replace("+ -", "- ") if const else text
+
+
+def _format_rule(rule: Rule) -> str:
+    conditions = [_format_interval(sensor, lo, hi) for sensor, lo, hi in rule.bounds]
+    for test in rule.excluded:
+        conditions.append(f"{test.sensor} != {test.lo}" if test.lo == test.hi
+                          else f"not {_format_interval(test.sensor, test.lo, test.hi)}")
+    when = " ∧ ".join(conditions) or "always"
+    if rule.leaf.error is not None:
+        return f"{when} → error: {rule.leaf.error}"
+    settings = ", ".join(f"{SETTING_LABELS[field]} {_format_value(field, value)}"
+                         for field, value in rule.leaf.settings)
+    return f"{when} → {settings or 'no change'}"
+
+
+def evaluate_program(vm: AirConditionerVM, readings: Dict[str, "object"],
+                     max_steps: Optional[int] = 10000) -> Dict[str, "object"]:
+    """
+    DecisionTable(vm).evaluate(readings) when the program compiles to a
+    table, else the device state after running vm from reset once per
+    reading (with output discarded)
+    """
+    import numpy as np
+
+    try:
+        return DecisionTable(vm).evaluate(readings)
+    except UnsupportedProgram:
+        pass
+    arrays = {name: np.asarray(values) for name, values in readings.items()}
+    size = len(next(iter(arrays.values()))) if arrays else 1
+    result = {field: np.empty(size, dtype=np.int64) for field in vm.device_state}
+    output, vm.output = vm.output, QuietSink()
+    try:
+        for row in range(size):
+            vm.reset()
+            for name, values in arrays.items():
+                vm.set_sensor(name, int(values[row]))
+            vm.run(max_steps=max_steps)
+            for field, value in vm.device_state.items():
+                result[field][row] = value
+    finally:
+        vm.output = output
+    return result
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Print a program's sensor decision table.")
+    parser.add_argument("program", help="assembly, .thermo or bytecode file")
+    parser.add_argument("--optimize", action="store_true", help="analyse the optimized program")
+    args = parser.parse_args(argv)
+
+    vm = AirConditionerVM(optimize=args.optimize)
+    vm.load_file(args.program)
+    try:
+        table = DecisionTable(vm)
+    except UnsupportedProgram as e:
+        print(f"No decision table: {e}", file=sys.stderr)
+        return 1
+    print(table)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,328 @@
+"""
+Batch engine that runs one AirConditioner program across many rooms at once.
+
+Every piece of VM state is a NumPy array with one column (lane) per room.
+Each instruction executes once for all lanes sitting on it; lanes that branch
+differently at JZ/JNZ simply end up on different pcs and are stepped with
+per-lane masks, so each lane's final state matches a scalar AirConditionerVM.
+"""
+
+from typing import Dict, Optional, Union
+
+import numpy as np
+
+from airconditioner_vm import (
+    AirConditionerVM, AMBIENT_TEMP, BASE_REGISTERS, COOL_HEAT_RATE, DRIFT_RATE,
+    DRY_COOLING, DRY_FLOOR, FAN_BOOST, REGISTER_EFFECTS, TEMP_RANGE, THERMAL_SENSORS,
+)
+
+SENSOR_NAMES = ("TEMP", "HUMIDITY", "OCCUPIED", "TIME")
+DEVICE_NAMES = ("POWER_STATE", "MODE", "TARGET_TEMP", "FAN_SPEED", "SWING_STATE")
+
+TEMP, HUMIDITY, OCCUPIED, TIME = range(4)
+POWER_STATE, MODE, TARGET_TEMP, FAN_SPEED, SWING_STATE = range(5)
+
+DEVICE_OPS = {
+    "POWER": POWER_STATE,
+    "SET_MODE": MODE,
+    "SET_FAN": FAN_SPEED,
+    "SET_SWING": SWING_STATE,
+}
+
+ARITHMETIC = {
+    "ADD": np.add,
+    "SUB": np.subtract,
+    "MUL": np.multiply,
+}
+
+COMPARISONS = {
+    "CMP_EQ": np.equal,
+    "CMP_NE": np.not_equal,
+    "CMP_LT": np.less,
+    "CMP_LE": np.less_equal,
+    "CMP_GT": np.greater,
+    "CMP_GE": np.greater_equal,
+}
+
+
+class FleetVM:
+    """
+    Run the same program for `rooms` independent VMs in lockstep.
+    Values are int64, so programs must stay within 64-bit arithmetic.
+    PRINT and the HALT banner produce no output in batch mode.
+    """
+
+    def __init__(self, rooms: int, allocate_registers: bool = False, optimize: bool = False):
+        self.rooms = rooms
+        self.allocate_registers = allocate_registers
+        self.optimize = optimize
+        self.ops = []
+        self.weights = []
+        self.reg_slots: Dict[str, int] = {}
+        self.var_slots: Dict[str, int] = {}
+        self.regs = np.zeros((0, rooms), dtype=np.int64)
+        self.vars = np.zeros((0, rooms), dtype=np.int64)
+        self.stored = np.zeros((0, rooms), dtype=bool)
+        # Registers written per lane (T0-T9 always count, see AirConditionerVM)
+        self.written = np.zeros((0, rooms), dtype=bool)
+        self.reset()
+
+    def reset(self):
+        """Reset every lane to the initial VM state"""
+        rooms = self.rooms
+        self.regs[:] = 0
+        self.vars[:] = 0
+        self.stored[:] = False
+        self.written[:] = False
+        self._base_written()
+        reference = AirConditionerVM()
+        self.sensors = np.array(
+            [[reference.sensors[name]] * rooms for name in SENSOR_NAMES],
+            dtype=np.int64,
+        )
+        self.device_state = np.array(
+            [[reference.device_state[name]] * rooms for name in DEVICE_NAMES],
+            dtype=np.int64,
+        )
+        self.pc = np.zeros(rooms, dtype=np.int64)
+        self.halted = np.zeros(rooms, dtype=bool)
+        self.steps = np.zeros(rooms, dtype=np.int64)
+        self.ticks = np.zeros(rooms, dtype=np.int64)
+        self.last_cmp_result = np.zeros(rooms, dtype=np.int64)
+        self.temperature = self.sensors[TEMP].astype(np.float64)
+        self.humidity = self.sensors[HUMIDITY].astype(np.float64)
+        self.thermal_ticks = np.zeros(rooms, dtype=np.int64)
+
+    def load_program(self, source: str):
+        """Assemble with the scalar loader and size the lane arrays to match"""
+        assembler = AirConditionerVM(allocate_registers=self.allocate_registers,
+                                     optimize=self.optimize)
+        assembler.load_program(source)
+        self.ops = assembler.ops
+        self.weights = assembler.weights or [1] * len(self.ops)
+        self.reg_slots = assembler.reg_slots
+        self.var_slots = assembler.var_slots
+        self.regs = self._resize(self.regs, len(assembler.regs), np.int64)
+        self.vars = self._resize(self.vars, len(assembler.vars), np.int64)
+        self.stored = self._resize(self.stored, len(assembler.vars), bool)
+        self.written = self._resize(self.written, len(assembler.regs), bool)
+        self._base_written()
+        self._sync_thermal(slice(None))
+        self.pc[:] = 0
+        self.halted[:] = False
+        self.steps[:] = 0
+        self.ticks[:] = 0
+        self.thermal_ticks[:] = 0
+
+    def _base_written(self):
+        for name, slot in self.reg_slots.items():
+            if name in BASE_REGISTERS:
+                self.written[slot] = True
+
+    def _resize(self, array: np.ndarray, rows: int, dtype) -> np.ndarray:
+        grown = np.zeros((rows, self.rooms), dtype=dtype)
+        keep = min(rows, len(array))
+        grown[:keep] = array[:keep]
+        return grown
+
+    def set_sensor(self, sensor: str, value: Union[int, np.ndarray]):
+        """Set a sensor for all lanes (scalar) or per lane (array of length rooms)"""
+        sensor = sensor.upper()
+        if sensor not in SENSOR_NAMES:
+            raise ValueError(f"Unknown sensor: {sensor}")
+        self._sync_thermal(slice(None))
+        self.sensors[SENSOR_NAMES.index(sensor)] = value
+        if sensor == "TEMP":
+            self.temperature[:] = self.sensors[TEMP]
+        elif sensor == "HUMIDITY":
+            self.humidity[:] = self.sensors[HUMIDITY]
+
+    # --- Execution ---
+    def run(self, max_steps: Optional[int] = None):
+        """Run every lane until it halts or max_steps is reached"""
+        size = len(self.ops)
+        pc, halted, steps = self.pc, self.halted, self.steps
+        while True:
+            active = ~halted
+            off_end = active & ((pc < 0) | (pc >= size))
+            halted |= off_end
+            active &= ~off_end
+            if not active.any():
+                return
+            if max_steps is not None and (steps[active] >= max_steps).any():
+                raise RuntimeError("Step limit reached (possible infinite loop).")
+
+            # Step the lowest pc first so diverged lanes reconverge quickly
+            cur = int(pc[active].min())
+            lanes = active & (pc == cur)
+            idx = slice(None) if lanes.all() else np.flatnonzero(lanes)
+            steps[idx] += 1
+            self.ticks[idx] += self.weights[cur]
+            self._execute(cur, idx)
+
+    def _execute(self, cur: int, idx):
+        """Execute the instruction at cur for the selected lanes"""
+        name, args = self.ops[cur]
+        regs = self.regs
+        nxt = cur + 1
+        for i in REGISTER_EFFECTS.get(name, ((), ()))[0]:
+            self.written[self.reg_slots[args[i]], idx] = True
+
+        if name == "LOAD_IMM":
+            regs[self.reg_slots[args[0]], idx] = args[1]
+        elif name == "STORE":
+            var = self.var_slots[args[0]]
+            self.vars[var, idx] = regs[self.reg_slots[args[1]], idx]
+            self.stored[var, idx] = True
+        elif name == "LOAD":
+            # Unstored variables stay zero, matching variables.get(var, 0)
+            regs[self.reg_slots[args[0]], idx] = self.vars[self.var_slots[args[1]], idx]
+        elif name in ARITHMETIC:
+            rd, r1, r2 = (self.reg_slots[a] for a in args)
+            regs[rd, idx] = ARITHMETIC[name](regs[r1, idx], regs[r2, idx])
+        elif name == "DIV":
+            rd, r1, r2 = (self.reg_slots[a] for a in args)
+            divisor = regs[r2, idx]
+            if (divisor == 0).any():
+                raise RuntimeError("Division by zero")
+            regs[rd, idx] = np.floor_divide(regs[r1, idx], divisor)
+        elif name == "INC":
+            regs[self.reg_slots[args[0]], idx] += 1
+        elif name == "DEC":
+            regs[self.reg_slots[args[0]], idx] -= 1
+        elif name == "NEG":
+            regs[self.reg_slots[args[0]], idx] = -regs[self.reg_slots[args[1]], idx]
+        elif name in COMPARISONS:
+            rd, r1, r2 = (self.reg_slots[a] for a in args)
+            result = COMPARISONS[name](regs[r1, idx], regs[r2, idx]).astype(np.int64)
+            regs[rd, idx] = result
+            self.last_cmp_result[idx] = result
+        elif name == "JZ":
+            self.pc[idx] = np.where(self.last_cmp_result[idx] == 0, args[0], nxt)
+            return
+        elif name == "JNZ":
+            self.pc[idx] = np.where(self.last_cmp_result[idx] != 0, args[0], nxt)
+            return
+        elif name == "JMP":
+            self.pc[idx] = args[0]
+            return
+        elif name == "READ_SENSOR":
+            if args[1] in THERMAL_SENSORS:
+                self._sync_thermal(idx)
+            regs[self.reg_slots[args[0]], idx] = self.sensors[SENSOR_NAMES.index(args[1]), idx]
+        elif name == "WAIT":
+            wait_time = regs[self.reg_slots[args[0]], idx]
+            self.sensors[TIME, idx] = np.mod(self.sensors[TIME, idx] + wait_time, 86400)
+            self.ticks[idx] += wait_time
+        elif name in DEVICE_OPS:
+            if name != "SET_SWING":
+                self._sync_thermal(idx)
+            self.device_state[DEVICE_OPS[name], idx] = args[0]
+        elif name == "SET_TEMP":
+            self._sync_thermal(idx)
+            self.device_state[TARGET_TEMP, idx] = regs[self.reg_slots[args[0]], idx]
+        elif name == "PRINT":
+            # Batch mode is silent, but the scalar VM settles the model here
+            self._sync_thermal(idx)
+        elif name == "HALT":
+            self.halted[idx] = True
+            return
+        self.pc[idx] = nxt
+
+    def _sync_thermal(self, idx):
+        """Vectorised AirConditionerVM._sync_thermal for the selected lanes"""
+        lanes = np.arange(self.rooms)[idx]
+        elapsed = self.ticks[lanes] - self.thermal_ticks[lanes]
+        self.thermal_ticks[lanes] = self.ticks[lanes]
+        due = elapsed > 0
+        if due.any():
+            self._advance_thermal(lanes[due], elapsed[due])
+
+    def _advance_thermal(self, lanes: np.ndarray, seconds: np.ndarray):
+        """Vectorised AirConditionerVM._advance_thermal, lane by lane elapsed ticks"""
+        device = self.device_state[:, lanes]
+        power, mode = device[POWER_STATE], device[MODE]
+        target = device[TARGET_TEMP].astype(np.float64)
+        temp = self.temperature[lanes]
+        humidity = self.humidity[lanes]
+        new_temp = temp.copy()
+
+        drift = (power == 0) | (mode == 3)
+        if drift.any():
+            # Python's float ** int, so lanes agree bit for bit with the scalar VM
+            exponents, inverse = np.unique(seconds[drift], return_inverse=True)
+            decay = np.array([(1 - DRIFT_RATE) ** int(n) for n in exponents])[inverse]
+            new_temp[drift] = AMBIENT_TEMP + (temp[drift] - AMBIENT_TEMP) * decay
+
+        rate = COOL_HEAT_RATE * (1 + device[FAN_SPEED] * FAN_BOOST)
+        cool = ~drift & (mode == 0) & (temp > target)
+        new_temp[cool] = np.maximum(target[cool], temp[cool] - rate[cool] * seconds[cool])
+        heat = ~drift & (mode == 1) & (temp < target)
+        new_temp[heat] = np.minimum(target[heat], temp[heat] + rate[heat] * seconds[heat])
+        dry = ~drift & (mode == 2) & (humidity > DRY_FLOOR)
+        drying = np.minimum(seconds[dry], humidity[dry] - DRY_FLOOR)
+        humidity[dry] -= drying
+        new_temp[dry] = temp[dry] - DRY_COOLING * drying
+
+        low, high = TEMP_RANGE
+        new_temp = np.clip(new_temp, low, high)
+        self.temperature[lanes] = new_temp
+        self.humidity[lanes] = humidity
+        self.sensors[TEMP, lanes] = np.rint(new_temp).astype(np.int64)
+        self.sensors[HUMIDITY, lanes] = np.rint(humidity).astype(np.int64)
+
+    # --- Helpers ---
+    def state(self, lane: int) -> Dict:
+        """Get one lane's state in the same shape as AirConditionerVM.state()"""
+        self._sync_thermal([lane])
+        return {
+            "registers": {
+                name: int(self.regs[slot, lane]) for name, slot in self.reg_slots.items()
+                if self.written[slot, lane]
+            },
+            "variables": {
+                name: int(self.vars[slot, lane])
+                for name, slot in self.var_slots.items()
+                if self.stored[slot, lane]
+            },
+            "sensors": {
+                name: int(self.sensors[i, lane]) for i, name in enumerate(SENSOR_NAMES)
+            },
+            "device": {
+                name: int(self.device_state[i, lane]) for i, name in enumerate(DEVICE_NAMES)
+            },
+            "pc": int(self.pc[lane]),
+            "halted": bool(self.halted[lane]),
+            "steps": int(self.steps[lane]),
+            "ticks": int(self.ticks[lane]),
+        }
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+
+    if len(sys.argv) < 2:
+        print("Usage: python3 fleet_vm.py <program.asm> [rooms]")
+        sys.exit(1)
+
+    rooms = int(sys.argv[2]) if len(sys.argv) > 2 else 10000
+    with open(sys.argv[1], 'r') as f:
+        source = f.read()
+
+    rng = np.random.default_rng(0)
+    fleet = FleetVM(rooms)
+    fleet.load_program(source)
+    fleet.set_sensor("TEMP", rng.integers(15, 35, rooms))
+    fleet.set_sensor("HUMIDITY", rng.integers(30, 90, rooms))
+    fleet.set_sensor("OCCUPIED", rng.integers(0, 2, rooms))
+    fleet.set_sensor("TIME", rng.integers(0, 86400, rooms))
+
+    start = time.perf_counter()
+    fleet.run(max_steps=10000)
+    elapsed = time.perf_counter() - start
+
+    print(f"Rooms simulated: {rooms}")
+    print(f"Elapsed: {elapsed:.3f}s ({rooms / elapsed:,.0f} rooms/s)")
+    print(f"Total steps: {int(fleet.steps.sum())}")
+    print(f"Powered on: {int(fleet.device_state[POWER_STATE].sum())}")
@@ -0,0 +1,232 @@
+"""
+Superinstructions for the compiler's compare-and-branch idioms.
+
+thermolang.y compiles every condition to
+
+    READ_SENSOR Tx, S        (or LOAD Tx, var)
+    LOAD_IMM Ty, k
+    CMP_xx Tz, Tx, Ty
+    JZ L
+
+and every `repeat` to DEC / JNZ. At install time these sequences (and the
+shorter LOAD_IMM / CMP / Jcc and CMP / Jcc) get one handler that does the
+work of the whole sequence, so the interpreter dispatches once instead of up
+to four times. The assembly language, vm.ops and vm.code are unchanged; the
+fused handlers live in a separate table used by run() with the plain
+interpreter (not under the JIT, the profiler or the tracer).
+
+Effects are exactly those of the unfused instructions, in order: every
+register written, the compare flag, the thermal sync of a TEMP/HUMIDITY read
+at the same tick, and the instructions' ticks (optimizer weights included).
+A superinstruction counts as all of its steps. Near the end of a step budget
+run() goes back to single instructions, so max_steps still stops on exactly
+the same instruction. Entering a sequence anywhere but its first
+instruction runs the plain handlers.
+"""
+
+import operator
+import sys
+from typing import Callable, List, Optional, Tuple
+
+from airconditioner_vm import AirConditionerVM, THERMAL_SENSORS, StepLimitError
+
+COMPARES = {
+    "CMP_EQ": operator.eq, "CMP_NE": operator.ne,
+    "CMP_LT": operator.lt, "CMP_LE": operator.le,
+    "CMP_GT": operator.gt, "CMP_GE": operator.ge,
+}
+BRANCHES = ("JZ", "JNZ")
+# Longest sequence fused, in instructions
+MAX_WIDTH = 4
+
+Handler = Callable[[], int]
+
+
+class FusedProgram:
+    """Dispatch table of the program installed in one VM, with superinstructions"""
+
+    def __init__(self, vm: AirConditionerVM):
+        self.vm = vm
+        self.code: List[Handler] = list(vm.code)
+        # How many instructions code[pc] executes
+        self.widths = [1] * len(vm.ops)
+        for pc in range(len(vm.ops)):
+            built = _fuse(vm, pc)
+            if built is not None:
+                self.code[pc], self.widths[pc] = built
+        self.sites = sum(width > 1 for width in self.widths)
+
+    def run(self, limit: int):
+        """
+        AirConditionerVM.run on the fused table (limit -1 = no step limit);
+        within MAX_WIDTH steps of the end of the budget it goes back to
+        single instructions
+        """
+        vm = self.vm
+        code, widths = self.code, self.widths
+        size = len(code)
+        edge = sys.maxsize if limit < 0 else limit - MAX_WIDTH
+        pc = vm.pc
+        executed = 0
+        try:
+            while not vm.halted:
+                if executed > edge:
+                    if executed == limit:
+                        raise StepLimitError("Step limit reached (possible infinite loop).")
+                    if code is not vm.code:
+                        code, widths = vm.code, [1] * size
+                if not (0 <= pc < size):
+                    if pc < 0:  # Parked after a WAIT
+                        pc = ~pc
+                        break
+                    vm.halted = True
+                    break
+                executed += widths[pc]
+                vm.ticks += 1
+                pc = code[pc]()
+        finally:
+            vm.pc = ~pc if pc < 0 else pc
+            vm.steps += executed
+            vm.output.flush()
+
+
+def superinstructions(vm: AirConditionerVM) -> Optional[FusedProgram]:
+    """The fused dispatch table for the installed program, None when nothing fuses"""
+    fused = FusedProgram(vm)
+    return fused if fused.sites else None
+
+
+def _fuse(vm: AirConditionerVM, pc: int) -> Optional[Tuple[Handler, int]]:
+    """The superinstruction starting at pc, if the sequence there is one"""
+    names = [name for name, _ in vm.ops[pc:pc + MAX_WIDTH]]
+    names += [None] * (MAX_WIDTH - len(names))
+    # Longest match first
+    if names[0] in ("READ_SENSOR", "LOAD") and names[1] == "LOAD_IMM" \
+            and names[2] in COMPARES and names[3] in BRANCHES:
+        return _load_compare_branch(vm, pc), 4
+    if names[0] == "LOAD_IMM" and names[1] in COMPARES and names[2] in BRANCHES:
+        return _imm_compare_branch(vm, pc), 3
+    if names[0] in COMPARES and names[1] in BRANCHES:
+        return _compare_branch(vm, pc), 2
+    if names[0] == "DEC" and names[1] in BRANCHES:
+        return _dec_branch(vm, pc), 2
+    return None
+
+
+def _weights(vm: AirConditionerVM, pc: int, width: int) -> Tuple[int, int]:
+    """Ticks to add before the first instruction and after it (run() adds one)"""
+    weights = vm.weights[pc:pc + width] if vm.weights is not None else [1] * width
+    return weights[0] - 1, sum(weights[1:])
+
+
+def _exits(vm: AirConditionerVM, pc: int) -> Tuple[int, int]:
+    """(next pc when the flag is set, next pc when it is clear) for the branch at pc"""
+    name, (target,) = vm.ops[pc]
+    return (target, pc + 1) if name == "JNZ" else (pc + 1, target)
+
+
+def _compare(vm: AirConditionerVM, pc: int):
+    name, (rd, r1, r2) = vm.ops[pc]
+    slots = vm.reg_slots
+    return COMPARES[name], slots[rd], slots[r1], slots[r2]
+
+
+def _load_compare_branch(vm: AirConditionerVM, pc: int) -> Handler:
+    """READ_SENSOR/LOAD Tx; LOAD_IMM Ty, k; CMP_xx Tz, Ta, Tb; JZ/JNZ L"""
+    first, (reg, source) = vm.ops[pc]
+    _, (imm_reg, value) = vm.ops[pc + 1]
+    test, rd, r1, r2 = _compare(vm, pc + 2)
+    if_set, if_clear = _exits(vm, pc + 3)
+    before, after = _weights(vm, pc, 4)
+    regs, slots = vm.regs, vm.reg_slots
+    rx, ry = slots[reg], slots[imm_reg]
+    # The compiler's shape compares the loaded value with the constant;
+    # anything else reads the registers back after both writes
+    direct = (r1, r2) == (rx, ry) and rx != ry
+
+    if first == "LOAD":
+        variables, var = vm.vars, vm.var_slots[source]
+        def fetch():
+            loaded = variables[var]
+            return 0 if loaded is None else loaded
+    elif source in THERMAL_SENSORS:
+        def fetch():
+            vm._sync_thermal()
+            return vm.sensors[source]
+    else:
+        def fetch():
+            return vm.sensors[source]
+
+    if before or first == "LOAD" or source not in THERMAL_SENSORS:
+        def op():
+            vm.ticks += before
+            loaded = fetch()
+            vm.ticks += after
+            regs[rx] = loaded
+            regs[ry] = value
+            result = 1 if (test(loaded, value) if direct else test(regs[r1], regs[r2])) else 0
+            regs[rd] = result
+            vm.last_cmp_result = result
+            return if_set if result else if_clear
+    else:
+        # The common case, with the sensor read inlined
+        sync = vm._sync_thermal
+        def op():
+            sync()
+            loaded = vm.sensors[source]
+            vm.ticks += after
+            regs[rx] = loaded
+            regs[ry] = value
+            result = 1 if (test(loaded, value) if direct else test(regs[r1], regs[r2])) else 0
+            regs[rd] = result
+            vm.last_cmp_result = result
+            return if_set if result else if_clear
+    return op
+
+
+def _imm_compare_branch(vm: AirConditionerVM, pc: int) -> Handler:
+    """LOAD_IMM Ty, k; CMP_xx Tz, Ta, Tb; JZ/JNZ L"""
+    _, (imm_reg, value) = vm.ops[pc]
+    test, rd, r1, r2 = _compare(vm, pc + 1)
+    if_set, if_clear = _exits(vm, pc + 2)
+    before, after = _weights(vm, pc, 3)
+    extra = before + after
+    regs, ry = vm.regs, vm.reg_slots[imm_reg]
+    def op():
+        vm.ticks += extra
+        regs[ry] = value
+        result = 1 if test(regs[r1], regs[r2]) else 0
+        regs[rd] = result
+        vm.last_cmp_result = result
+        return if_set if result else if_clear
+    return op
+
+
+def _compare_branch(vm: AirConditionerVM, pc: int) -> Handler:
+    """CMP_xx Tz, Ta, Tb; JZ/JNZ L"""
+    test, rd, r1, r2 = _compare(vm, pc)
+    if_set, if_clear = _exits(vm, pc + 1)
+    before, after = _weights(vm, pc, 2)
+    extra = before + after
+    regs = vm.regs
+    def op():
+        vm.ticks += extra
+        result = 1 if test(regs[r1], regs[r2]) else 0
+        regs[rd] = result
+        vm.last_cmp_result = result
+        return if_set if result else if_clear
+    return op
+
+
+def _dec_branch(vm: AirConditionerVM, pc: int) -> Handler:
+    """DEC Tx; JZ/JNZ L (the branch tests the compare flag, as JNZ always does)"""
+    _, (reg,) = vm.ops[pc]
+    if_set, if_clear = _exits(vm, pc + 1)
+    before, after = _weights(vm, pc, 2)
+    extra = before + after
+    regs, rx = vm.regs, vm.reg_slots[reg]
+    def op():
+        vm.ticks += extra
+        regs[rx] -= 1
+        return if_set if vm.last_cmp_result else if_clear
+    return op
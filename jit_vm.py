@@ -0,0 +1,375 @@
+"""
+Basic-block JIT for the AirConditioner VM.
+
+The installed program is split into basic blocks at jump targets and after
+jumps/HALT, and the blocks are grouped into regions: the loops of the block
+graph (strongly connected components), or single blocks outside any loop.
+Code is interpreted one instruction at a time until one of a region's blocks
+has been entered HOT_THRESHOLD times; then the whole region is turned into
+Python source, compile()d and run as one function from then on. Inside it
+registers and the compare flag live in local variables (written back when
+control leaves the region), tick accounting is folded into constants, and the
+thermal model update before sensor reads and device changes is inlined.
+
+Compiled code checks the step budget before every block and hands control
+back to the interpreter when a block would not fit, so max_steps stops at
+exactly the same instruction as the interpreter. Results, output, steps and
+ticks are identical with the JIT on or off.
+"""
+
+import sys
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from airconditioner_vm import (
+    AMBIENT_TEMP, COOL_HEAT_RATE, DRIFT_RATE, DRY_COOLING, DRY_FLOOR, FAN_BOOST,
+    REG_OPERANDS, REGISTER_EFFECTS, TEMP_RANGE, THERMAL_SENSORS, StepLimitError,
+)
+
+HOT_THRESHOLD = 8
+
+COMPARE_SYMBOLS = {
+    "CMP_EQ": "==", "CMP_NE": "!=", "CMP_LT": "<",
+    "CMP_LE": "<=", "CMP_GT": ">", "CMP_GE": ">=",
+}
+ARITHMETIC_SYMBOLS = {"ADD": "+", "SUB": "-", "MUL": "*"}
+DEVICE_FIELDS = {"POWER": "POWER_STATE", "SET_MODE": "MODE", "SET_FAN": "FAN_SPEED"}
+JUMPS = ("JMP", "JZ", "JNZ")
+
+
+class _Fault(Exception):
+    """Raised by compiled code at a runtime error"""
+
+    def __init__(self, pc: int, executed: int, message: str):
+        super().__init__(message)
+        self.pc = pc                # instruction that failed
+        self.executed = executed    # steps run in the region, that one included
+        self.message = message
+
+
+class Region:
+    __slots__ = ("blocks", "function")
+
+    def __init__(self, blocks: List[Tuple[int, int]]):
+        self.blocks = blocks        # (start, end) pairs in program order
+        self.function: Optional[Callable[[int, int], Tuple[int, int]]] = None
+
+
+class Block:
+    __slots__ = ("start", "end", "entries", "region")
+
+    def __init__(self, start: int, end: int):
+        self.start = start
+        self.end = end
+        self.entries = 0
+        self.region: Optional[Region] = None
+
+
+class BlockCompiler:
+    """Basic blocks of the program installed in one VM, compiled by region once hot"""
+
+    def __init__(self, vm):
+        self.vm = vm
+        ops = vm.ops
+        size = len(ops)
+        leaders = {0}
+        for i, (name, args) in enumerate(ops):
+            if name in JUMPS or name == "HALT":
+                leaders.add(i + 1)
+            if name in JUMPS:
+                leaders.add(args[0])
+        starts = sorted(pc for pc in leaders if pc < size)
+        self.blocks: Dict[int, Block] = {
+            start: Block(start, end)
+            for start, end in zip(starts, starts[1:] + [size])
+        }
+        for component in _loops(self.blocks, ops):
+            region = Region([(start, self.blocks[start].end) for start in sorted(component)])
+            for start in component:
+                self.blocks[start].region = region
+
+    def run(self, limit: int):
+        """AirConditionerVM.run with hot regions compiled (limit -1 = no step limit)"""
+        vm = self.vm
+        code = vm.code
+        size = len(code)
+        blocks = self.blocks
+        pc = vm.pc
+        executed = 0
+        try:
+            while not vm.halted:
+                if executed == limit:
+                    raise StepLimitError("Step limit reached (possible infinite loop).")
+                if not (0 <= pc < size):
+                    if pc < 0:  # Parked after a WAIT
+                        pc = ~pc
+                        break
+                    vm.halted = True
+                    break
+                block = blocks.get(pc)
+                if block is not None:
+                    region = block.region
+                    function = region.function
+                    if function is None:
+                        block.entries += 1
+                        if block.entries >= HOT_THRESHOLD:
+                            function = region.function = self.compile(region)
+                    if function is not None:
+                        budget = sys.maxsize if limit < 0 else limit - executed
+                        try:
+                            pc, count = function(pc, budget)
+                        except _Fault as fault:
+                            pc = fault.pc
+                            executed += fault.executed
+                            raise RuntimeError(fault.message + vm._where(fault.pc)) from None
+                        if count:
+                            executed += count
+                            continue
+                executed += 1
+                vm.ticks += 1
+                pc = code[pc]()
+        finally:
+            vm.pc = ~pc if pc < 0 else pc
+            vm.steps += executed
+
+    def compile(self, region: Region) -> Callable[[int, int], Tuple[int, int]]:
+        """Compile a region into a function (pc, budget) -> (next pc, steps run)"""
+        source = region_source(self.vm, region.blocks)
+        first, last = region.blocks[0][0], region.blocks[-1][1] - 1
+        namespace: Dict = {}
+        exec(compile(source, f"<region {first}-{last}>", "exec"), namespace)
+        vm = self.vm
+        return namespace["make"](vm, vm.regs, vm.vars, _Fault)
+
+
+def _loops(blocks: Dict[int, Block], ops) -> List[Set[int]]:
+    """Strongly connected components of the block graph (Tarjan, iterative)"""
+    edges: Dict[int, List[int]] = {}
+    for start, block in blocks.items():
+        name, args = ops[block.end - 1]
+        targets = []
+        if name in JUMPS:
+            targets.append(args[0])
+        if name not in ("JMP", "HALT"):
+            targets.append(block.end)
+        edges[start] = [t for t in targets if t in blocks]
+
+    index: Dict[int, int] = {}
+    low: Dict[int, int] = {}
+    stack: List[int] = []
+    on_stack: Set[int] = set()
+    components: List[Set[int]] = []
+    for root in blocks:
+        if root in index:
+            continue
+        work = [(root, iter(edges[root]))]
+        index[root] = low[root] = len(index)
+        stack.append(root)
+        on_stack.add(root)
+        while work:
+            node, children = work[-1]
+            for child in children:
+                if child not in index:
+                    index[child] = low[child] = len(index)
+                    stack.append(child)
+                    on_stack.add(child)
+                    work.append((child, iter(edges[child])))
+                    break
+                if child in on_stack:
+                    low[node] = min(low[node], index[child])
+            else:
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    low[parent] = min(low[parent], low[node])
+                if low[node] == index[node]:
+                    component = set()
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        component.add(member)
+                        if member == node:
+                            break
+                    components.append(component)
+    return components
+
+
+def _register_kinds(name: str) -> List[Optional[str]]:
+    """Per operand: "def" for a written register, "use" for a read one, else None"""
+    defs, _ = REGISTER_EFFECTS.get(name, ((), ()))
+    kinds: List[Optional[str]] = [None] * 3
+    for i in REG_OPERANDS[name]:
+        kinds[i] = "def" if i in defs else "use"
+    return kinds
+
+
+def _thermal_lines() -> List[str]:
+    """
+    AirConditionerVM._sync_thermal/_advance_thermal inlined, with min/max
+    spelled as conditionals that pick the same operand, so results are
+    bit-for-bit the same
+    """
+    low, high = TEMP_RANGE
+    return [
+        "elapsed = ticks - vm.thermal_ticks",
+        "vm.thermal_ticks = ticks",
+        "if elapsed > 0:",
+        "    device = vm.device_state",
+        "    mode = device['MODE']",
+        "    temp = vm.temperature",
+        "    humidity = vm.humidity",
+        "    if device['POWER_STATE'] == 0 or mode == 3:",
+        f"        temp = {AMBIENT_TEMP!r} + (temp - {AMBIENT_TEMP!r}) * {1 - DRIFT_RATE!r} ** elapsed",
+        "    elif mode == 0:",
+        "        target = device['TARGET_TEMP']",
+        "        if temp > target:",
+        f"            moved = temp - {COOL_HEAT_RATE!r} * (1 + device['FAN_SPEED'] * {FAN_BOOST!r}) * elapsed",
+        "            temp = moved if moved > target else target",
+        "    elif mode == 1:",
+        "        target = device['TARGET_TEMP']",
+        "        if temp < target:",
+        f"            moved = temp + {COOL_HEAT_RATE!r} * (1 + device['FAN_SPEED'] * {FAN_BOOST!r}) * elapsed",
+        "            temp = moved if moved < target else target",
+        "    elif mode == 2:",
+        f"        if humidity > {DRY_FLOOR!r}:",
+        f"            excess = humidity - {DRY_FLOOR!r}",
+        "            drying = excess if excess < elapsed else elapsed",
+        "            humidity -= drying",
+        f"            temp -= {DRY_COOLING!r} * drying",
+        f"    temp = temp if temp < {high!r} else {high!r}",
+        f"    temp = temp if temp > {low!r} else {low!r}",
+        "    vm.temperature = temp",
+        "    vm.humidity = humidity",
+        "    sensors = vm.sensors",
+        "    sensors['TEMP'] = round(temp)",
+        "    sensors['HUMIDITY'] = round(humidity)",
+    ]
+
+
+def region_source(vm, blocks: List[Tuple[int, int]]) -> str:
+    """Python source for a region of the program installed in vm"""
+    reg_slots, var_slots = vm.reg_slots, vm.var_slots
+    weights = vm.weights
+    thermal = _thermal_lines()
+    used: Set[int] = set()
+    written: Set[int] = set()
+    for start, end in blocks:
+        for name, args in vm.ops[start:end]:
+            for i, kind in enumerate(_register_kinds(name)):
+                if kind:
+                    used.add(reg_slots[args[i]])
+                if kind == "def":
+                    written.add(reg_slots[args[i]])
+
+    def leave(indent: str, pending: str) -> List[str]:
+        lines = [f"{indent}regs[{slot}] = r{slot}" for slot in sorted(written)]
+        lines.append(f"{indent}vm.last_cmp_result = flag")
+        lines.append(f"{indent}vm.ticks = ticks{pending}")
+        return lines
+
+    def block_body(start: int, end: int, indent: str) -> List[str]:
+        body: List[str] = [f"if executed + {end - start} > budget:", "    break"]
+        pending = 0
+
+        def flush():
+            nonlocal pending
+            if pending:
+                body.append(f"ticks += {pending}")
+                pending = 0
+
+        def sync():
+            flush()
+            body.extend(thermal)
+
+        next_pc = str(end)
+        for pc in range(start, end):
+            name, args = vm.ops[pc]
+            pending += weights[pc] if weights is not None else 1
+            r = [f"r{reg_slots[a]}" if kind else None
+                 for a, kind in zip(args, _register_kinds(name))]
+            if name == "LOAD_IMM":
+                body.append(f"{r[0]} = {args[1]!r}")
+            elif name == "STORE":
+                # As the interpreter: a plain 0 for an UNWRITTEN register
+                body.append(f"vars[{var_slots[args[0]]}] = {r[1]} or 0")
+            elif name == "LOAD":
+                # Never-stored variables (None) read as 0
+                body.append(f"{r[0]} = vars[{var_slots[args[1]]}] or 0")
+            elif name in ARITHMETIC_SYMBOLS:
+                body.append(f"{r[0]} = {r[1]} {ARITHMETIC_SYMBOLS[name]} {r[2]}")
+            elif name == "DIV":
+                body.append(f"if {r[2]} == 0:")
+                body.extend(leave("    ", f" + {pending}"))
+                body.append(f"    raise Fault({pc}, executed + {pc - start + 1}, 'Division by zero')")
+                body.append(f"{r[0]} = {r[1]} // {r[2]}")
+            elif name in ("INC", "DEC"):
+                body.append(f"{r[0]} {'+' if name == 'INC' else '-'}= 1")
+            elif name == "NEG":
+                body.append(f"{r[0]} = -{r[1]}")
+            elif name in COMPARE_SYMBOLS:
+                body.append(f"flag = {r[0]} = 1 if {r[1]} {COMPARE_SYMBOLS[name]} {r[2]} else 0")
+            elif name == "READ_SENSOR":
+                if args[1] in THERMAL_SENSORS:
+                    sync()
+                body.append(f"{r[0]} = vm.sensors[{args[1]!r}]")
+            elif name == "WAIT":
+                body.extend([
+                    "sensors = vm.sensors",
+                    f"sensors['TIME'] = (sensors['TIME'] + {r[0]}) % 86400",
+                    f"ticks += {r[0]}",
+                ])
+                if vm.park_on_wait:
+                    flush()
+                    body.extend(leave("", ""))
+                    body.append(f"return {~(pc + 1)}, executed + {pc - start + 1}")
+                    return [indent + line for line in body]
+            elif name in DEVICE_FIELDS:
+                sync()
+                body.append(f"vm.device_state[{DEVICE_FIELDS[name]!r}] = {args[0]}")
+            elif name == "SET_TEMP":
+                sync()
+                body.append(f"vm.device_state['TARGET_TEMP'] = {r[0]} or 0")
+            elif name == "SET_SWING":
+                body.append(f"vm.device_state['SWING_STATE'] = {args[0]}")
+            elif name == "PRINT":
+                flush()
+                body.append("vm.ticks = ticks")
+                body.append(f"vm._emit_state({pc})")
+            elif name == "JMP":
+                next_pc = str(args[0])
+            elif name in ("JZ", "JNZ"):
+                test = "==" if name == "JZ" else "!="
+                next_pc = f"{args[0]} if flag {test} 0 else {pc + 1}"
+            elif name == "HALT":
+                body.extend(leave("", f" + {pending}"))
+                body.append("vm.output.halt(vm.ticks)")
+                body.append("vm.halted = True")
+                body.append(f"return {pc}, executed + {end - start}")
+                return [indent + line for line in body]
+        flush()
+        body.append(f"executed += {end - start}")
+        body.append(f"pc = {next_pc}")
+        return [indent + line for line in body]
+
+    def dispatch(lo: int, hi: int, indent: str) -> List[str]:
+        # Binary search on pc over the region's blocks
+        if hi - lo == 1:
+            start, end = blocks[lo]
+            return [f"{indent}if pc != {start}:", f"{indent}    break"] + block_body(start, end, indent)
+        mid = (lo + hi) // 2
+        return ([f"{indent}if pc < {blocks[mid][0]}:"] + dispatch(lo, mid, indent + "    ")
+                + [f"{indent}else:"] + dispatch(mid, hi, indent + "    "))
+
+    lines = [
+        "def make(vm, regs, vars, Fault):",
+        "    def region(pc, budget):",
+        "        ticks = vm.ticks",
+        "        flag = vm.last_cmp_result",
+        "        executed = 0",
+    ]
+    lines.extend(f"        r{slot} = regs[{slot}]" for slot in sorted(used))
+    lines.append("        while True:")
+    lines.extend(dispatch(0, len(blocks), "            "))
+    lines.extend(leave("        ", ""))
+    lines.append("        return pc, executed")
+    lines.append("    return region")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,248 @@
+"""
+Result memoization for pure AirConditioner programs.
+
+A program is pure when it has no WAIT and every jump goes forward, so each
+run from pc 0 executes every instruction at most once and ends. Such a run is a function of its inputs: the sensors the program reads,
+the registers and variables it reads before writing them and, if a JZ/JNZ
+can run before any CMP, the compare flag. The memo maps those input values
+to what the run did: the registers, variables, device fields and flag it
+wrote, its steps and ticks, where it stopped and whether it executed HALT.
+
+The thermal model keeps moving during a run, so each entry also records the
+ticks at which the run synced it (device changes, TEMP/HUMIDITY reads and
+PRINTs) with the value read or written there. A hit replays exactly those
+syncs, which reproduces the model and the PRINT records bit for bit, and
+checks every recorded read; if the room has drifted so a read comes out
+different, the hit is undone before any output is emitted and the program
+runs for real (counted as a miss, replacing the entry).
+"""
+
+from collections import OrderedDict
+from typing import Dict, List, Optional, Set, Tuple
+
+from airconditioner_vm import (
+    AirConditionerVM, THERMAL_SENSORS, StepLimitError, register_effects, successors,
+)
+from output_vm import CollectorSink
+
+DEFAULT_MEMO_SIZE = 1024
+
+JUMPS = ("JZ", "JNZ", "JMP")
+COMPARES = ("CMP_EQ", "CMP_NE", "CMP_LT", "CMP_LE", "CMP_GT", "CMP_GE")
+# Device writes that sync the thermal model first, and the field they set
+THERMAL_WRITES = {"POWER": "POWER_STATE", "SET_MODE": "MODE",
+                  "SET_TEMP": "TARGET_TEMP", "SET_FAN": "FAN_SPEED"}
+DEVICE_WRITES = dict(THERMAL_WRITES, SET_SWING="SWING_STATE")
+
+PRINT = "PRINT"
+
+# (tick offset, device field / thermal sensor / PRINT, value written / value read / pc)
+Event = Tuple[int, str, int]
+
+
+def is_pure(ops) -> bool:
+    """No WAIT and only forward jumps"""
+    for pc, (name, args) in enumerate(ops):
+        if name == "WAIT":
+            return False
+        if name in JUMPS and args[0] <= pc:
+            return False
+    return bool(ops)
+
+
+class Entry:
+    __slots__ = ("events", "checked", "regs", "vars", "device", "flag", "steps", "ticks",
+                 "pc", "halt")
+
+    def __init__(self, events, regs, variables, device, flag, steps, ticks, pc, halt):
+        self.events: Tuple[Event, ...] = events
+        # Whether a replay can fail (has thermal reads to check)
+        self.checked = any(field in THERMAL_SENSORS for _, field, _ in events)
+        self.regs: Tuple[Tuple[int, int], ...] = regs       # (slot, value) written
+        self.vars: Tuple[Tuple[int, int], ...] = variables
+        self.device: Tuple[Tuple[str, int], ...] = device
+        self.flag: Optional[int] = flag  # None when no CMP ran
+        self.steps = steps
+        self.ticks = ticks
+        self.pc = pc
+        self.halt = halt  # Ended on HALT (rather than running off the end)
+
+
+class ResultMemo:
+    """Bounded LRU of run results for one pure program, shared by its forks"""
+
+    def __init__(self, vm: AirConditionerVM, size: int = DEFAULT_MEMO_SIZE):
+        self.ops = vm.ops
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self.entries: "OrderedDict[tuple, Entry]" = OrderedDict()
+
+        ops = vm.ops
+        count = len(ops)
+        # Inputs live on entry: one backward pass, as every jump goes forward
+        live: List[Tuple[Set[str], Set[str], bool]] = [None] * (count + 1)
+        live[count] = (set(), set(), False)
+        for pc in reversed(range(count)):
+            name, args = ops[pc]
+            regs: Set[str] = set()
+            variables: Set[str] = set()
+            flag = False
+            for succ in successors(pc, ops[pc]):
+                regs |= live[succ][0]
+                variables |= live[succ][1]
+                flag = flag or live[succ][2]
+            defs, uses = register_effects(ops[pc])
+            regs.difference_update(defs)
+            regs.update(uses)
+            if name == "STORE":
+                variables.discard(args[0])
+            elif name == "LOAD":
+                variables.add(args[1])
+            if name in COMPARES:
+                flag = False
+            elif name in ("JZ", "JNZ"):
+                flag = True
+            live[pc] = (regs, variables, flag)
+        regs, variables, self.reads_flag = live[0]
+        self.reg_inputs = tuple(sorted({vm.reg_slots[r] for r in regs}))
+        self.var_inputs = tuple(sorted(vm.var_slots[v] for v in variables))
+        self.sensor_inputs = tuple(sorted({args[1] for name, args in ops
+                                           if name == "READ_SENSOR"}))
+
+        # What each instruction writes, by slot
+        self.reg_writes = [tuple(vm.reg_slots[reg] for reg in register_effects(op)[0])
+                           for op in ops]
+        self.var_writes = [vm.var_slots[args[0]] if name == "STORE" else None
+                           for name, args in ops]
+
+    def key(self, vm: AirConditionerVM) -> tuple:
+        regs, variables, sensors = vm.regs, vm.vars, vm.sensors
+        return (tuple(regs[slot] for slot in self.reg_inputs),
+                tuple(variables[slot] for slot in self.var_inputs),
+                tuple(sensors[name] for name in self.sensor_inputs),
+                vm.last_cmp_result if self.reads_flag else None)
+
+    def run(self, vm: AirConditionerVM, limit: int):
+        """run() from pc 0; limit is the step budget (-1 for none)"""
+        key = self.key(vm)
+        entry = self.entries.get(key)
+        if entry is not None and (limit == -1 or entry.steps <= limit) and self._replay(vm, entry):
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return
+        self.misses += 1
+        entry = self._record(vm, limit)
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def _replay(self, vm: AirConditionerVM, entry: Entry) -> bool:
+        """Apply a recorded run; False (with nothing changed) if a thermal read differs"""
+        start = vm.ticks
+        device, sensors, output = vm.device_state, vm.sensors, vm.output
+        printed = None
+        if entry.checked:
+            saved = (vm.temperature, vm.humidity, vm.thermal_ticks, dict(sensors), dict(device))
+            # PRINTs are held back until every read has checked out
+            printed = vm.output = CollectorSink()
+        try:
+            for offset, field, value in entry.events:
+                vm.ticks = start + offset
+                if field == PRINT:
+                    vm._emit_state(value)
+                    continue
+                if field != "SWING_STATE":
+                    vm._sync_thermal()
+                if field in THERMAL_SENSORS:
+                    if sensors[field] != value:
+                        vm.ticks = start
+                        (vm.temperature, vm.humidity, vm.thermal_ticks,
+                         sensors_before, device_before) = saved
+                        sensors.update(sensors_before)
+                        device.update(device_before)
+                        return False
+                else:
+                    device[field] = value
+        finally:
+            vm.output = output
+
+        regs, variables = vm.regs, vm.vars
+        for slot, value in entry.regs:
+            regs[slot] = value
+        for slot, value in entry.vars:
+            variables[slot] = value
+        device.update(entry.device)
+        if entry.flag is not None:
+            vm.last_cmp_result = entry.flag
+        vm.ticks = start + entry.ticks
+        vm.steps += entry.steps
+        vm.pc = entry.pc
+        vm.halted = True
+        try:
+            if printed is not None:
+                for record in printed.records:
+                    output.state(record)
+            if entry.halt:
+                vm.output.halt(vm.ticks)
+        finally:
+            vm.output.flush()
+        return True
+
+    def _record(self, vm: AirConditionerVM, limit: int) -> Entry:
+        """The interpreter loop of run(), noting the path and thermal syncs"""
+        code, ops = vm.code, self.ops
+        size = len(code)
+        start = vm.ticks
+        path: List[int] = []
+        events: List[Event] = []
+        pc = vm.pc
+        try:
+            while not vm.halted:
+                if len(path) == limit:
+                    raise StepLimitError("Step limit reached (possible infinite loop).")
+                if not (0 <= pc < size):
+                    vm.halted = True
+                    break
+                path.append(pc)
+                vm.ticks += 1
+                nxt = code[pc]()
+                name, args = ops[pc]
+                if name in DEVICE_WRITES:
+                    field = DEVICE_WRITES[name]
+                    events.append((vm.thermal_ticks - start, field, vm.device_state[field]))
+                elif name == "READ_SENSOR" and args[1] in THERMAL_SENSORS:
+                    events.append((vm.thermal_ticks - start, args[1], vm.sensors[args[1]]))
+                elif name == PRINT:
+                    events.append((vm.thermal_ticks - start, PRINT, pc))
+                pc = nxt
+        finally:
+            vm.pc = pc
+            vm.steps += len(path)
+            vm.output.flush()
+
+        reg_slots: Dict[int, None] = {}
+        var_slots: Dict[int, None] = {}
+        fields: Dict[str, None] = {}
+        flag = None
+        for at in path:
+            name = ops[at][0]
+            reg_slots.update(dict.fromkeys(self.reg_writes[at]))
+            if self.var_writes[at] is not None:
+                var_slots[self.var_writes[at]] = None
+            if name in DEVICE_WRITES:
+                fields[DEVICE_WRITES[name]] = None
+            elif name in COMPARES:
+                flag = vm.last_cmp_result
+        return Entry(
+            tuple(events),
+            tuple((slot, vm.regs[slot]) for slot in reg_slots),
+            tuple((slot, vm.vars[slot]) for slot in var_slots),
+            tuple((field, vm.device_state[field]) for field in fields),
+            flag, len(path), vm.ticks - start, pc,
+            bool(path) and ops[path[-1]][0] == "HALT")
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = self.misses = 0
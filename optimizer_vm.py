@@ -0,0 +1,521 @@
+#!/usr/bin/env python3
+"""
+Load-time optimizer for verified AirConditioner VM programs.
+
+Works on the (opcode, operands) list the loader builds and repeats these
+passes until nothing changes:
+- constant propagation and folding: arithmetic on known values, LOADs of
+  variables with a known value, compares whose flag is never tested, and
+  JZ/JNZ on a flag known at load time
+- copy propagation: a register read is redirected to the lowest-numbered
+  register known to hold the same value (a reloaded constant, a variable
+  LOADed right after it was STOREd, ...), which leaves the copy dead
+- dead register, dead compare and dead store elimination
+- jump threading through JMP chains, and removal of jumps to the next
+  instruction
+- removal of unreachable code
+
+Device, sensor and variable behaviour is unchanged, and so is time: every
+instruction carries a tick weight, and a removed instruction hands its tick
+to the instruction that always runs right after it. TIME, the thermal model
+and the tick counter therefore advance exactly as in the original program;
+only `steps` (and the work done per tick) goes down. A removal that can't
+hand its tick on like that (e.g. just before a label other code jumps to)
+is skipped. Registers are scratch space, so their final values may differ.
+"""
+
+import heapq
+import operator
+import sys
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Set, Tuple
+
+from airconditioner_vm import (
+    AirConditionerVM, FAN_MAP, Instr, MODE_MAP, Op, REGISTER_EFFECTS,
+    Register, live_registers, successors,
+)
+
+JUMPS = ("JMP", "JZ", "JNZ")
+ARITHMETIC = {"ADD": operator.add, "SUB": operator.sub, "MUL": operator.mul}
+COMPARES = {
+    "CMP_EQ": operator.eq, "CMP_NE": operator.ne,
+    "CMP_LT": operator.lt, "CMP_LE": operator.le,
+    "CMP_GT": operator.gt, "CMP_GE": operator.ge,
+}
+# Instructions whose only effect is writing their destination register
+PURE = ("LOAD_IMM", "LOAD", "ADD", "SUB", "MUL", "NEG", "INC", "DEC")
+# Sensors that can be read without touching the thermal model
+PASSIVE_SENSORS = ("OCCUPIED", "TIME")
+
+MAX_ROUNDS = 16
+# Registers nothing reads any more still hold their value and can stand in
+# for a later copy; this many of the most recent ones are tracked
+DEAD_WINDOW = 64
+
+# A value key: ("k", n) is the constant n, ("d", pc) the value instruction
+# pc produced the last time it ran. Equal keys mean equal values.
+Key = Tuple
+
+
+@dataclass
+class OptimizationReport:
+    """What the optimizer did to one program"""
+    original: int = 0           # instructions before
+    optimized: int = 0          # instructions after
+    folded: int = 0             # instructions rewritten as LOAD_IMM
+    copies: int = 0             # register reads redirected to an equal register
+    branches: int = 0           # JZ/JNZ turned into JMP (never-taken ones are removed)
+    threaded: int = 0           # jumps retargeted past a JMP
+    removed: Dict[str, int] = field(default_factory=dict)  # by reason
+    # Original index of each surviving instruction, for per-instruction metadata
+    origins: List[int] = field(default_factory=list, repr=False)
+
+    @property
+    def removed_total(self) -> int:
+        return self.original - self.optimized
+
+    def __str__(self) -> str:
+        reasons = ", ".join(f"{count} {reason}" for reason, count in sorted(self.removed.items()))
+        return (f"{self.original} -> {self.optimized} instructions "
+                f"({self.removed_total} removed{': ' + reasons if reasons else ''}); "
+                f"{self.folded} folded, {self.copies} copies propagated, "
+                f"{self.branches} branches decided, {self.threaded} jumps threaded")
+
+
+class _Facts:
+    """Value keys known to hold at one program point"""
+    __slots__ = ("regs", "vars", "flag")
+
+    def __init__(self, regs: Optional[Dict[Register, Key]] = None,
+                 vars: Optional[Dict[str, Key]] = None, flag: Optional[int] = None):
+        self.regs = regs if regs is not None else {}
+        self.vars = vars if vars is not None else {}
+        self.flag = flag
+
+    def copy(self) -> "_Facts":
+        return _Facts(dict(self.regs), dict(self.vars), self.flag)
+
+    def meet(self, other: "_Facts") -> "_Facts":
+        return _Facts(
+            {r: k for r, k in self.regs.items() if other.regs.get(r) == k},
+            {v: k for v, k in self.vars.items() if other.vars.get(v) == k},
+            self.flag if self.flag == other.flag else None,
+        )
+
+    def __eq__(self, other) -> bool:
+        return (self.regs == other.regs and self.vars == other.vars
+                and self.flag == other.flag)
+
+
+def _register_number(reg: Register) -> int:
+    return int(reg[1:])
+
+
+def _constant(key: Optional[Key]) -> Optional[int]:
+    return key[1] if key is not None and key[0] == "k" else None
+
+
+def _evaluate(pc: int, op: Op, facts: _Facts) -> Tuple[Dict[int, Optional[Key]], Optional[Key]]:
+    """
+    Apply op to facts in place. Returns the keys of the registers it reads
+    (by operand position) and the key of the value it writes, if any.
+    """
+    name, args = op
+    regs, variables = facts.regs, facts.vars
+    uses = REGISTER_EFFECTS.get(name, ((), ()))[1]
+    keys = {i: regs.get(args[i]) for i in uses}
+
+    def fresh() -> Key:
+        # pc ran again: anything still holding its previous value is stale
+        key = ("d", pc)
+        for table in (regs, variables):
+            for stale in [n for n, k in table.items() if k == key]:
+                del table[stale]
+        return key
+
+    result: Optional[Key] = None
+    if name == "LOAD_IMM":
+        result = ("k", args[1])
+    elif name == "LOAD":
+        result = variables.get(args[1]) or fresh()
+        variables[args[1]] = result
+    elif name == "STORE":
+        key = keys[1]
+        if key is None:
+            variables.pop(args[0], None)
+        else:
+            variables[args[0]] = key
+        return keys, None
+    elif name in ARITHMETIC or name == "DIV":
+        a, b = _constant(keys[1]), _constant(keys[2])
+        if a is not None and b is not None:
+            if name != "DIV":
+                result = ("k", ARITHMETIC[name](a, b))
+            elif b != 0:
+                result = ("k", a // b)
+    elif name == "NEG":
+        a = _constant(keys[1])
+        if a is not None:
+            result = ("k", -a)
+    elif name in ("INC", "DEC"):
+        a = _constant(keys[0])
+        if a is not None:
+            result = ("k", a + 1 if name == "INC" else a - 1)
+    elif name in COMPARES:
+        test = COMPARES[name]
+        a, b = _constant(keys[1]), _constant(keys[2])
+        flag = None
+        if a is not None and b is not None:
+            flag = 1 if test(a, b) else 0
+        elif keys[1] is not None and keys[1] == keys[2]:
+            flag = 1 if test(0, 0) else 0
+        facts.flag = flag
+        if flag is not None:
+            result = ("k", flag)
+    elif name != "READ_SENSOR":
+        return keys, None  # Jumps, device control, WAIT, PRINT, HALT
+
+    if result is None:
+        result = fresh()
+    regs.pop(args[0], None)  # Keep definition order for the dead window
+    regs[args[0]] = result
+    return keys, result
+
+
+def _control_flow(ops: List[Op]) -> Tuple[List[List[int]], List[List[int]]]:
+    size = len(ops)
+    succs = [[s for s in successors(i, op) if s < size] for i, op in enumerate(ops)]
+    preds: List[List[int]] = [[] for _ in ops]
+    for i, targets in enumerate(succs):
+        for s in targets:
+            preds[s].append(i)
+    return succs, preds
+
+
+def _reachable(ops: List[Op], succs: List[List[int]]) -> Set[int]:
+    seen: Set[int] = set()
+    stack = [0] if ops else []
+    while stack:
+        i = stack.pop()
+        if i not in seen:
+            seen.add(i)
+            stack.extend(succs[i])
+    return seen
+
+
+def _known_facts(ops: List[Op], succs: List[List[int]], preds: List[List[int]],
+                 live_out: List[Set[Register]]) -> List[Optional[_Facts]]:
+    """Forward dataflow: the facts that hold on entry to each instruction"""
+    facts_in: List[Optional[_Facts]] = [None] * len(ops)
+    facts_out: List[Optional[_Facts]] = [None] * len(ops)
+    if not ops:
+        return facts_in
+    # Nothing is known on entry: registers, variables and the flag may all
+    # carry over from whatever ran before
+    facts_in[0] = _Facts()
+    pending, queued = [0], {0}
+    while pending:
+        i = heapq.heappop(pending)
+        queued.discard(i)
+        out = facts_in[i].copy()
+        _evaluate(i, ops[i], out)
+        if len(out.regs) > len(live_out[i]) + DEAD_WINDOW:
+            live = live_out[i]
+            excess = len(out.regs) - len(live) - DEAD_WINDOW
+            for reg in [r for r in out.regs if r not in live][:excess]:
+                del out.regs[reg]
+        facts_out[i] = out
+        for s in succs[i]:
+            if s == 0:
+                continue
+            merged = None
+            for p in preds[s]:
+                if facts_out[p] is not None:
+                    merged = facts_out[p] if merged is None else merged.meet(facts_out[p])
+            if facts_in[s] is None or merged != facts_in[s]:
+                facts_in[s] = merged
+                if s not in queued:
+                    queued.add(s)
+                    heapq.heappush(pending, s)
+    return facts_in
+
+
+def _flag_liveness(ops: List[Op], succs: List[List[int]]) -> List[bool]:
+    """Whether a JZ/JNZ may test the compare flag after each instruction"""
+    live_in = [False] * len(ops)
+    live_out = [False] * len(ops)
+    changed = True
+    while changed:
+        changed = False
+        for i in reversed(range(len(ops))):
+            out = any(live_in[s] for s in succs[i])
+            name = ops[i][0]
+            if name in ("JZ", "JNZ"):
+                new_in = True
+            elif name in COMPARES:
+                new_in = False
+            else:
+                new_in = out
+            if new_in != live_in[i] or out != live_out[i]:
+                live_in[i], live_out[i] = new_in, out
+                changed = True
+    return live_out
+
+
+def _variable_liveness(ops: List[Op], succs: List[List[int]]) -> List[Set[str]]:
+    """Variables that may be read, or seen in the final state, after each instruction"""
+    size = len(ops)
+    names = {args[0] for name, args in ops if name == "STORE"}
+    names.update(args[1] for name, args in ops if name == "LOAD")
+    live_in: List[Set[str]] = [set() for _ in ops]
+    live_out: List[Set[str]] = [set() for _ in ops]
+    exits = [op[0] == "HALT" or any(s >= size for s in successors(i, op))
+             for i, op in enumerate(ops)]
+    changed = True
+    while changed:
+        changed = False
+        for i in reversed(range(size)):
+            out = set(names) if exits[i] else set()
+            for s in succs[i]:
+                out |= live_in[s]
+            name, args = ops[i]
+            if name == "STORE":
+                new_in = out - {args[0]}
+            elif name == "LOAD":
+                new_in = out | {args[1]}
+            else:
+                new_in = out
+            if new_in != live_in[i] or out != live_out[i]:
+                live_in[i], live_out[i] = new_in, out
+                changed = True
+    return live_out
+
+
+def _rewrite(ops: List[Op], facts_in: List[Optional[_Facts]], flag_live: List[bool],
+             report: OptimizationReport) -> Tuple[List[Op], Set[int]]:
+    """Constant folding, copy propagation and branch folding from the known facts"""
+    new_ops = list(ops)
+    drop: Set[int] = set()
+    for i, op in enumerate(ops):
+        facts = facts_in[i]
+        if facts is None:
+            continue  # Unreachable
+        name, args = op
+        holders: Dict[Key, Register] = {}
+        for reg, key in facts.regs.items():
+            best = holders.get(key)
+            if best is None or _register_number(reg) < _register_number(best):
+                holders[key] = reg
+        flag = facts.flag
+        keys, result = _evaluate(i, op, facts.copy())
+
+        if name in ("JZ", "JNZ") and flag is not None:
+            if (flag == 0) == (name == "JZ"):
+                new_ops[i] = ("JMP", args)
+                report.branches += 1
+            else:
+                drop.add(i)  # Never taken; counted once it is removed
+            continue
+
+        constant = _constant(result)
+        if constant is not None and name != "LOAD_IMM" and (
+                name not in COMPARES or not flag_live[i]):
+            new_ops[i] = ("LOAD_IMM", (args[0], constant))
+            report.folded += 1
+            continue
+
+        defs = REGISTER_EFFECTS.get(name, ((), ()))[0]
+        operands = list(args)
+        for position, key in keys.items():
+            if key is None or position in defs:
+                continue
+            holder = holders.get(key)
+            if holder is not None and holder != operands[position]:
+                operands[position] = holder
+                report.copies += 1
+        if operands != list(args):
+            new_ops[i] = (name, tuple(operands))
+    return new_ops, drop
+
+
+def _dead_code(ops: List[Op], succs: List[List[int]]) -> Dict[int, str]:
+    """Instructions whose results nothing observes, and jumps that go nowhere"""
+    live_out, _ = live_registers(ops)
+    flag_live = _flag_liveness(ops, succs)
+    var_live = _variable_liveness(ops, succs)
+    dead: Dict[int, str] = {}
+    for i, (name, args) in enumerate(ops):
+        if name in PURE or (name == "READ_SENSOR" and args[1] in PASSIVE_SENSORS):
+            if args[0] not in live_out[i]:
+                dead[i] = "dead"
+        elif name in COMPARES:
+            if args[0] not in live_out[i] and not flag_live[i]:
+                dead[i] = "dead"
+        elif name == "STORE":
+            if args[0] not in var_live[i]:
+                dead[i] = "dead store"
+        elif name in JUMPS and args[0] == i + 1:
+            dead[i] = "jump"
+    return dead
+
+
+def _thread_jumps(ops: List[Op], weights: List[int],
+                  report: OptimizationReport) -> Tuple[List[Op], List[int]]:
+    """Point jumps that land on a JMP straight at its target"""
+    new_ops, new_weights = list(ops), list(weights)
+    for i, (name, args) in enumerate(ops):
+        # A conditional jump would need the skipped JMP's ticks on its taken
+        # edge only, so only unconditional chains are threaded
+        if name != "JMP":
+            continue
+        target, seen = args[0], {i}
+        while target < len(ops) and ops[target][0] == "JMP" and target not in seen:
+            seen.add(target)
+            new_weights[i] += weights[target]
+            target = ops[target][1][0]
+            report.threaded += 1
+        if target != args[0]:
+            new_ops[i] = ("JMP", (target,))
+    return new_ops, new_weights
+
+
+def _compact(ops: List[Op], weights: List[int], labels: Dict[str, int],
+             drop: Dict[int, str], unreachable: Set[int],
+             report: OptimizationReport) -> Tuple[List[Op], List[int], Dict[str, int]]:
+    """
+    Remove unreachable instructions, and dropped ones whose ticks can move
+    to the instruction that always runs next; remap jumps and labels.
+    """
+    size = len(ops)
+    targets: Dict[int, int] = {}
+    for i, (name, args) in enumerate(ops):
+        if name in JUMPS and i not in unreachable:
+            targets[args[0]] = targets.get(args[0], 0) + 1
+
+    weights = list(weights)
+    removed = set(unreachable)
+    if unreachable:
+        report.removed["unreachable"] = report.removed.get("unreachable", 0) + len(unreachable)
+    after = size  # Next surviving instruction
+    for i in reversed(range(size)):
+        if i in unreachable:
+            continue
+        reason = drop.get(i)
+        if reason is not None and after < size:
+            name, args = ops[i]
+            own = args[0] if name in JUMPS else None
+            # Every instruction from i+1 up to the survivor must only be
+            # reachable by falling through from i
+            if all(targets.get(k, 0) == (1 if k == own else 0)
+                   for k in range(i + 1, after + 1)):
+                removed.add(i)
+                weights[after] += weights[i]
+                if own is not None:
+                    targets[own] -= 1
+                report.removed[reason] = report.removed.get(reason, 0) + 1
+                continue
+        after = i
+
+    if not removed:
+        return ops, weights, labels
+    remap = [0] * (size + 1)
+    position = len(ops) - len(removed)
+    remap[size] = position
+    for i in reversed(range(size)):
+        if i not in removed:
+            position -= 1
+        remap[i] = position if i not in removed else remap[i + 1]
+    new_ops: List[Op] = []
+    new_weights: List[int] = []
+    for i, (name, args) in enumerate(ops):
+        if i in removed:
+            continue
+        if name in JUMPS:
+            args = (remap[args[0]],)
+        new_ops.append((name, args))
+        new_weights.append(weights[i])
+    report.origins = [origin for i, origin in enumerate(report.origins) if i not in removed]
+    new_labels = {label: remap[target] for label, target in labels.items()}
+    return new_ops, new_weights, new_labels
+
+
+def optimize(ops: List[Op], labels: Dict[str, int],
+             weights: Optional[List[int]] = None
+             ) -> Tuple[List[Op], Dict[str, int], List[int], OptimizationReport]:
+    """
+    Optimize a verified program. Returns the new ops, remapped labels, the
+    ticks each instruction accounts for, and a report.
+    """
+    weights = list(weights) if weights is not None else [1] * len(ops)
+    labels = dict(labels)
+    report = OptimizationReport(original=len(ops), origins=list(range(len(ops))))
+    for _ in range(MAX_ROUNDS):
+        before = (ops, weights)
+        succs, preds = _control_flow(ops)
+        live_out, _ = live_registers(ops)
+        facts_in = _known_facts(ops, succs, preds, live_out)
+        ops, drop = _rewrite(ops, facts_in, _flag_liveness(ops, succs), report)
+        succs, _ = _control_flow(ops)
+        dead = _dead_code(ops, succs)
+        dead.update((i, "branch") for i in drop)
+        ops, weights = _thread_jumps(ops, weights, report)
+        succs, _ = _control_flow(ops)
+        unreachable = set(range(len(ops))) - _reachable(ops, succs)
+        ops, weights, labels = _compact(ops, weights, labels, dead, unreachable, report)
+        if (ops, weights) == before:
+            break
+    report.optimized = len(ops)
+    return ops, labels, weights, report
+
+
+MODE_NAMES = {value: name for name, value in MODE_MAP.items()}
+FAN_NAMES = {value: name for name, value in FAN_MAP.items()}
+
+
+def to_instructions(ops: List[Op], labels: Dict[str, int]) -> List[Instr]:
+    """Turn verified ops back into assembly instructions"""
+    names: Dict[int, str] = {}
+    for label, target in labels.items():
+        names.setdefault(target, label)
+    program = []
+    for name, args in ops:
+        if name in JUMPS:
+            text = (names[args[0]],)
+        elif name == "SET_MODE":
+            text = (MODE_NAMES[args[0]],)
+        elif name == "SET_FAN":
+            text = (FAN_NAMES[args[0]],)
+        elif name in ("POWER", "SET_SWING"):
+            text = ("ON" if args[0] else "OFF",)
+        else:
+            text = tuple(str(arg) for arg in args)
+        program.append(Instr(name, text))
+    return program
+
+
+def to_source(ops: List[Op], labels: Dict[str, int], weights: List[int]) -> str:
+    """Assembly listing of an optimized program, tick weights as comments"""
+    by_target: Dict[int, List[str]] = {}
+    for label, target in labels.items():
+        by_target.setdefault(target, []).append(label)
+    lines = []
+    for i, instr in enumerate(to_instructions(ops, labels)):
+        lines.extend(f"{label}:" for label in by_target.get(i, ()))
+        line = f"{instr.op} {', '.join(instr.args)}".rstrip()
+        if weights[i] > 1:
+            line = f"{line:<28}; {weights[i]} ticks"
+        lines.append(line)
+    lines.extend(f"{label}:" for label in by_target.get(len(ops), ()))
+    return "\n".join(lines) + "\n"
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Usage: python3 optimizer_vm.py <input.asm>")
+        sys.exit(1)
+    with open(sys.argv[1], 'r') as f:
+        source = f.read()
+    vm = AirConditionerVM(optimize=True)
+    vm.load_program(source)
+    print(f"; {vm.optimization}")
+    print(to_source(vm.ops, vm.labels, vm.weights), end="")
@@ -0,0 +1,181 @@
+"""
+Output sinks for the AirConditioner VM.
+
+PRINT hands the sink one StateRecord and HALT one halt event; what happens
+to them is up to the sink:
+- QuietSink drops everything (batch runs)
+- CollectorSink keeps the records in memory
+- TextSink writes the human-readable state block, buffered
+- JsonLinesSink and BinarySink write one structured record per event,
+  buffered
+
+Buffered sinks write in bulk once `buffer_size` events are pending; the VM
+flushes its sink when run() or step() returns, so output never lags behind
+the VM.
+"""
+
+import json
+import struct
+import sys
+from typing import IO, Iterator, List, NamedTuple, Optional, Tuple
+
+MODE_NAMES = ("COOL", "HEAT", "DRY", "FAN", "AUTO")
+FAN_NAMES = ("OFF", "LOW", "MID", "HIGH")
+
+HALT_BANNER = "*** Air Conditioner Program Halted ***\n"
+
+
+class StateRecord(NamedTuple):
+    """Device and sensor state at one PRINT"""
+    tick: int
+    pc: int
+    power: int
+    mode: int
+    target_temp: int
+    temp: int
+    fan: int
+    swing: int
+    humidity: int
+    occupied: int
+    time: int
+
+
+class OutputSink:
+    """Receives PRINT records and HALT events; the default does nothing"""
+
+    def state(self, record: StateRecord):
+        pass
+
+    def halt(self, tick: int):
+        pass
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.flush()
+
+
+QuietSink = OutputSink
+
+
+class CollectorSink(OutputSink):
+    """Keeps every record in memory"""
+
+    def __init__(self):
+        self.records: List[StateRecord] = []
+        self.halts: List[int] = []  # tick of each HALT
+
+    def state(self, record: StateRecord):
+        self.records.append(record)
+
+    def halt(self, tick: int):
+        self.halts.append(tick)
+
+    def clear(self):
+        self.records.clear()
+        self.halts.clear()
+
+
+class _BufferedSink(OutputSink):
+    """Encodes events and writes them to a stream in batches"""
+    empty = ""
+
+    def __init__(self, stream: Optional[IO] = None, buffer_size: int = 256):
+        # Without a stream, sys.stdout is looked up at write time so
+        # redirect_stdout and friends keep working
+        self.stream = stream
+        self.buffer_size = buffer_size
+        self.pending: list = []
+
+    def state(self, record: StateRecord):
+        self.pending.append(self.encode_state(record))
+        if len(self.pending) >= self.buffer_size:
+            self.flush()
+
+    def halt(self, tick: int):
+        self.pending.append(self.encode_halt(tick))
+        if len(self.pending) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            stream = self.stream or sys.stdout
+            stream.write(self.empty.join(self.pending))
+            self.pending.clear()
+            stream.flush()
+
+    def encode_state(self, record: StateRecord):
+        raise NotImplementedError
+
+    def encode_halt(self, tick: int):
+        raise NotImplementedError
+
+
+class TextSink(_BufferedSink):
+    """The human-readable state block, as a terminal user sees it"""
+
+    def encode_state(self, r: StateRecord) -> str:
+        return (
+            "=== Air Conditioner State ===\n"
+            f"Power: {'ON' if r.power else 'OFF'}\n"
+            f"Mode: {MODE_NAMES[r.mode]}\n"
+            f"Target Temp: {r.target_temp}°C\n"
+            f"Current Temp: {r.temp}°C\n"
+            f"Fan: {FAN_NAMES[r.fan]}\n"
+            f"Swing: {'ON' if r.swing else 'OFF'}\n"
+            f"Humidity: {r.humidity}%\n"
+            f"Occupied: {'YES' if r.occupied else 'NO'}\n"
+            f"Time: {r.time // 3600:02d}:{(r.time % 3600) // 60:02d}\n"
+            "============================\n"
+        )
+
+    def encode_halt(self, tick: int) -> str:
+        return HALT_BANNER
+
+
+class JsonLinesSink(_BufferedSink):
+    """One JSON object per event: {"event": "state", ...fields} or {"event": "halt", "tick": n}"""
+
+    def encode_state(self, record: StateRecord) -> str:
+        return json.dumps({"event": "state", **record._asdict()}, separators=(',', ':')) + "\n"
+
+    def encode_halt(self, tick: int) -> str:
+        return f'{{"event":"halt","tick":{tick}}}\n'
+
+
+# Binary record: u8 kind, u64 tick, u32 pc, then the nine state fields as
+# i64. Sensors and device fields take any int (set_sensor, SET_TEMP of a
+# computed register); values outside a field's range are saturated to it.
+BINARY_RECORD = struct.Struct("<BQI9q")
+KIND_STATE = 0
+KIND_HALT = 1
+# (low, high) per BINARY_RECORD field after the kind
+BINARY_RANGES = ((0, (1 << 64) - 1), (0, (1 << 32) - 1)) + ((-(1 << 63), (1 << 63) - 1),) * 9
+
+
+def _saturate(fields) -> List[int]:
+    return [min(max(value, low), high) for value, (low, high) in zip(fields, BINARY_RANGES)]
+
+
+class BinarySink(_BufferedSink):
+    """Fixed-size little-endian records (BINARY_RECORD), for a binary stream"""
+    empty = b""
+
+    def __init__(self, stream: IO, buffer_size: int = 256):
+        super().__init__(stream, buffer_size)
+
+    def encode_state(self, record: StateRecord) -> bytes:
+        try:
+            return BINARY_RECORD.pack(KIND_STATE, *record)
+        except struct.error:
+            return BINARY_RECORD.pack(KIND_STATE, *_saturate(record))
+
+    def encode_halt(self, tick: int) -> bytes:
+        return BINARY_RECORD.pack(KIND_HALT, *_saturate((tick,)), *[0] * 10)
+
+
+def read_binary(buffer) -> Iterator[Tuple[str, StateRecord]]:
+    """Decode BinarySink output into ("state" | "halt", record) pairs"""
+    for kind, *fields in BINARY_RECORD.iter_unpack(buffer):
+        yield ("halt" if kind == KIND_HALT else "state"), StateRecord(*fields)
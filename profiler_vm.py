@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""
+Execution profiler for the AirConditioner VM.
+
+vm.enable_profiler() wraps every pre-decoded handler so each execution bumps
+a counter and adds its wall time (time.perf_counter_ns) for that instruction
+address. Everything else is aggregated from those two arrays on demand:
+- per opcode
+- per instruction address
+- per label-delimited block (code before the first label is "(entry)")
+- per ThermoLang rule, inclusive of nested rules, from the "; RULE: name"
+  comments the compiler leaves in the assembly
+
+A profile exports as JSON or as collapsed stacks ("rule;block;OPCODE value"
+lines) for flame graph tools. With the profiler disabled the handlers are
+the plain ones, so it costs nothing.
+"""
+
+import argparse
+import json
+import sys
+from time import perf_counter_ns
+from typing import Callable, Dict, List, Optional
+
+from airconditioner_vm import AirConditionerVM
+
+ENTRY_BLOCK = "(entry)"
+
+Stats = Dict[str, int]  # {"count": executions, "time_ns": wall time}
+
+
+class Profiler:
+    """Counts and wall time per instruction address of the loaded program"""
+
+    def __init__(self, vm: AirConditionerVM):
+        self.vm = vm
+        self.counts: List[int] = [0] * len(vm.ops)
+        self.times: List[int] = [0] * len(vm.ops)
+
+    def wrap(self, pc: int, handler: Callable[[], int]) -> Callable[[], int]:
+        """Handler that records its own executions and time"""
+        counts, times, clock = self.counts, self.times, perf_counter_ns
+        def op():
+            counts[pc] += 1
+            start = clock()
+            nxt = handler()
+            times[pc] += clock() - start
+            return nxt
+        return op
+
+    def clear(self):
+        """Drop everything recorded so far"""
+        self.counts[:] = [0] * len(self.counts)
+        self.times[:] = [0] * len(self.times)
+
+    # --- Aggregations ---
+    def blocks(self) -> List[str]:
+        """Label-delimited block each instruction belongs to"""
+        names: Dict[int, str] = {}
+        for label, target in self.vm.labels.items():
+            names.setdefault(target, label)
+        block, out = ENTRY_BLOCK, []
+        for pc in range(len(self.counts)):
+            block = names.get(pc, block)
+            out.append(block)
+        return out
+
+    def total(self) -> Stats:
+        return {"count": sum(self.counts), "time_ns": sum(self.times)}
+
+    def by_address(self) -> List[Dict]:
+        """One entry per instruction, in program order"""
+        blocks = self.blocks()
+        return [{
+            "pc": pc,
+            "instruction": f"{instr.op} {', '.join(instr.args)}".rstrip(),
+            "block": blocks[pc],
+            "rules": list(self.vm.rules[pc]),
+            "count": self.counts[pc],
+            "time_ns": self.times[pc],
+        } for pc, instr in enumerate(self.vm.program)]
+
+    def by_opcode(self) -> Dict[str, Stats]:
+        return self._group(lambda pc: (self.vm.ops[pc][0],))
+
+    def by_block(self) -> Dict[str, Stats]:
+        blocks = self.blocks()
+        return self._group(lambda pc: (blocks[pc],))
+
+    def by_rule(self) -> Dict[str, Stats]:
+        """Inclusive: an instruction counts towards every rule enclosing it"""
+        return self._group(lambda pc: set(self.vm.rules[pc]))
+
+    def _group(self, keys: Callable[[int], object]) -> Dict[str, Stats]:
+        groups: Dict[str, Stats] = {}
+        for pc, (count, time_ns) in enumerate(zip(self.counts, self.times)):
+            for key in keys(pc):
+                stats = groups.setdefault(key, {"count": 0, "time_ns": 0})
+                stats["count"] += count
+                stats["time_ns"] += time_ns
+        return groups
+
+    # --- Export ---
+    def to_dict(self) -> Dict:
+        return {
+            "total": self.total(),
+            "opcodes": self.by_opcode(),
+            "blocks": self.by_block(),
+            "rules": self.by_rule(),
+            "addresses": self.by_address(),
+        }
+
+    def to_json(self, indent: Optional[int] = 2) -> str:
+        return json.dumps(self.to_dict(), indent=indent)
+
+    def collapsed(self, metric: str = "time") -> str:
+        """Collapsed stacks, "rule:outer;rule:inner;block;OPCODE value" per line"""
+        if metric not in ("time", "count"):
+            raise ValueError(f"Unknown metric: {metric}")
+        values = self.times if metric == "time" else self.counts
+        blocks = self.blocks()
+        stacks: Dict[str, int] = {}
+        for pc, value in enumerate(values):
+            if not value:
+                continue
+            frames = [f"rule:{rule}" for rule in self.vm.rules[pc]]
+            frames += [blocks[pc], self.vm.ops[pc][0]]
+            # ';' separates frames in this format
+            stack = ";".join(frame.replace(";", "_") for frame in frames)
+            stacks[stack] = stacks.get(stack, 0) + value
+        return "".join(f"{stack} {value}\n" for stack, value in stacks.items())
+
+    def report(self, top: int = 10) -> str:
+        """Human-readable summary, hottest entries first"""
+        total = self.total()
+        lines = [f"{total['count']} instructions executed in "
+                 f"{total['time_ns'] / 1e6:.3f} ms"]
+        sections = [("Opcodes", self.by_opcode()), ("Blocks", self.by_block()),
+                    ("Rules", self.by_rule())]
+        sections.append(("Addresses", {
+            f"{entry['pc']:>4}  {entry['instruction']}": entry
+            for entry in self.by_address()}))
+        for title, groups in sections:
+            if not groups:
+                continue
+            lines.append("")
+            lines.append(f"{title}:")
+            hottest = sorted(groups.items(), key=lambda item: -item[1]["time_ns"])
+            for name, stats in hottest[:top]:
+                share = stats["time_ns"] / total["time_ns"] if total["time_ns"] else 0.0
+                lines.append(f"  {stats['time_ns'] / 1e3:>10.1f} us {share:>6.1%} "
+                             f"{stats['count']:>10}x  {name}")
+        return "\n".join(lines)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Profile an AirConditioner program.")
+    parser.add_argument("program", help="assembly or bytecode file")
+    parser.add_argument("--sensor", action="append", default=[], metavar="NAME=VALUE",
+                        help="sensor value before running, e.g. TEMP=28 (repeatable)")
+    parser.add_argument("--max-steps", type=int, default=10000)
+    parser.add_argument("--optimize", action="store_true", help="profile the optimized program")
+    parser.add_argument("--top", type=int, default=10, help="entries per section in the report")
+    parser.add_argument("--json", help="write the full profile as JSON to this file")
+    parser.add_argument("--collapsed", help="write collapsed stacks to this file")
+    parser.add_argument("--metric", choices=("time", "count"), default="time",
+                        help="value of the collapsed stacks")
+    args = parser.parse_args(argv)
+
+    vm = AirConditionerVM(optimize=args.optimize)
+    vm.load_file(args.program)
+    for setting in args.sensor:
+        name, _, value = setting.partition("=")
+        vm.set_sensor(name, int(value))
+    profiler = vm.enable_profiler()
+    try:
+        vm.run(max_steps=args.max_steps)
+    except (RuntimeError, ValueError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+
+    print(profiler.report(args.top))
+    if args.json:
+        with open(args.json, 'w') as f:
+            f.write(profiler.to_json())
+    if args.collapsed:
+        with open(args.collapsed, 'w') as f:
+            f.write(profiler.collapsed(args.metric))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
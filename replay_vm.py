@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+Replay recorded sensor traces through an AirConditioner program.
+
+A trace is a stream of (tick, {sensor: value}) samples in tick order, read
+from CSV line by line or from a .npy file memory-mapped and converted one
+chunk of rows at a time. The program runs as a periodic control loop: every
+`period` ticks it starts again from pc 0, after the samples due by then have
+been applied (registers, variables and the device carry over between
+cycles). Between cycles time simply passes, as in a WAIT.
+
+replay() is a generator of DeviceChange records, one per device field that
+differs from the previous cycle, reported at the end of the cycle that made
+the change. Nothing is buffered beyond the current chunk, so memory stays
+flat however long the trace is.
+"""
+
+import argparse
+import csv
+import json
+import sys
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+from airconditioner_vm import AirConditionerVM, StepLimitError
+from output_vm import QuietSink
+
+Sample = Tuple[int, Dict[str, int]]
+
+TICK_COLUMN = "TICK"
+NPY_COLUMNS = (TICK_COLUMN, "TEMP", "HUMIDITY", "OCCUPIED")
+CHUNK_ROWS = 65536
+
+
+class DeviceChange(NamedTuple):
+    tick: int       # vm.ticks at the end of the cycle
+    time: int       # TIME sensor at that point
+    field: str      # device_state key
+    old: int
+    new: int
+
+
+def read_csv(path: str) -> Iterator[Sample]:
+    """
+    Samples from a CSV file with a header row: a "tick" column plus any of
+    TEMP, HUMIDITY, OCCUPIED, TIME (case-insensitive). Empty cells leave the
+    sensor unchanged.
+    """
+    with open(path, 'r', newline='') as f:
+        reader = csv.reader(f)
+        header = [name.strip().upper() for name in next(reader)]
+        if TICK_COLUMN not in header:
+            raise ValueError(f"Trace has no '{TICK_COLUMN.lower()}' column")
+        key = header.index(TICK_COLUMN)
+        sensors = [(i, name) for i, name in enumerate(header) if i != key]
+        for row in reader:
+            if not row:
+                continue
+            values = {name: int(float(row[i])) for i, name in sensors
+                      if i < len(row) and row[i].strip()}
+            yield int(float(row[key])), values
+
+
+def read_npy(path: str, columns: Sequence[str] = NPY_COLUMNS,
+             chunk_rows: int = CHUNK_ROWS) -> Iterator[Sample]:
+    """
+    Samples from a .npy file (requires NumPy): either a structured array
+    with a "tick" field, or a 2-D array whose columns are `columns`.
+    """
+    import numpy as np
+
+    data = np.load(path, mmap_mode='r')
+    if data.dtype.names:
+        names = [name.upper() for name in data.dtype.names]
+        fields = list(data.dtype.names)
+    else:
+        if data.ndim != 2 or data.shape[1] != len(columns):
+            raise ValueError(f"Expected {len(columns)} columns, got shape {data.shape}")
+        names, fields = [name.upper() for name in columns], None
+    if TICK_COLUMN not in names:
+        raise ValueError(f"Trace has no '{TICK_COLUMN.lower()}' column")
+    key = names.index(TICK_COLUMN)
+    sensors = [(i, name) for i, name in enumerate(names) if i != key]
+
+    for start in range(0, len(data), chunk_rows):
+        chunk = data[start:start + chunk_rows]
+        if fields is not None:
+            rows = zip(*(chunk[field].tolist() for field in fields))
+        else:
+            rows = chunk.tolist()
+        for row in rows:
+            yield int(row[key]), {name: int(row[i]) for i, name in sensors}
+
+
+def read_trace(path: str) -> Iterator[Sample]:
+    """read_npy for .npy files, read_csv otherwise"""
+    return read_npy(path) if path.endswith(".npy") else read_csv(path)
+
+
+def _idle(vm: AirConditionerVM, ticks: int):
+    """Let time pass between cycles, as a WAIT would"""
+    if ticks > 0:
+        vm.sensors["TIME"] = (vm.sensors["TIME"] + ticks) % 86400
+        vm.ticks += ticks
+
+
+def replay(vm: AirConditionerVM, trace: Iterable[Sample], period: int,
+           max_steps: Optional[int] = 10000,
+           until: Optional[int] = None) -> Iterator[DeviceChange]:
+    """
+    Run the program loaded in vm once per `period` ticks against the trace,
+    until the trace runs out (or `until` ticks, if given). max_steps bounds
+    each cycle: a cycle that reaches it ends there, and the next one starts
+    from pc 0 as usual. A cycle that overruns its period delays the next one.
+    """
+    if period <= 0:
+        raise ValueError("period must be positive")
+    samples = iter(trace)
+    sample = next(samples, None)
+    previous = dict(vm.device_state)
+    start = vm.ticks
+    while until is None or start < until:
+        _idle(vm, start - vm.ticks)
+        while sample is not None and sample[0] <= vm.ticks:
+            for sensor, value in sample[1].items():
+                vm.set_sensor(sensor, value)
+            sample = next(samples, None)
+
+        vm.pc, vm.halted = 0, False
+        try:
+            vm.run(max_steps=None if max_steps is None else vm.steps + max_steps)
+        except StepLimitError:
+            pass
+
+        device = vm.device_state
+        for field, value in device.items():
+            if previous[field] != value:
+                yield DeviceChange(vm.ticks, vm.sensors["TIME"], field, previous[field], value)
+        previous = dict(device)
+        if sample is None and until is None:
+            return
+        start += period
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Replay a sensor trace through an AirConditioner program.")
+    parser.add_argument("program", help="assembly or bytecode file")
+    parser.add_argument("trace", help="CSV (tick,TEMP,...) or .npy trace")
+    parser.add_argument("--period", type=int, default=60, help="ticks between control cycles")
+    parser.add_argument("--until", type=int, default=None, help="stop at this tick")
+    parser.add_argument("--max-steps", type=int, default=10000, help="step limit per cycle")
+    parser.add_argument("--optimize", action="store_true", help="run the optimized program")
+    parser.add_argument("--jit", action="store_true", help="compile hot loops (see jit_vm)")
+    parser.add_argument("--memo", type=int, default=0, metavar="N",
+                        help="remember up to N results of a pure program (see memo_vm)")
+    parser.add_argument("-o", "--output", help="JSON Lines output file (default: stdout)")
+    args = parser.parse_args(argv)
+
+    vm = AirConditionerVM(optimize=args.optimize, jit=args.jit, output=QuietSink(),
+                          memo_size=args.memo)
+    vm.load_file(args.program)
+    changes = replay(vm, read_trace(args.trace), args.period, args.max_steps, args.until)
+    out = open(args.output, 'w') if args.output else sys.stdout
+    try:
+        for change in changes:
+            out.write(json.dumps(change._asdict(), separators=(',', ':')) + '\n')
+    finally:
+        if args.output:
+            out.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,128 @@
+"""
+Discrete-event scheduler for many AirConditioner VMs on one simulated clock.
+
+Every controller is a VM built with park_on_wait=True. The scheduler keeps a
+heap of (wake-up time, ...) entries in simulated seconds and always resumes
+the earliest one; a VM runs until it executes a WAIT, HALTs, or uses up its
+step budget, and is then pushed back keyed by its own clock. Idle
+controllers cost nothing until they wake.
+
+A VM's clock is the time it was added plus its ticks (one per instruction,
+plus WAIT seconds), so the budget also bounds how far a slice can run ahead
+of the others.
+
+run_async() is the asyncio face of the same loop: it yields to the event
+loop between slices, and `await scheduler.at(t)` suspends a coroutine until
+the simulated clock reaches t, so external coroutines can inject sensor
+updates at precise simulated times.
+"""
+
+import asyncio
+import heapq
+import itertools
+from typing import Dict, List, Optional, Tuple
+
+from airconditioner_vm import AirConditionerVM, StepLimitError
+
+DEFAULT_BUDGET = 1000
+
+
+class Scheduler:
+    """Runs VMs in wake-up order on a shared simulated clock"""
+
+    def __init__(self, budget: int = DEFAULT_BUDGET):
+        self.budget = budget    # steps per slice
+        self.now: int = 0       # simulated seconds
+        self.vms: Dict[str, AirConditionerVM] = {}
+        self.errors: Dict[str, str] = {}  # VMs stopped by a runtime error
+        self.slices: int = 0
+        self._origins: Dict[str, int] = {}  # clock time at vm.ticks == 0
+        # (time, sequence, vm name or None, future or None); futures are at() timers
+        self._heap: List[Tuple[int, int, Optional[str], Optional[asyncio.Future]]] = []
+        self._sequence = itertools.count()
+
+    def add(self, vm: AirConditionerVM, name: Optional[str] = None,
+            at: Optional[int] = None) -> str:
+        """Schedule a loaded VM to start at simulated time `at` (default: now)"""
+        if not vm.park_on_wait:
+            raise ValueError("Scheduled VMs need park_on_wait=True")
+        name = name if name is not None else f"vm{len(self.vms)}"
+        if name in self.vms:
+            raise ValueError(f"Duplicate VM name: {name}")
+        at = self.now if at is None else at
+        self.vms[name] = vm
+        self._origins[name] = at - vm.ticks
+        if not vm.halted:
+            heapq.heappush(self._heap, (at, next(self._sequence), name, None))
+        return name
+
+    def clock(self, name: str) -> int:
+        """Simulated time the VM has reached"""
+        return self._origins[name] + self.vms[name].ticks
+
+    def set_sensor(self, name: str, sensor: str, value: int):
+        """Update a sensor of one VM; a parked VM sees it when it wakes"""
+        self.vms[name].set_sensor(sensor, value)
+
+    @property
+    def pending(self) -> int:
+        """Entries still queued (VMs and timers)"""
+        return len(self._heap)
+
+    def step(self) -> bool:
+        """Resume the earliest entry; False when nothing is left"""
+        if not self._heap:
+            return False
+        time, _, name, future = heapq.heappop(self._heap)
+        self.now = max(self.now, time)
+        if future is not None:
+            if not future.done():
+                future.set_result(time)
+            return True
+
+        vm = self.vms[name]
+        target = vm.steps + self.budget
+        try:
+            vm.run(max_steps=target)
+        except StepLimitError:
+            pass  # Slice over; requeue below
+        except (RuntimeError, ValueError) as e:
+            self.errors[name] = str(e)
+            return True
+        self.slices += 1
+        if not vm.halted:
+            heapq.heappush(self._heap, (self.clock(name), next(self._sequence), name, None))
+        return True
+
+    def run(self, until: Optional[int] = None):
+        """Process everything due up to `until` (default: until all VMs halt)"""
+        while self._heap and (until is None or self._heap[0][0] <= until):
+            self.step()
+        if until is not None:
+            self.now = max(self.now, until)
+
+    # --- asyncio ---
+    def at(self, time: int) -> "asyncio.Future":
+        """Future resolved (with the time) once the simulated clock reaches `time`"""
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._heap, (max(time, self.now), next(self._sequence), None, future))
+        return future
+
+    async def run_async(self, until: Optional[int] = None, slices_per_yield: int = 64):
+        """
+        run() that gives the event loop a turn every `slices_per_yield` slices
+        and right after each at() timer fires, so the coroutine awaiting it
+        acts before simulated time moves on
+        """
+        # Let coroutines started alongside register their timers first
+        await asyncio.sleep(0)
+        count = 0
+        while self._heap and (until is None or self._heap[0][0] <= until):
+            timer = self._heap[0][3] is not None
+            self.step()
+            count += 1
+            if timer or count >= slices_per_yield:
+                count = 0
+                await asyncio.sleep(0)
+        if until is not None:
+            self.now = max(self.now, until)
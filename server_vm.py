@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+"""
+Warm AirConditioner VM server.
+
+One long-running process answers run requests, so a caller that needs a
+handful of instructions several times a second doesn't pay for interpreter
+startup, imports and assembly on every call. Requests are JSON Lines, read
+from a Unix domain socket (any number of clients) or from stdin:
+
+    {"id": 7, "program": "zona.asm", "sensors": {"TEMP": 28}, "max_steps": 1000}
+
+- "program" is a path (assembly, .thermo or bytecode) or "hash" the key a
+  previous response returned; a hash unknown to the process is looked up in
+  the bytecode cache (see bytecode_vm.ProgramCache)
+- "sensors" are set after a reset, "max_steps" bounds the run (default
+  10000, at most the server's `step_limit`), "prints": true also returns
+  the PRINT records
+- a line holding a JSON array is a batch, answered by one array line with the
+  responses in order
+
+Every response carries the request's "id", the program "hash", the final
+vm.state() and "error" (null, or the message of the error that stopped the
+run); a request that can't be served at all gets just "id" and "error".
+{"op": "stats"} reports what the server holds.
+
+Each program is assembled once and kept as a warm VM (pre-decoded handlers,
+memo, JIT blocks), reset before every request; programs beyond
+`max_programs` are dropped least recently used first. A path is only
+rehashed when its size or modification time changes. On the socket, runs
+execute one at a time on a worker thread, so the event loop keeps accepting
+and reading clients while a run is under way.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import signal
+import socket
+import stat
+import sys
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import IO, Any, Dict, Optional, Tuple
+
+from airconditioner_vm import AirConditionerVM
+from bytecode_vm import SUFFIX, ProgramCache
+from output_vm import CollectorSink
+from sweep_vm import run_scenario
+
+DEFAULT_MAX_STEPS = 10000
+DEFAULT_STEP_LIMIT = 1000000  # Largest max_steps a request may ask for
+DEFAULT_MAX_PROGRAMS = 256
+# Longest request line accepted on the socket (batches can be large)
+LINE_LIMIT = 16 << 20
+
+Message = Dict[str, Any]
+
+
+class Server:
+    """Warm VMs by program hash, answering JSON requests"""
+
+    def __init__(self, cache_dir: Optional[str] = None, optimize: bool = False,
+                 jit: bool = False, memo_size: int = 0,
+                 max_programs: int = DEFAULT_MAX_PROGRAMS,
+                 step_limit: int = DEFAULT_STEP_LIMIT):
+        self.cache = ProgramCache(cache_dir)
+        self.optimize = optimize
+        self.jit = jit
+        self.memo_size = memo_size
+        self.max_programs = max_programs
+        self.step_limit = step_limit
+        self.programs: "OrderedDict[str, AirConditionerVM]" = OrderedDict()
+        self.paths: Dict[str, Tuple[Tuple[int, int], str]] = {}  # path -> ((mtime, size), hash)
+        self.requests = 0
+        self.loads = 0
+        # Runs on the socket; one worker, as warm VMs are shared by clients
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def _vm(self) -> AirConditionerVM:
+        return AirConditionerVM(optimize=self.optimize, jit=self.jit,
+                                output=CollectorSink(), memo_size=self.memo_size)
+
+    def _keep(self, key: str, vm: AirConditionerVM) -> AirConditionerVM:
+        self.loads += 1
+        self.programs[key] = vm
+        while len(self.programs) > self.max_programs:
+            self.programs.popitem(last=False)
+        return vm
+
+    def program(self, path: Optional[str] = None,
+                key: Optional[str] = None) -> Tuple[str, AirConditionerVM]:
+        """The warm VM for a program file or hash, loading it on first use"""
+        if path is not None:
+            info = os.stat(path)
+            stamp = (info.st_mtime_ns, info.st_size)
+            known = self.paths.get(path)
+            if known is not None and known[0] == stamp and known[1] in self.programs:
+                key = known[1]
+            else:
+                key, vm = self._load(path)
+                self.paths[path] = (stamp, key)
+                if key not in self.programs:
+                    self._keep(key, vm)
+        elif key is None:
+            raise ValueError("Request names no program")
+        elif key not in self.programs:
+            vm = self._vm()
+            try:
+                vm.load_bytecode(os.path.join(self.cache.directory, key + SUFFIX))
+            except (OSError, ValueError):
+                raise ValueError(f"Unknown program hash: {key}") from None
+            self._keep(key, vm)
+        self.programs.move_to_end(key)
+        return key, self.programs[key]
+
+    def _load(self, path: str) -> Tuple[str, Optional[AirConditionerVM]]:
+        """Hash a program file and, unless that program is already warm, load it"""
+        if path.endswith(".thermo"):
+            path = self.cache.compile(path)
+        # The bytecode cache key, so the hash also works after a restart
+        key = self.cache.file_key(path, self.optimize)
+        if key in self.programs:
+            return key, None
+        vm = self._vm()
+        self.cache.load_path(vm, path)
+        return key, vm
+
+    def run(self, request: Message) -> Message:
+        """Answer one run request"""
+        self.requests += 1
+        ident = request.get("id")
+        try:
+            key, vm = self.program(request.get("program"), request.get("hash"))
+            sensors = request.get("sensors") or {}
+            max_steps = request.get("max_steps", DEFAULT_MAX_STEPS)
+            if (not isinstance(max_steps, int) or isinstance(max_steps, bool)
+                    or not 0 < max_steps <= self.step_limit):
+                raise ValueError(f"max_steps must be an integer from 1 to {self.step_limit}")
+            vm.output.clear()
+            state, error = run_scenario(vm, sensors, max_steps)
+        except (OSError, RuntimeError, ValueError, TypeError, AttributeError) as e:
+            return {"id": ident, "error": str(e)}
+        response = {"id": ident, "hash": key, "state": state, "error": error}
+        if request.get("prints"):
+            response["prints"] = [record._asdict() for record in vm.output.records]
+        return response
+
+    def handle(self, message: Any) -> Any:
+        """Response to a decoded request line: a run, a batch or an op"""
+        if isinstance(message, list):
+            return [self.handle(item) for item in message]
+        if not isinstance(message, dict):
+            return {"id": None, "error": "Request must be a JSON object or array"}
+        if message.get("op") == "stats":
+            return {"id": message.get("id"), "programs": len(self.programs),
+                    "requests": self.requests, "loads": self.loads}
+        return self.run(message)
+
+    def handle_line(self, line: str) -> str:
+        try:
+            message = json.loads(line)
+        except ValueError as e:
+            return json.dumps({"id": None, "error": f"Bad JSON: {e}"}, separators=(',', ':'))
+        return json.dumps(self.handle(message), separators=(',', ':'))
+
+    # --- Transports ---
+    def serve_stream(self, infile: IO[str], outfile: IO[str]):
+        """Answer request lines from infile until EOF, one response line each"""
+        for line in infile:
+            if line.strip():
+                outfile.write(self.handle_line(line) + "\n")
+                outfile.flush()
+
+    async def serve_unix(self, path: str):
+        """Listen on a Unix domain socket until cancelled"""
+        try:
+            # Only a stale socket is replaced, never a regular file
+            if stat.S_ISSOCK(os.stat(path).st_mode):
+                os.unlink(path)
+        except FileNotFoundError:
+            pass
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        server = await asyncio.start_unix_server(self._client, path=path, limit=LINE_LIMIT)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+
+    async def _client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if line.strip():
+                    response = await loop.run_in_executor(self._executor, self.handle_line,
+                                                          line.decode())
+                    writer.write(response.encode() + b"\n")
+                    await writer.drain()
+        except (ConnectionError, ValueError, asyncio.CancelledError):
+            pass  # client went away, sent a line beyond LINE_LIMIT, or the server stopped
+        finally:
+            writer.close()
+
+
+class Client:
+    """Blocking client for a server on a Unix domain socket"""
+
+    def __init__(self, path: str):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(path)
+        self.file = self.sock.makefile("rwb")
+
+    def request(self, message: Any) -> Any:
+        """Send a request (or a list of them) and wait for the response"""
+        self.file.write(json.dumps(message, separators=(',', ':')).encode() + b"\n")
+        self.file.flush()
+        line = self.file.readline()
+        if not line:
+            raise ConnectionError("Server closed the connection")
+        return json.loads(line)
+
+    def close(self):
+        self.file.close()
+        self.sock.close()
+
+    def __enter__(self) -> "Client":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Serve AirConditioner VM runs from warm programs.")
+    parser.add_argument("--socket", help="Unix domain socket to listen on (default: stdin/stdout)")
+    parser.add_argument("--cache-dir", help="bytecode cache directory")
+    parser.add_argument("--optimize", action="store_true", help="run optimized programs")
+    parser.add_argument("--jit", action="store_true", help="compile hot loops (see jit_vm)")
+    parser.add_argument("--memo", type=int, default=0, metavar="N",
+                        help="memoize up to N results per pure program (see memo_vm)")
+    parser.add_argument("--max-programs", type=int, default=DEFAULT_MAX_PROGRAMS,
+                        help="warm programs kept in memory")
+    parser.add_argument("--step-limit", type=int, default=DEFAULT_STEP_LIMIT,
+                        help="largest max_steps a request may ask for")
+    args = parser.parse_args(argv)
+
+    server = Server(args.cache_dir, args.optimize, args.jit, args.memo, args.max_programs,
+                    args.step_limit)
+    if args.socket is None:
+        server.serve_stream(sys.stdin, sys.stdout)
+        return 0
+
+    async def serve():
+        # SIGTERM cancels the server, so the socket file is removed
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+        await server.serve_unix(args.socket)
+    try:
+        asyncio.run(serve())
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
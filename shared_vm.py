@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+"""
+Shared-memory state store for AirConditioner VMs spread over processes.
+
+StateStore lays out one fixed-width record per VM in a
+multiprocessing.shared_memory block:
+
+    header   magic, record count, register/variable counts, symbol table
+             length, stop flag, then the symbol table (JSON: register and
+             variable name -> column, interned once for every record)
+    ints     int64 per VM: pc, halted, steps, ticks, flag, thermal ticks,
+             error, inbox mask, 4 sensors, 5 device fields, 4 inbox values,
+             registers, variables, variable-set flags, register-written
+             flags
+    floats   float64 per VM: temperature, humidity (thermal model)
+
+The records are the state of truth. A worker copies a record into its VM,
+runs one budgeted slice and writes it back; those are flat array copies, so
+nothing is pickled and the VM keeps its plain-list fast path. SharedFleet
+runs all workers in lockstep rounds, so between rounds the coordinator sees
+one consistent state and reads it straight from shared memory. Sensor
+updates go through a per-record inbox that the owning worker applies with
+set_sensor() at the start of its next slice, keeping the thermal model exact.
+"""
+
+import json
+import multiprocessing
+import struct
+import sys
+import threading
+from array import array
+from multiprocessing import shared_memory
+from typing import Dict, List, Optional
+
+from airconditioner_vm import UNWRITTEN, AirConditionerVM, StepLimitError
+from output_vm import QuietSink
+
+MAGIC = b"ACSM"
+HEADER = struct.Struct("<4sIIIIB")
+HEADER_SIZE = 64  # Header struct padded, the symbol table follows
+
+SENSOR_NAMES = ("TEMP", "HUMIDITY", "OCCUPIED", "TIME")
+DEVICE_NAMES = ("POWER_STATE", "MODE", "TARGET_TEMP", "FAN_SPEED", "SWING_STATE")
+
+# Fixed int64 columns of a record
+PC, HALTED, STEPS, TICKS, FLAG, THERMAL_TICKS, ERROR, INBOX_MASK = range(8)
+SENSORS = 8
+DEVICE = SENSORS + len(SENSOR_NAMES)
+INBOX = DEVICE + len(DEVICE_NAMES)
+REGISTERS = INBOX + len(SENSOR_NAMES)
+# Float64 columns
+TEMPERATURE, HUMIDITY = range(2)
+FLOAT_WIDTH = 2
+
+
+class StateStore:
+    """Fixed-width VM records in shared memory; create() once, attach() anywhere"""
+
+    def __init__(self, shm: shared_memory.SharedMemory, owner: bool):
+        self.shm = shm
+        self.owner = owner
+        magic, self.count, self.n_regs, self.n_vars, table, _ = HEADER.unpack_from(shm.buf)
+        if magic != MAGIC:
+            raise ValueError("Not an AirConditioner state store")
+        symbols = json.loads(bytes(shm.buf[HEADER_SIZE:HEADER_SIZE + table]))
+        self.reg_slots: Dict[str, int] = symbols["registers"]
+        self.var_slots: Dict[str, int] = symbols["variables"]
+        self.variables = REGISTERS + self.n_regs
+        self.present = self.variables + self.n_vars
+        self.written = self.present + self.n_vars
+        self.width = self.written + self.n_regs
+
+        start = _align(HEADER_SIZE + table)
+        size = self.count * self.width * 8
+        self.ints = shm.buf[start:start + size].cast('q')
+        self.floats = shm.buf[start + size:start + size + self.count * FLOAT_WIDTH * 8].cast('d')
+
+    @classmethod
+    def create(cls, template: AirConditionerVM, count: int,
+               name: Optional[str] = None) -> "StateStore":
+        """A store of `count` records laid out for the program loaded in template, all in its state"""
+        symbols = json.dumps({"registers": template.reg_slots,
+                              "variables": template.var_slots}).encode('utf-8')
+        n_regs, n_vars = len(template.regs), len(template.vars)
+        width = REGISTERS + 2 * n_regs + 2 * n_vars
+        start = _align(HEADER_SIZE + len(symbols))
+        size = start + count * (width + FLOAT_WIDTH) * 8
+        shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        HEADER.pack_into(shm.buf, 0, MAGIC, count, n_regs, n_vars, len(symbols), 0)
+        shm.buf[HEADER_SIZE:HEADER_SIZE + len(symbols)] = symbols
+        store = cls(shm, owner=True)
+        for index in range(count):
+            store.save(template, index)
+        return store
+
+    @classmethod
+    def attach(cls, name: str) -> "StateStore":
+        return cls(shared_memory.SharedMemory(name=name), owner=False)
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+    def close(self):
+        self.ints.release()
+        self.floats.release()
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+    @property
+    def stopping(self) -> bool:
+        return bool(self.shm.buf[HEADER.size - 1])
+
+    @stopping.setter
+    def stopping(self, value: bool):
+        self.shm.buf[HEADER.size - 1] = int(value)
+
+    # --- Worker side: VM <-> record ---
+    def load(self, vm: AirConditionerVM, index: int):
+        """Copy a record into vm (same program) and apply pending sensor updates"""
+        ints, base = self.ints, index * self.width
+        record = ints[base:base + self.width].tolist()
+        vm.pc = record[PC]
+        vm.halted = bool(record[HALTED])
+        vm.steps = record[STEPS]
+        vm.ticks = record[TICKS]
+        vm.last_cmp_result = record[FLAG]
+        vm.thermal_ticks = record[THERMAL_TICKS]
+        vm.sensors.update(zip(SENSOR_NAMES, record[SENSORS:DEVICE]))
+        vm.device_state.update(zip(DEVICE_NAMES, record[DEVICE:INBOX]))
+        # In place: the loaded handlers hold on to these lists
+        vm.regs[:] = [value if written else UNWRITTEN for value, written in
+                      zip(record[REGISTERS:self.variables], record[self.written:])]
+        vm.vars[:] = [value if present else None for value, present in
+                      zip(record[self.variables:self.present], record[self.present:self.written])]
+        floats = self.floats
+        vm.temperature = floats[index * FLOAT_WIDTH + TEMPERATURE]
+        vm.humidity = floats[index * FLOAT_WIDTH + HUMIDITY]
+
+        mask = record[INBOX_MASK]
+        if mask:
+            for bit, sensor in enumerate(SENSOR_NAMES):
+                if mask & (1 << bit):
+                    vm.set_sensor(sensor, record[INBOX + bit])
+            ints[base + INBOX_MASK] = 0
+
+    def save(self, vm: AirConditionerVM, index: int):
+        """Write vm's state into a record, thermal model synced to its tick"""
+        if len(vm.regs) != self.n_regs or len(vm.vars) != self.n_vars:
+            raise ValueError("VM layout doesn't match the store's records")
+        vm._sync_thermal()
+        base = index * self.width
+        ints = self.ints
+        mask = ints[base + INBOX_MASK]
+        record = [vm.pc, int(vm.halted), vm.steps, vm.ticks, vm.last_cmp_result,
+                  vm.thermal_ticks, ints[base + ERROR], mask]
+        record += [vm.sensors[name] for name in SENSOR_NAMES]
+        record += [vm.device_state[name] for name in DEVICE_NAMES]
+        record += ints[base + INBOX:base + REGISTERS].tolist()
+        record += vm.regs
+        record += [0 if value is None else value for value in vm.vars]
+        record += [0 if value is None else 1 for value in vm.vars]
+        record += [0 if value is UNWRITTEN else 1 for value in vm.regs]
+        ints[base:base + self.width] = array('q', record)
+        self.floats[index * FLOAT_WIDTH + TEMPERATURE] = vm.temperature
+        self.floats[index * FLOAT_WIDTH + HUMIDITY] = vm.humidity
+
+    # --- Coordinator side: direct reads and sensor injection ---
+    def field(self, index: int, column: int) -> int:
+        return self.ints[index * self.width + column]
+
+    def sensor(self, index: int, sensor: str) -> int:
+        return self.field(index, SENSORS + SENSOR_NAMES.index(sensor.upper()))
+
+    def device(self, index: int, name: str) -> int:
+        return self.field(index, DEVICE + DEVICE_NAMES.index(name.upper()))
+
+    def set_sensor(self, index: int, sensor: str, value: int):
+        """Queue a sensor update for the VM's next slice"""
+        bit = SENSOR_NAMES.index(sensor.upper())
+        base = index * self.width
+        self.ints[base + INBOX + bit] = value
+        self.ints[base + INBOX_MASK] |= 1 << bit
+
+    def halted(self, index: int) -> bool:
+        return bool(self.field(index, HALTED))
+
+    def failed(self, index: int) -> bool:
+        return bool(self.field(index, ERROR))
+
+    def state(self, index: int) -> Dict:
+        """The record as AirConditionerVM.state() would report it"""
+        base = index * self.width
+        record = self.ints[base:base + self.width].tolist()
+        regs = record[REGISTERS:self.variables]
+        return {
+            "registers": {name: regs[slot] for name, slot in self.reg_slots.items()
+                          if record[self.written + slot]},
+            "variables": {name: record[self.variables + slot]
+                          for name, slot in self.var_slots.items()
+                          if record[self.present + slot]},
+            "sensors": dict(zip(SENSOR_NAMES, record[SENSORS:DEVICE])),
+            "device": dict(zip(DEVICE_NAMES, record[DEVICE:INBOX])),
+            "pc": record[PC],
+            "halted": bool(record[HALTED]),
+            "steps": record[STEPS],
+            "ticks": record[TICKS],
+        }
+
+
+def _align(offset: int) -> int:
+    return (offset + 7) // 8 * 8
+
+
+def _worker(name: str, program, labels, ops, weights, first: int, last: int,
+            budget: int, start, done):
+    store = StateStore.attach(name)
+    vm = AirConditionerVM(output=QuietSink())
+    vm.install(program, labels, ops, weights)
+    try:
+        while True:
+            start.wait()
+            if store.stopping:
+                break
+            for index in range(first, last):
+                if store.halted(index) or store.failed(index):
+                    continue
+                store.load(vm, index)
+                try:
+                    vm.run(max_steps=vm.steps + budget)
+                except StepLimitError:
+                    pass
+                except (RuntimeError, ValueError):
+                    store.ints[index * store.width + ERROR] = 1
+                store.save(vm, index)
+            done.wait()
+    except BaseException:
+        # Don't leave the coordinator waiting on a barrier forever
+        start.abort()
+        done.abort()
+        raise
+    finally:
+        store.close()
+
+
+class SharedFleet:
+    """
+    Many copies of one program stepped by worker processes in lockstep
+    rounds of `budget` steps each, their state in a StateStore
+    """
+
+    def __init__(self, source: str, count: int, workers: Optional[int] = None,
+                 budget: int = 1000, optimize: bool = False):
+        template = AirConditionerVM(optimize=optimize, output=QuietSink())
+        template.load_program(source)
+        self.store = StateStore.create(template, count)
+        self.rounds = 0
+        workers = max(1, min(workers or multiprocessing.cpu_count(), count))
+        self._start = multiprocessing.Barrier(workers + 1)
+        self._done = multiprocessing.Barrier(workers + 1)
+        self._processes: List[multiprocessing.Process] = []
+        share = -(-count // workers)
+        for first in range(0, count, share):
+            process = multiprocessing.Process(target=_worker, daemon=True, args=(
+                self.store.name, template.program, template.labels, template.ops,
+                template.weights, first, min(first + share, count), budget,
+                self._start, self._done))
+            process.start()
+            self._processes.append(process)
+
+    def step(self, rounds: int = 1):
+        """Let every worker run one slice per VM, `rounds` times"""
+        for _ in range(rounds):
+            self._start.wait()
+            self._done.wait()
+            self.rounds += 1
+
+    def active(self) -> int:
+        """VMs neither halted nor failed"""
+        store = self.store
+        return sum(1 for i in range(store.count) if not (store.halted(i) or store.failed(i)))
+
+    def run(self, max_rounds: Optional[int] = None):
+        """Step until every VM halted or failed (or max_rounds)"""
+        rounds = 0
+        while self.active() and (max_rounds is None or rounds < max_rounds):
+            self.step()
+            rounds += 1
+
+    def close(self):
+        if self._processes:
+            self.store.stopping = True
+            try:
+                self._start.wait()
+            except threading.BrokenBarrierError:
+                pass
+            for process in self._processes:
+                process.join()
+            self._processes = []
+        self.store.close()
+
+    def __enter__(self) -> "SharedFleet":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python3 shared_vm.py <program.asm> [rooms] [workers]")
+        sys.exit(1)
+    with open(sys.argv[1], 'r') as f:
+        source = f.read()
+    rooms = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    workers = int(sys.argv[3]) if len(sys.argv) > 3 else None
+    with SharedFleet(source, rooms, workers) as fleet:
+        fleet.run(max_rounds=100)
+        powered = sum(fleet.store.device(i, "POWER_STATE") for i in range(rooms))
+        print(f"Rooms simulated: {rooms} in {fleet.rounds} rounds")
+        print(f"Powered on: {powered}")
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""
+Scenario sweeps for the AirConditioner VM on a process pool.
+
+The program is assembled once in the parent, shipped to each worker when the
+pool starts, and every scenario is then just reset + set_sensor + run.
+Scenarios are handed out in chunks and results come back in input order,
+either as columns or as JSON Lines.
+"""
+
+import argparse
+import itertools
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from airconditioner_vm import AirConditionerVM, Instr, Op
+from output_vm import QuietSink
+
+Scenario = Dict[str, int]
+Outcome = Tuple[Scenario, Dict, Optional[str]]
+
+SENSOR_AXES = ("TEMP", "HUMIDITY", "OCCUPIED", "TIME")
+
+_worker_vm: Optional[AirConditionerVM] = None
+_worker_max_steps: Optional[int] = None
+
+
+def sensor_grid(**axes: Iterable[int]) -> List[Scenario]:
+    """Cartesian product of sensor values, e.g. sensor_grid(TEMP=range(18, 30), OCCUPIED=[0, 1])"""
+    names = [name.upper() for name in axes]
+    for name in names:
+        if name not in SENSOR_AXES:
+            raise ValueError(f"Unknown sensor: {name}")
+    return [dict(zip(names, values)) for values in itertools.product(*axes.values())]
+
+
+def run_scenario(vm: AirConditionerVM, scenario: Scenario,
+                 max_steps: Optional[int]) -> Tuple[Dict, Optional[str]]:
+    """Run the loaded program from a clean state with the given sensor values"""
+    vm.reset()
+    for sensor, value in scenario.items():
+        vm.set_sensor(sensor, value)
+    try:
+        vm.run(max_steps=max_steps)
+    except (RuntimeError, ValueError) as e:
+        return vm.state(), str(e)
+    return vm.state(), None
+
+
+def _init_worker(program: List[Instr], labels: Dict[str, int], ops: List[Op],
+                 weights: Optional[List[int]], rules: Optional[List[Tuple[str, ...]]],
+                 lines: Optional[Sequence[int]], max_steps: Optional[int], jit: bool):
+    global _worker_vm, _worker_max_steps
+    # PRINT/HALT output from thousands of scenarios is just noise here
+    _worker_vm = AirConditionerVM(jit=jit, output=QuietSink())
+    _worker_vm.install(program, labels, ops, weights, rules, lines)
+    _worker_max_steps = max_steps
+
+
+def _run_chunk(chunk: List[Scenario]) -> List[Tuple[Dict, Optional[str]]]:
+    return [run_scenario(_worker_vm, scenario, _worker_max_steps) for scenario in chunk]
+
+
+def _chunks(scenarios: Sequence[Scenario], size: int) -> Iterator[List[Scenario]]:
+    for start in range(0, len(scenarios), size):
+        yield list(scenarios[start:start + size])
+
+
+def iter_sweep(source: str, scenarios: Sequence[Scenario],
+               max_steps: Optional[int] = 10000, workers: Optional[int] = None,
+               chunksize: Optional[int] = None, optimize: bool = False,
+               jit: bool = False) -> Iterator[Outcome]:
+    """
+    Yield (scenario, final state, error) for every scenario, in input order.
+    error is None unless the run stopped on a runtime error or the step limit.
+    With jit, hot code compiled in one scenario is reused by the next ones.
+    """
+    vm = AirConditionerVM(optimize=optimize, jit=jit, output=QuietSink())
+    vm.load_program(source)
+    workers = workers or os.cpu_count() or 1
+
+    if workers == 1:
+        for scenario in scenarios:
+            state, error = run_scenario(vm, scenario, max_steps)
+            yield scenario, state, error
+        return
+
+    if chunksize is None:
+        # A few chunks per worker keeps the pool balanced without tiny tasks
+        chunksize = max(1, -(-len(scenarios) // (workers * 4)))
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(vm.program, vm.labels, vm.ops, vm.weights,
+                                       vm.rules, vm.lines, max_steps, jit)) as pool:
+        chunks = list(_chunks(scenarios, chunksize))
+        for chunk, results in zip(chunks, pool.map(_run_chunk, chunks)):
+            for scenario, (state, error) in zip(chunk, results):
+                yield scenario, state, error
+
+
+def flatten_state(state: Dict) -> Dict[str, Any]:
+    """Flatten a state() dict into dotted column names (e.g. device.MODE)"""
+    flat: Dict[str, Any] = {}
+    for key, value in state.items():
+        if isinstance(value, dict):
+            for name, item in value.items():
+                flat[f"{key}.{name}"] = item
+        else:
+            flat[key] = value
+    return flat
+
+
+def sweep(source: str, scenarios: Sequence[Scenario], **options) -> Dict[str, List[Any]]:
+    """
+    Run every scenario and return columns: input.<SENSOR> for the scenario,
+    the flattened final state, and error. Missing values are None.
+    """
+    columns: Dict[str, List[Any]] = {}
+    count = 0
+    for scenario, state, error in iter_sweep(source, scenarios, **options):
+        row = {f"input.{name}": value for name, value in scenario.items()}
+        row.update(flatten_state(state))
+        row["error"] = error
+        for name, value in row.items():
+            column = columns.get(name)
+            if column is None:
+                column = columns[name] = [None] * count
+            column.append(value)
+        count += 1
+        if len(row) != len(columns):
+            for column in columns.values():
+                if len(column) < count:
+                    column.append(None)
+    return columns
+
+
+def write_jsonl(out, source: str, scenarios: Sequence[Scenario], **options) -> int:
+    """Stream one JSON object per scenario to a text file; returns the count"""
+    count = 0
+    for scenario, state, error in iter_sweep(source, scenarios, **options):
+        record = {"scenario": scenario, "state": state, "error": error}
+        out.write(json.dumps(record, separators=(',', ':')) + '\n')
+        count += 1
+    return count
+
+
+def parse_axis(spec: str) -> List[int]:
+    """Parse '18,22,26' or 'start:stop[:step]' (stop exclusive) into values"""
+    if ':' in spec:
+        parts = [int(p) for p in spec.split(':')]
+        if len(parts) not in (2, 3):
+            raise ValueError(f"Invalid range: {spec}")
+        return list(range(*parts))
+    return [int(p) for p in spec.split(',')]
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Run an AirConditioner program over many sensor scenarios.")
+    parser.add_argument("program", help="assembly file")
+    parser.add_argument("--temp", help="TEMP values, e.g. 15:36 or 18,25,30")
+    parser.add_argument("--humidity", help="HUMIDITY values")
+    parser.add_argument("--occupied", help="OCCUPIED values")
+    parser.add_argument("--time", help="TIME values in seconds, e.g. 0:86400:3600")
+    parser.add_argument("--scenarios", help="JSON Lines file with one {sensor: value} object per line")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument("--chunksize", type=int, default=None, help="scenarios per task")
+    parser.add_argument("--max-steps", type=int, default=10000)
+    parser.add_argument("--optimize", action="store_true", help="run the optimized program")
+    parser.add_argument("--jit", action="store_true", help="compile hot loops (see jit_vm)")
+    parser.add_argument("-o", "--output", help="JSON Lines output file (default: stdout)")
+    args = parser.parse_args(argv)
+
+    with open(args.program, 'r') as f:
+        source = f.read()
+
+    if args.scenarios:
+        with open(args.scenarios, 'r') as f:
+            scenarios = [json.loads(line) for line in f if line.strip()]
+    else:
+        axes = {name: parse_axis(spec) for name, spec in (
+            ("TEMP", args.temp), ("HUMIDITY", args.humidity),
+            ("OCCUPIED", args.occupied), ("TIME", args.time)) if spec}
+        scenarios = sensor_grid(**axes)
+
+    options = dict(max_steps=args.max_steps, workers=args.workers, chunksize=args.chunksize,
+                   optimize=args.optimize, jit=args.jit)
+    if args.output:
+        with open(args.output, 'w') as out:
+            count = write_jsonl(out, source, scenarios, **options)
+        print(f"Wrote {count} scenario results to {args.output}", file=sys.stderr)
+    else:
+        write_jsonl(sys.stdout, source, scenarios, **options)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
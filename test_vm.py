@@ -3,83 +3,265 @@
 Test script for AirConditioner VM with different scenarios
 """
 
-from airconditioner_vm import AirConditionerVM
+import io
 
-def test_scenario(name, vm, sensor_settings, program_file):
-    """Run a test scenario with specific sensor values"""
+import numpy as np
+
+from airconditioner_vm import AirConditionerVM, BASIC_TEMP_PROGRAM, StepLimitError
+from decision_vm import DecisionTable, evaluate_program
+from output_vm import QuietSink, TextSink
+from sweep_vm import sweep
+
+MODE_NAMES = ["COOL", "HEAT", "DRY", "FAN", "AUTO"]
+FAN_NAMES = ["OFF", "LOW", "MID", "HIGH"]
+
+SCENARIOS = [
+    # Test 1: Hot room, high humidity, occupied, daytime
+    ("Test 1: Hot & Humid Room (Occupied, Daytime)",
+     {"TEMP": 28, "HUMIDITY": 75, "OCCUPIED": 1, "TIME": 43200}),  # 12:00
+    # Test 2: Cool room, normal humidity, empty, nighttime
+    ("Test 2: Cool Room (Empty, Nighttime)",
+     {"TEMP": 20, "HUMIDITY": 50, "OCCUPIED": 0, "TIME": 79200}),  # 22:00
+    # Test 3: Warm room, occupied, evening
+    ("Test 3: Warm Room (Occupied, Evening)",
+     {"TEMP": 26, "HUMIDITY": 55, "OCCUPIED": 1, "TIME": 72000}),  # 20:00
+    # Test 4: Very humid room
+    ("Test 4: Very Humid Room",
+     {"TEMP": 24, "HUMIDITY": 80, "OCCUPIED": 0, "TIME": 36000}),  # 10:00
+]
+
+
+def print_scenario(name, results, i):
+    """Print the sensors a scenario started with and the device state it ended in"""
     print(f"\n{'='*60}")
     print(f"  {name}")
     print(f"{'='*60}")
-    
-    # Reset VM
-    vm.reset()
-    
-    # Set sensor values
-    for sensor, value in sensor_settings.items():
-        vm.set_sensor(sensor, value)
-    
-    # Load and run program
-    with open(program_file, 'r') as f:
-        program = f.read()
-    
-    vm.load_program(program)
-    
+
     print(f"\nInitial Sensors:")
-    print(f"  Temperature: {vm.sensors['TEMP']}°C")
-    print(f"  Humidity: {vm.sensors['HUMIDITY']}%")
-    print(f"  Occupied: {'YES' if vm.sensors['OCCUPIED'] else 'NO'}")
-    print(f"  Time: {vm.sensors['TIME']//3600:02d}:{(vm.sensors['TIME']%3600)//60:02d}")
-    
-    print(f"\n--- Running Program ---\n")
-    vm.run(max_steps=1000)
-    
+    print(f"  Temperature: {results['input.TEMP'][i]}°C")
+    print(f"  Humidity: {results['input.HUMIDITY'][i]}%")
+    print(f"  Occupied: {'YES' if results['input.OCCUPIED'][i] else 'NO'}")
+    time = results['input.TIME'][i]
+    print(f"  Time: {time//3600:02d}:{(time%3600)//60:02d}")
+
+    if results['error'][i]:
+        print(f"\nError: {results['error'][i]}")
+
     print(f"\nFinal Device State:")
-    print(f"  Power: {'ON' if vm.device_state['POWER_STATE'] else 'OFF'}")
-    mode_names = ["COOL", "HEAT", "DRY", "FAN", "AUTO"]
-    print(f"  Mode: {mode_names[vm.device_state['MODE']]}")
-    print(f"  Target Temp: {vm.device_state['TARGET_TEMP']}°C")
-    print(f"  Current Temp: {vm.sensors['TEMP']}°C")
-    fan_names = ["OFF", "LOW", "MID", "HIGH"]
-    print(f"  Fan: {fan_names[vm.device_state['FAN_SPEED']]}")
-    print(f"  Steps: {vm.steps}, Ticks: {vm.ticks}")
+    print(f"  Power: {'ON' if results['device.POWER_STATE'][i] else 'OFF'}")
+    print(f"  Mode: {MODE_NAMES[results['device.MODE'][i]]}")
+    print(f"  Target Temp: {results['device.TARGET_TEMP'][i]}°C")
+    print(f"  Current Temp: {results['sensors.TEMP'][i]}°C")
+    print(f"  Fan: {FAN_NAMES[results['device.FAN_SPEED'][i]]}")
+    print(f"  Steps: {results['steps'][i]}, Ticks: {results['ticks'][i]}")
+
+
+# A settled loop of 4 instructions, for budgets on and off cycle boundaries
+SETTLED_LOOP = "loop:\nPOWER OFF\nLOAD_IMM T0, 60\nWAIT T0\nJMP loop\n"
+
+
+def check_cycle_skipping_budget():
+    """skip_cycles must stop on exactly max_steps, whole cycles or not"""
+    for max_steps in (29, 30, 31, 32, 33, 100, 1000, 1001):
+        states = []
+        for skip_cycles in (True, False):
+            vm = AirConditionerVM(output=QuietSink(), skip_cycles=skip_cycles)
+            vm.load_program(SETTLED_LOOP)
+            try:
+                vm.run(max_steps=max_steps)
+            except StepLimitError:
+                pass
+            else:
+                raise AssertionError(f"max_steps={max_steps}: no StepLimitError")
+            assert vm.steps == max_steps, (max_steps, vm.steps)
+            states.append(vm.state())
+        assert states[0] == states[1], (max_steps, states)
+    print("Cycle skipping stops on the step budget: OK")
+
+
+# Cooling before the read: no starting TEMP reads 50
+COOL_THEN_READ = ("POWER ON\nSET_MODE COOL\nSET_FAN HIGH\nLOAD_IMM T1, 20\nSET_TEMP T1\n"
+                  "READ_SENSOR T0, TEMP\nSET_TEMP T0\nHALT\n")
+
+
+def check_decision_table(source: str):
+    """A program's decision table must give the device state the VM ends in"""
+    vm = AirConditionerVM(output=QuietSink())
+    vm.load_program(source)
+    table = DecisionTable(vm)
+    temps = np.arange(-5, 60)
+    tables = [table.evaluate({"TEMP": temps}), evaluate_program(vm, {"TEMP": temps})]
+    for row, temp in enumerate(temps):
+        vm.reset()
+        vm.set_sensor("TEMP", int(temp))
+        vm.run(max_steps=1000)
+        looked_up = table.lookup({"TEMP": int(temp)})
+        for field, value in vm.device_state.items():
+            for result in tables:
+                assert result[field][row] == value, (int(temp), field, result[field][row], value)
+            assert looked_up.get(field, value) == value, (int(temp), field, looked_up)
+    print("Decision table matches the interpreter: OK")
+
+
+def check_step_output():
+    """step() must leave nothing of PRINT and HALT in the sink's buffer"""
+    stepped, ran = io.StringIO(), io.StringIO()
+    vm = AirConditionerVM(output=TextSink(stepped))
+    vm.load_program(BASIC_TEMP_PROGRAM)
+    while not vm.halted:
+        vm.step()
+        assert not vm.output.pending, vm.pc
+    vm = AirConditionerVM(output=TextSink(ran))
+    vm.load_program(BASIC_TEMP_PROGRAM)
+    vm.run()
+    assert stepped.getvalue() == ran.getvalue() != ""
+    print("step() flushes PRINT and HALT output: OK")
+
+
+def check_failed_load():
+    """A program that fails to assemble must leave the loaded one intact"""
+    vm = AirConditionerVM(output=QuietSink())
+    vm.load_program(SETTLED_LOOP)
+    for load in (vm.load_program, vm.reload_program):
+        try:
+            load("foo:\nLOAD_IMM T0, 1\nBOGUS\n")
+        except ValueError:
+            pass
+        else:
+            raise AssertionError(f"{load.__name__}: no ValueError")
+        assert vm.labels == {"loop": 0}, (load.__name__, vm.labels)
+    print("A failed load keeps the loaded program: OK")
+
+
+# Runs forever: a thermostat reading TEMP every 30 ticks. The register
+# beyond T0-T9 is written only inside the loop
+THERMOSTAT_LOOP = """
+POWER ON
+LOAD_IMM T1, 24
+LOAD_IMM T5, 30
+loop:
+READ_SENSOR T0, TEMP
+INC T12
+STORE cycles, T12
+CMP_GT T2, T0, T1
+JZ heat
+SET_MODE COOL
+SET_FAN HIGH
+SET_TEMP T1
+JMP wait
+heat:
+SET_MODE HEAT
+SET_FAN LOW
+SET_TEMP T1
+wait:
+PRINT
+WAIT T5
+JMP loop
+"""
+
+ENGINES = ({}, {"jit": True}, {"skip_cycles": True})
+
+
+def run_to(vm: AirConditionerVM, steps: int):
+    """Run until vm.steps reaches steps"""
+    try:
+        vm.run(max_steps=steps)
+    except StepLimitError:
+        pass
+
+
+def thermostat(**engine) -> AirConditionerVM:
+    vm = AirConditionerVM(output=QuietSink(), **engine)
+    vm.load_program(THERMOSTAT_LOOP)
+    vm.set_sensor("TEMP", 30)
+    return vm
+
+
+def check_snapshot_restore_fork():
+    """Restoring or forking a snapshot must carry on as if never interrupted"""
+    for engine in ENGINES:
+        for taken in (1, 5, 700):
+            straight = thermostat(**engine)
+            run_to(straight, 2000)
+            expected = straight.state()
+
+            vm = thermostat(**engine)
+            run_to(vm, taken)
+            snapshot = vm.snapshot()
+            fork = vm.fork()
+            run_to(vm, 2000)
+            assert vm.state() == expected, (engine, taken, "run on")
+            vm.restore(snapshot)
+            run_to(vm, 2000)
+            assert vm.state() == expected, (engine, taken, "restore")
+            run_to(fork, 2000)
+            assert fork.state() == expected, (engine, taken, "fork")
+    print("Snapshot, restore and fork match a straight run: OK")
+
+
+def position(vm: AirConditionerVM):
+    """state(), with the instruction at pc in place of pc"""
+    state = vm.state()
+    pc = state.pop("pc")
+    return state, vm.program[pc] if pc < len(vm.program) else None
+
+
+def check_reload_program():
+    """reload_program() of code that only moves the labels must not change the run"""
+    # Dead code after the JMP: heat and wait move, the behaviour doesn't
+    moved = THERMOSTAT_LOOP.replace("JMP wait\n", "JMP wait\nLOAD_IMM T9, 99\nLOAD_IMM T9, 98\n")
+    for engine in ENGINES:
+        straight = thermostat(**engine)
+        run_to(straight, 1000)
+        expected = position(straight)
+        loaded = AirConditionerVM(output=QuietSink(), **engine)
+        loaded.load_program(moved)
+        loaded.set_sensor("TEMP", 30)
+        run_to(loaded, 1000)
+        assert position(loaded) == expected, (engine, "full load")
+        for at in range(1, 40):
+            vm = thermostat(**engine)
+            run_to(vm, at)
+            vm.reload_program(moved)
+            run_to(vm, 1000)
+            assert position(vm) == expected, (engine, at)
+    print("reload_program matches a full load: OK")
+
+
+def check_unwritten_registers():
+    """Registers read before any write give plain 0s and stay out of state()"""
+    for engine in ENGINES:
+        vm = AirConditionerVM(output=QuietSink(), **engine)
+        # Hot enough for the JIT to compile the loop
+        vm.load_program("LOAD_IMM T0, 200\nloop:\nSET_TEMP T15\nSTORE v, T16\n"
+                        "DEC T0\nJNZ loop\nHALT\n")
+        vm.run()
+        target, stored = vm.device_state["TARGET_TEMP"], vm.state()["variables"]["v"]
+        assert type(target) is int and target == 0, (engine, repr(target))
+        assert type(stored) is int and stored == 0, (engine, repr(stored))
+        assert not {"T15", "T16"} & set(vm.state()["registers"]), engine
+    print("Unwritten registers read as plain 0: OK")
 
 
 if __name__ == "__main__":
-    vm = AirConditionerVM()
     program_file = "test.asm"
-    
-    # Test 1: Hot room, high humidity, occupied, daytime
-    test_scenario(
-        "Test 1: Hot & Humid Room (Occupied, Daytime)",
-        vm,
-        {"TEMP": 28, "HUMIDITY": 75, "OCCUPIED": 1, "TIME": 43200},  # 12:00
-        program_file
-    )
-    
-    # Test 2: Cool room, normal humidity, empty, nighttime
-    test_scenario(
-        "Test 2: Cool Room (Empty, Nighttime)",
-        vm,
-        {"TEMP": 20, "HUMIDITY": 50, "OCCUPIED": 0, "TIME": 79200},  # 22:00
-        program_file
-    )
-    
-    # Test 3: Warm room, occupied, evening
-    test_scenario(
-        "Test 3: Warm Room (Occupied, Evening)",
-        vm,
-        {"TEMP": 26, "HUMIDITY": 55, "OCCUPIED": 1, "TIME": 72000},  # 20:00
-        program_file
-    )
-    
-    # Test 4: Very humid room
-    test_scenario(
-        "Test 4: Very Humid Room",
-        vm,
-        {"TEMP": 24, "HUMIDITY": 80, "OCCUPIED": 0, "TIME": 36000},  # 10:00
-        program_file
-    )
-    
+    with open(program_file, 'r') as f:
+        program = f.read()
+
+    # All scenarios run in one sweep: assembled once, spread over the cores
+    results = sweep(program, [sensors for _, sensors in SCENARIOS], max_steps=1000)
+    for i, (name, _) in enumerate(SCENARIOS):
+        print_scenario(name, results, i)
+
+    print()
+    check_cycle_skipping_budget()
+    check_decision_table(COOL_THEN_READ)
+    check_step_output()
+    check_failed_load()
+    check_snapshot_restore_fork()
+    check_reload_program()
+    check_unwritten_registers()
+
     print(f"\n{'='*60}")
     print("  All Tests Complete!")
     print(f"{'='*60}\n")
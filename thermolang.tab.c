@@ -1692,8 +1692,15 @@ yyreduce:
     ;}
     break;
 
+  case 42:
+#line 174 "thermolang.y"
+    {
+        fprintf(output_file, "; END RULE\n");
+    ;}
+    break;
+
   case 43:
-#line 178 "thermolang.y"
+#line 180 "thermolang.y"
     {
         int temp = new_temp();
         fprintf(output_file, "CMP_EQ T%d, T%d, T%d\n", temp, (yyvsp[(1) - (3)].num), (yyvsp[(3) - (3)].num));
@@ -1701,7 +1708,7 @@ yyreduce:
     break;
 
   case 44:
-#line 182 "thermolang.y"
+#line 184 "thermolang.y"
     {
         int temp = new_temp();
         fprintf(output_file, "CMP_NE T%d, T%d, T%d\n", temp, (yyvsp[(1) - (3)].num), (yyvsp[(3) - (3)].num));
@@ -1709,7 +1716,7 @@ yyreduce:
     break;
 
   case 45:
-#line 186 "thermolang.y"
+#line 188 "thermolang.y"
     {
         int temp = new_temp();
         fprintf(output_file, "CMP_LT T%d, T%d, T%d\n", temp, (yyvsp[(1) - (3)].num), (yyvsp[(3) - (3)].num));
@@ -1717,7 +1724,7 @@ yyreduce:
     break;
 
   case 46:
-#line 190 "thermolang.y"
+#line 192 "thermolang.y"
     {
         int temp = new_temp();
         fprintf(output_file, "CMP_LE T%d, T%d, T%d\n", temp, (yyvsp[(1) - (3)].num), (yyvsp[(3) - (3)].num));
@@ -1725,7 +1732,7 @@ yyreduce:
     break;
 
   case 47:
-#line 194 "thermolang.y"
+#line 196 "thermolang.y"
     {
         int temp = new_temp();
         fprintf(output_file, "CMP_GT T%d, T%d, T%d\n", temp, (yyvsp[(1) - (3)].num), (yyvsp[(3) - (3)].num));
@@ -1733,7 +1740,7 @@ yyreduce:
     break;
 
   case 48:
-#line 198 "thermolang.y"
+#line 200 "thermolang.y"
     {
         int temp = new_temp();
         fprintf(output_file, "CMP_GE T%d, T%d, T%d\n", temp, (yyvsp[(1) - (3)].num), (yyvsp[(3) - (3)].num));
@@ -1741,12 +1748,12 @@ yyreduce:
     break;
 
   case 49:
-#line 205 "thermolang.y"
+#line 207 "thermolang.y"
     { (yyval.num) = (yyvsp[(1) - (1)].num); ;}
     break;
 
   case 50:
-#line 206 "thermolang.y"
+#line 208 "thermolang.y"
     {
         int temp = new_temp();
         fprintf(output_file, "ADD T%d, T%d, T%d\n", temp, (yyvsp[(1) - (3)].num), (yyvsp[(3) - (3)].num));
@@ -1755,7 +1762,7 @@ yyreduce:
     break;
 
   case 51:
-#line 211 "thermolang.y"
+#line 213 "thermolang.y"
     {
         int temp = new_temp();
         fprintf(output_file, "SUB T%d, T%d, T%d\n", temp, (yyvsp[(1) - (3)].num), (yyvsp[(3) - (3)].num));
@@ -1764,12 +1771,12 @@ yyreduce:
     break;
 
   case 52:
-#line 219 "thermolang.y"
+#line 221 "thermolang.y"
     { (yyval.num) = (yyvsp[(1) - (1)].num); ;}
     break;
 
   case 53:
-#line 220 "thermolang.y"
+#line 222 "thermolang.y"
     {
         int temp = new_temp();
         fprintf(output_file, "MUL T%d, T%d, T%d\n", temp, (yyvsp[(1) - (3)].num), (yyvsp[(3) - (3)].num));
@@ -1778,7 +1785,7 @@ yyreduce:
     break;
 
   case 54:
-#line 225 "thermolang.y"
+#line 227 "thermolang.y"
     {
         int temp = new_temp();
         fprintf(output_file, "DIV T%d, T%d, T%d\n", temp, (yyvsp[(1) - (3)].num), (yyvsp[(3) - (3)].num));
@@ -1787,7 +1794,7 @@ yyreduce:
     break;
 
   case 55:
-#line 233 "thermolang.y"
+#line 235 "thermolang.y"
     {
         int temp = new_temp();
         fprintf(output_file, "LOAD_IMM T%d, %d\n", temp, (yyvsp[(1) - (1)].num));
@@ -1796,7 +1803,7 @@ yyreduce:
     break;
 
   case 56:
-#line 238 "thermolang.y"
+#line 240 "thermolang.y"
     {
         int temp = new_temp();
         fprintf(output_file, "LOAD T%d, %s\n", temp, (yyvsp[(1) - (1)].str));
@@ -1806,7 +1813,7 @@ yyreduce:
     break;
 
   case 57:
-#line 244 "thermolang.y"
+#line 246 "thermolang.y"
     {
         int temp = new_temp();
         fprintf(output_file, "READ_SENSOR T%d, TEMP\n", temp);
@@ -1815,7 +1822,7 @@ yyreduce:
     break;
 
   case 58:
-#line 249 "thermolang.y"
+#line 251 "thermolang.y"
     {
         int temp = new_temp();
         fprintf(output_file, "READ_SENSOR T%d, HUMIDITY\n", temp);
@@ -1824,7 +1831,7 @@ yyreduce:
     break;
 
   case 59:
-#line 254 "thermolang.y"
+#line 256 "thermolang.y"
     {
         int temp = new_temp();
         fprintf(output_file, "READ_SENSOR T%d, OCCUPIED\n", temp);
@@ -1833,7 +1840,7 @@ yyreduce:
     break;
 
   case 60:
-#line 259 "thermolang.y"
+#line 261 "thermolang.y"
     {
         int temp = new_temp();
         fprintf(output_file, "READ_SENSOR T%d, TIME\n", temp);
@@ -1842,12 +1849,12 @@ yyreduce:
     break;
 
   case 61:
-#line 264 "thermolang.y"
+#line 266 "thermolang.y"
     { (yyval.num) = (yyvsp[(2) - (3)].num); ;}
     break;
 
   case 62:
-#line 265 "thermolang.y"
+#line 267 "thermolang.y"
     {
         int temp = new_temp();
         fprintf(output_file, "NEG T%d, T%d\n", temp, (yyvsp[(2) - (2)].num));
@@ -1856,7 +1863,7 @@ yyreduce:
     break;
 
   case 63:
-#line 270 "thermolang.y"
+#line 272 "thermolang.y"
     { (yyval.num) = (yyvsp[(2) - (2)].num); ;}
     break;
 
@@ -2076,7 +2083,7 @@ yyreturn:
 }
 
 
-#line 273 "thermolang.y"
+#line 275 "thermolang.y"
 
 
 void yyerror(const char *s) {
@@ -171,7 +171,9 @@ rule_stmt:
     RULE STRING {
         fprintf(output_file, "; RULE: %s\n", $2);
         free($2);
-    } block
+    } block {
+        fprintf(output_file, "; END RULE\n");
+    }
     ;
 
 condition:
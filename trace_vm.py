@@ -0,0 +1,347 @@
+#!/usr/bin/env python3
+"""
+Execution trace recorder for the AirConditioner VM.
+
+vm.enable_trace(path) wraps every pre-decoded handler, like the profiler,
+so each executed step appends its pc and a value (the destination register
+after the step; WAIT: seconds waited; otherwise 0) to array-backed columns.
+The opcode id column (bytecode_vm.OPCODE_IDS) is derived from the pcs when a
+chunk is written, keeping the per-step cost to two appends.
+
+Device changes and TEMP are recorded sparsely, as (row, field, value)
+events: a device field only when an instruction actually changes it, TEMP
+whenever a step that syncs the thermal model (sensor read, device change,
+PRINT) finds it different from the last recorded value. Recording never
+syncs the model itself, so a traced run behaves exactly like an untraced one.
+
+Every `chunk_rows` steps the columns spill to the file. Each column of a
+chunk is stored in the narrowest integer type that holds it, either as is
+or delta-encoded against the previous value (whichever is smaller), so a
+straight-line pc column costs a byte per step. Blocks are 8-byte aligned
+and load_trace() decodes them with NumPy straight out of an mmap. Writing
+uses NumPy too when it is installed, and plain arrays otherwise.
+
+File layout (little-endian):
+    header      magic "ACTR", version u16, flags u16
+    chunk       u32 rows, u32 events, then the pc, opcode and value columns
+                and the event row, field and value columns, each a block of
+                typecode char, delta flag u8, 2 pad bytes, u32 count, data
+                padded to 8 bytes
+"""
+
+import argparse
+import mmap
+import struct
+import sys
+from array import array
+from itertools import chain
+from operator import sub
+from typing import BinaryIO, Callable, Dict, List, Optional, Tuple
+
+from airconditioner_vm import AirConditionerVM, REGISTER_EFFECTS, THERMAL_SENSORS
+from bytecode_vm import OPCODE_IDS, OPCODES
+from memo_vm import DEVICE_WRITES
+
+MAGIC = b"ACTR"
+VERSION = 1
+HEADER = struct.Struct("<4sHH")
+CHUNK = struct.Struct("<II")
+BLOCK = struct.Struct("<cBxxI")
+DEFAULT_CHUNK_ROWS = 65536
+
+# Event fields: device fields, then TEMP
+FIELDS = ("POWER_STATE", "MODE", "TARGET_TEMP", "FAN_SPEED", "SWING_STATE", "TEMP")
+FIELD_IDS = {name: i for i, name in enumerate(FIELDS)}
+TEMP_FIELD = FIELD_IDS["TEMP"]
+
+INT64 = (-(1 << 63), (1 << 63) - 1)
+# Signed types by width, for narrowing
+NARROW = (("b", 1 << 7), ("h", 1 << 15), ("i", 1 << 31), ("q", 1 << 63))
+# Instructions after which TEMP may have moved
+SYNCS = ("READ_SENSOR", "POWER", "SET_MODE", "SET_TEMP", "SET_FAN", "PRINT")
+CONTROL = ("JMP", "JZ", "JNZ", "WAIT", "HALT")
+
+
+def _narrowest(low: int, high: int) -> str:
+    for code, bound in NARROW:
+        if -bound <= low and high < bound:
+            return code
+    return "q"
+
+
+def _encode(column: array, base: int, delta: bool) -> Tuple[bytes, int]:
+    """A column block, raw or delta-encoded against base, in its narrowest type"""
+    if not column:
+        return BLOCK.pack(b"b", 0, 0), base
+    try:
+        import numpy as np
+    except ImportError:
+        np = None
+    if np is not None:
+        values = np.frombuffer(column, dtype=np.dtype(column.typecode)).astype(np.int64)
+        code, encoded = _narrowest(int(values.min()), int(values.max())), values
+        if delta:
+            deltas = np.diff(values, prepend=np.int64(base))
+            delta_code = _narrowest(int(deltas.min()), int(deltas.max()))
+            delta = np.dtype(delta_code).itemsize < np.dtype(code).itemsize
+            if delta:
+                code, encoded = delta_code, deltas
+        data = encoded.astype(np.dtype(code).newbyteorder("<")).tobytes()
+    else:
+        code, encoded = _narrowest(min(column), max(column)), column
+        if delta:
+            deltas = array("q", map(sub, column, chain((base,), column)))
+            delta_code = _narrowest(min(deltas), max(deltas))
+            delta = array(delta_code).itemsize < array(code).itemsize
+            if delta:
+                code, encoded = delta_code, deltas
+        data = array(code, encoded)
+        if sys.byteorder == "big":
+            data.byteswap()
+        data = data.tobytes()
+    block = BLOCK.pack(code.encode(), int(delta), len(column)) + data
+    return block + bytes(-len(block) % 8), column[-1]
+
+
+class Tracer:
+    """Columns of every executed step, spilled to a file in chunks"""
+
+    def __init__(self, vm: AirConditionerVM, path: str,
+                 chunk_rows: int = DEFAULT_CHUNK_ROWS, delta: bool = True):
+        self.vm = vm
+        self.path = path
+        self.chunk_rows = chunk_rows
+        self.delta = delta
+        self.rows = 0  # steps already spilled
+        self.pcs = array("I")
+        self.values = array("q")
+        self.event_rows = array("q")
+        self.event_fields = array("B")
+        self.event_values = array("q")
+        self._bases = [0] * 4  # delta bases: pc, value, event row, event value
+        self._temp: Optional[int] = None  # last TEMP recorded
+        self.file: Optional[BinaryIO] = open(path, "wb")
+        self.file.write(HEADER.pack(MAGIC, VERSION, int(delta)))
+        self._note_temp(0)
+
+    def wrap(self, pc: int, handler: Callable[[], int]) -> Callable[[], int]:
+        """Handler that appends its step to the columns"""
+        vm = self.vm
+        name, args = vm.ops[pc]
+        pcs, values = self.pcs.append, self.values.append
+        column, limit, spill = self.pcs, self.chunk_rows, self.spill
+        regs = vm.regs
+        if REGISTER_EFFECTS.get(name, ((), ()))[0] or name == "WAIT":
+            slot = vm.reg_slots[args[0]]
+        else:
+            slot = None
+
+        if name in DEVICE_WRITES or name in SYNCS:
+            field = DEVICE_WRITES.get(name)
+            field_id = FIELD_IDS.get(field)
+            thermal = name != "READ_SENSOR" or args[1] in THERMAL_SENSORS
+            note_temp, note = self._note_temp, self._note
+            def op():
+                pcs(pc)
+                before = vm.device_state[field] if field else None
+                nxt = handler()
+                values(0 if slot is None else _clamp(regs[slot]))
+                row = self.rows + len(column) - 1
+                if field and vm.device_state[field] != before:
+                    note(row, field_id, vm.device_state[field])
+                if thermal:
+                    note_temp(row)
+                return nxt
+        elif slot is not None and name != "WAIT":
+            def op():
+                pcs(pc)
+                nxt = handler()
+                try:
+                    values(regs[slot])
+                except OverflowError:
+                    values(_clamp(regs[slot]))
+                return nxt
+        elif name in CONTROL:
+            # Only control flow checks the chunk size: between two of them
+            # a chunk overshoots by at most the length of the program
+            def op():
+                pcs(pc)
+                nxt = handler()
+                values(0 if slot is None else _clamp(regs[slot]))
+                if len(column) >= limit:
+                    spill()
+                return nxt
+        else:
+            def op():
+                pcs(pc)
+                nxt = handler()
+                values(0)
+                return nxt
+        return op
+
+    def _note(self, row: int, field: int, value: int):
+        self.event_rows.append(row)
+        self.event_fields.append(field)
+        self.event_values.append(_clamp(value))
+
+    def _note_temp(self, row: int):
+        temp = self.vm.sensors["TEMP"]
+        if temp != self._temp:
+            self._temp = temp
+            self._note(row, TEMP_FIELD, temp)
+
+    def spill(self):
+        """Write the buffered steps and events as one chunk"""
+        if self.file is None or not (self.pcs or self.event_rows):
+            return
+        # A step whose handler raised has no value yet
+        while len(self.values) < len(self.pcs):
+            self.values.append(0)
+        bases, delta = self._bases, self.delta
+        out = [CHUNK.pack(len(self.pcs), len(self.event_rows))]
+        block, bases[0] = _encode(self.pcs, bases[0], delta)
+        out.append(block)
+        # Opcodes follow from the pcs: install() spills before a new program
+        block, _ = _encode(_opcodes(self.vm.ops, self.pcs), 0, False)
+        out.append(block)
+        block, bases[1] = _encode(self.values, bases[1], delta)
+        out.append(block)
+        block, bases[2] = _encode(self.event_rows, bases[2], delta)
+        out.append(block)
+        block, _ = _encode(self.event_fields, 0, False)
+        out.append(block)
+        block, bases[3] = _encode(self.event_values, bases[3], delta)
+        out.append(block)
+        self.file.write(b"".join(out))
+        self.rows += len(self.pcs)
+        for column in (self.pcs, self.values, self.event_rows,
+                       self.event_fields, self.event_values):
+            del column[:]
+
+    def flush(self):
+        """Spill what is buffered and flush the file, so readers see every step so far"""
+        self.spill()
+        if self.file is not None:
+            self.file.flush()
+
+    def close(self):
+        if self.file is not None:
+            self.spill()
+            self.file.close()
+            self.file = None
+
+
+def _opcodes(ops, pcs: array) -> array:
+    """The opcode id of each pc"""
+    ids = [OPCODE_IDS[name] for name, _ in ops]
+    try:
+        import numpy as np
+    except ImportError:
+        return array("B", map(ids.__getitem__, pcs))
+    picked = np.asarray(ids, dtype=np.uint8)[np.frombuffer(pcs, dtype=np.uint32)]
+    return array("B", picked.tobytes())
+
+
+def _clamp(value: int) -> int:
+    """Values beyond int64 saturate"""
+    return min(max(value, INT64[0]), INT64[1])
+
+
+# --- Reading ---
+def load_trace(path: str) -> Dict[str, "object"]:
+    """
+    Decode a trace file into NumPy arrays (requires NumPy): per step "pc",
+    "opcode" and "value"; per event "event_row", "event_field" and
+    "event_value". Columns are decoded straight out of an mmap of the file.
+    """
+    import numpy as np
+
+    names = ("pc", "opcode", "value", "event_row", "event_field", "event_value")
+    parts: Dict[str, List] = {name: [] for name in names}
+    bases = {name: 0 for name in names}
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        magic, version, _ = HEADER.unpack_from(mapped, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("Not an AirConditioner trace file")
+        offset = HEADER.size
+        while offset < len(mapped):
+            offset += CHUNK.size
+            for name in names:
+                code, delta, count = BLOCK.unpack_from(mapped, offset)
+                offset += BLOCK.size
+                dtype = np.dtype(code.decode()).newbyteorder("<")
+                data = np.frombuffer(mapped, dtype=dtype, count=count, offset=offset).astype(np.int64)
+                offset += count * dtype.itemsize
+                offset += -(BLOCK.size + count * dtype.itemsize) % 8
+                if delta:
+                    data = np.cumsum(data) + bases[name]
+                if count:
+                    bases[name] = int(data[-1])
+                parts[name].append(data)
+    return {name: np.concatenate(chunks) if chunks else np.zeros(0, dtype=np.int64)
+            for name, chunks in parts.items()}
+
+
+def field_column(trace: Dict[str, "object"], field: str, initial: int = 0):
+    """
+    An event field (e.g. "TEMP" or "FAN_SPEED") as one value per step,
+    holding its last recorded value (initial before the first)
+    """
+    import numpy as np
+
+    steps = len(trace["pc"])
+    chosen = trace["event_field"] == FIELD_IDS[field]
+    rows, values = trace["event_row"][chosen], trace["event_value"][chosen]
+    column = np.full(steps, initial, dtype=np.int64)
+    if len(rows):
+        # Index of the last event at or before each step
+        last = np.searchsorted(rows, np.arange(steps), side="right") - 1
+        seen = last >= 0
+        column[seen] = values[last[seen]]
+    return column
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Record or show an AirConditioner execution trace.")
+    parser.add_argument("program", nargs="?", help="assembly, .thermo or bytecode file to run")
+    parser.add_argument("-o", "--output", default="trace.actr", help="trace file to write")
+    parser.add_argument("--sensor", action="append", default=[], metavar="NAME=VALUE",
+                        help="set a sensor before running (repeatable)")
+    parser.add_argument("--max-steps", type=int, default=10000)
+    parser.add_argument("--show", metavar="TRACE", help="print a recorded trace instead")
+    parser.add_argument("--head", type=int, default=20, help="steps to print with --show")
+    args = parser.parse_args(argv)
+
+    if args.show:
+        trace = load_trace(args.show)
+        temp = field_column(trace, "TEMP")
+        for row in range(min(args.head, len(trace["pc"]))):
+            print(f"{row:>8} pc={trace['pc'][row]:<5} {OPCODES[trace['opcode'][row]]:<12}"
+                  f"value={trace['value'][row]:<8} TEMP={temp[row]}")
+        print(f"{len(trace['pc'])} steps, {len(trace['event_row'])} events")
+        return 0
+    if not args.program:
+        parser.error("a program (or --show) is required")
+
+    from output_vm import QuietSink
+    vm = AirConditionerVM(output=QuietSink())
+    vm.load_file(args.program)
+    for setting in args.sensor:
+        sensor, _, value = setting.partition("=")
+        vm.set_sensor(sensor, int(value))
+    vm.enable_trace(args.output)
+    status = 0
+    try:
+        vm.run(max_steps=args.max_steps)
+    except (RuntimeError, ValueError) as e:
+        # The trace up to the failing step is still written
+        print(f"Error: {e}", file=sys.stderr)
+        status = 1
+    finally:
+        vm.disable_trace()
+    print(f"{vm.steps} steps traced to {args.output}")
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+"""
+Multi-zone thermal model shared by many AirConditioner VMs.
+
+The model built into AirConditionerVM is one room drifting toward a fixed
+ambient. A Building holds any number of zones, each with its own thermal
+capacity, exchanging heat with each other through a conductance matrix and
+with an outdoor temperature that may vary over time:
+
+    C_i dT_i/dt = sum_j K_ij (T_j - T_i) + U_i (T_out(t) - T_i) + unit_i
+
+Time advances in fixed steps of `dt` seconds, however many instructions the
+controllers execute. Each step is one matrix-vector product for the passive
+exchange (backward Euler, with the matrix inverted once, so it is stable for
+any dt and coupling), then every zone's unit acts on its zone, all zones at
+once with NumPy. A unit behaves like the room model's, scaled by the zone's
+capacity: COOL/HEAT move toward the target at a fan-dependent rate and hold
+there, DRY takes humidity down 1%/s to the floor, cooling slightly.
+
+building.attach(vm, zone) makes a VM the controller of a zone: READ_SENSOR
+TEMP/HUMIDITY read the zone, set_sensor writes it, and the VM's device
+settings drive the zone's unit. A VM's clock is the building time it was
+attached at plus its ticks (the same clock scheduler_vm.Scheduler keeps, for
+VMs added at that time), and a sensor read first advances the building to
+it. The building never goes back: when reset(), a new program or restore()
+sets the VM's ticks back, its clock restarts from the building's time, and
+TEMP/HUMIDITY are the zone's rather than the reset or snapshot values. A
+unit picks up device changes at the building's next step. Zones with no VM
+attached have their unit off.
+
+With the defaults (capacity 1, envelope DRIFT_RATE, outdoor AMBIENT_TEMP) a
+lone zone follows the room model, minus its 0-50°C clamp. Zoned VMs run on
+the interpreter (with superinstructions): the memo, cycle skipping and the
+JIT assume the room model and are bypassed.
+"""
+
+import argparse
+import sys
+from typing import Callable, List, Optional, Sequence, Union
+
+import numpy as np
+
+from airconditioner_vm import (
+    AirConditionerVM, AMBIENT_TEMP, COOL_HEAT_RATE, DRIFT_RATE, DRY_COOLING,
+    DRY_FLOOR, FAN_BOOST,
+)
+
+DEFAULT_DT = 10  # Seconds per physics step
+
+# Outdoor temperature: constant, or a function of building time (seconds)
+# giving one value or one per zone
+Outdoor = Union[float, Callable[[int], Union[float, np.ndarray]]]
+
+
+class Zone:
+    """A VM attached to one zone of a building (vm.zone)"""
+
+    def __init__(self, building: "Building", index: int, vm: AirConditionerVM):
+        self.building = building
+        self.index = index
+        self.vm = vm
+        self.origin = building.time - vm.ticks  # Building time at vm.ticks == 0
+
+    def sync(self):
+        """AirConditionerVM._sync_thermal: advance the building to the VM's clock and read the zone"""
+        vm, building, index = self.vm, self.building, self.index
+        building.advance(self.origin + vm.ticks)
+        # The device may change right after a sync; the unit picks it up
+        # at the next step
+        building._dirty.add(index)
+        vm.thermal_ticks = vm.ticks
+        vm.temperature = float(building.temperature[index])
+        vm.humidity = float(building.humidity[index])
+        vm.sensors["TEMP"] = round(vm.temperature)
+        vm.sensors["HUMIDITY"] = round(vm.humidity)
+
+    def rebase(self):
+        """
+        The VM's tick counter restarted (reset, a new program, restore): its
+        clock carries on from the building's time, and it reads the zone again
+        """
+        self.origin = self.building.time - self.vm.ticks
+        self.sync()
+
+    def store(self):
+        """Write the VM's temperature and humidity (after set_sensor) into the zone"""
+        self.building.temperature[self.index] = self.vm.temperature
+        self.building.humidity[self.index] = self.vm.humidity
+
+
+class Building:
+    """
+    Zones with heat capacities, a symmetric conductance matrix between them
+    and a conductance to the outdoors each (scalars apply to every zone)
+    """
+
+    def __init__(self, zones: int, capacity: Union[float, Sequence[float]] = 1.0,
+                 coupling: Optional[np.ndarray] = None,
+                 envelope: Union[float, Sequence[float]] = DRIFT_RATE,
+                 outdoor: Outdoor = AMBIENT_TEMP, dt: int = DEFAULT_DT,
+                 temperature: Union[float, Sequence[float]] = 25.0,
+                 humidity: Union[float, Sequence[float]] = 60.0):
+        if dt <= 0:
+            raise ValueError("dt must be a positive number of seconds")
+        self.zones = zones
+        self.dt = dt
+        self.time = 0  # Seconds simulated, a multiple of dt
+        self.outdoor = outdoor
+        self.capacity = np.broadcast_to(np.asarray(capacity, dtype=np.float64), (zones,)).copy()
+        self.envelope = np.broadcast_to(np.asarray(envelope, dtype=np.float64), (zones,)).copy()
+        self.coupling = (np.zeros((zones, zones)) if coupling is None
+                         else np.asarray(coupling, dtype=np.float64))
+        if self.coupling.shape != (zones, zones):
+            raise ValueError(f"Coupling must be {zones}x{zones}")
+        if not np.allclose(self.coupling, self.coupling.T):
+            raise ValueError("Coupling must be symmetric")
+        if (self.capacity <= 0).any():
+            raise ValueError("Capacities must be positive")
+        self.temperature = np.broadcast_to(np.asarray(temperature, dtype=np.float64), (zones,)).copy()
+        self.humidity = np.broadcast_to(np.asarray(humidity, dtype=np.float64), (zones,)).copy()
+
+        # Backward Euler for the passive exchange: (I - dt A) T' = T + dt b,
+        # A = C^-1 (K - diag(row sums of K) - diag(U)), b = C^-1 U T_out
+        coupling = self.coupling.copy()
+        np.fill_diagonal(coupling, 0.0)
+        exchange = coupling - np.diag(coupling.sum(axis=1) + self.envelope)
+        step = np.eye(zones) - dt * exchange / self.capacity[:, None]
+        self._implicit = np.linalg.inv(step)
+        self._forcing = dt * self.envelope / self.capacity
+
+        # Unit settings per zone, refreshed from the controllers that synced
+        self.power = np.zeros(zones, dtype=np.int64)
+        self.mode = np.zeros(zones, dtype=np.int64)
+        self.target = np.zeros(zones, dtype=np.float64)
+        self.fan = np.zeros(zones, dtype=np.int64)
+        self.controllers: List[Optional[Zone]] = [None] * zones
+        self._dirty = set()
+
+    @classmethod
+    def grid(cls, rows: int, cols: int, conductance: float, **kwargs) -> "Building":
+        """A floor of rows x cols zones, each exchanging heat with its 4 neighbours"""
+        zones = rows * cols
+        coupling = np.zeros((zones, zones))
+        for r in range(rows):
+            for c in range(cols):
+                i = r * cols + c
+                if c + 1 < cols:
+                    coupling[i, i + 1] = coupling[i + 1, i] = conductance
+                if r + 1 < rows:
+                    coupling[i, i + cols] = coupling[i + cols, i] = conductance
+        return cls(zones, coupling=coupling, **kwargs)
+
+    # --- Controllers ---
+    def attach(self, vm: AirConditionerVM, zone: int) -> Zone:
+        """Make vm the controller of a zone; its TEMP/HUMIDITY become the zone's"""
+        if not 0 <= zone < self.zones:
+            raise ValueError(f"No zone {zone} (building has {self.zones})")
+        if self.controllers[zone] is not None:
+            raise ValueError(f"Zone {zone} already has a controller")
+        if vm.zone is not None:
+            raise ValueError("VM is already attached to a zone")
+        attached = Zone(self, zone, vm)
+        self.controllers[zone] = vm.zone = attached
+        self._dirty.add(zone)
+        attached.sync()
+        return attached
+
+    def detach(self, vm: AirConditionerVM):
+        """Give the VM back its own room model, starting from its zone's state"""
+        attached = vm.zone
+        if attached is None or attached.building is not self:
+            raise ValueError("VM is not attached to this building")
+        attached.sync()
+        vm.zone = None
+        self.controllers[attached.index] = None
+        self._dirty.add(attached.index)
+
+    def _refresh(self):
+        """Copy the device settings of the controllers that may have changed them"""
+        for index in self._dirty:
+            controller = self.controllers[index]
+            if controller is None:
+                self.power[index] = 0
+                continue
+            device = controller.vm.device_state
+            self.power[index] = device["POWER_STATE"]
+            self.mode[index] = device["MODE"]
+            self.target[index] = device["TARGET_TEMP"]
+            self.fan[index] = device["FAN_SPEED"]
+        self._dirty.clear()
+
+    # --- Integration ---
+    def advance(self, until: int):
+        """Take every whole step up to building time `until`"""
+        count = (until - self.time) // self.dt
+        if count > 0:
+            self.step(count)
+
+    def step(self, count: int = 1):
+        """Advance the building `count` steps of dt seconds"""
+        self._refresh()
+        dt, outdoor = self.dt, self.outdoor
+        on = self.power == 1
+        cool = on & (self.mode == 0)
+        heat = on & (self.mode == 1)
+        dry = on & (self.mode == 2)
+        working = cool.any() or heat.any()
+        drying = dry.any()
+        # Degrees a unit moves its zone per step
+        rate = COOL_HEAT_RATE * (1 + self.fan * FAN_BOOST) * dt / self.capacity
+        target = self.target
+        temp, humidity = self.temperature, self.humidity
+        for _ in range(count):
+            outside = outdoor(self.time) if callable(outdoor) else outdoor
+            temp = self._implicit @ (temp + self._forcing * outside)
+            if working:
+                temp = np.where(cool & (temp > target), np.maximum(target, temp - rate), temp)
+                temp = np.where(heat & (temp < target), np.minimum(target, temp + rate), temp)
+            if drying:
+                removed = np.where(dry, np.clip(humidity - DRY_FLOOR, 0, dt), 0.0)
+                humidity = humidity - removed
+                temp = temp - DRY_COOLING * removed / self.capacity
+            self.time += dt
+        self.temperature[:] = temp
+        self.humidity[:] = humidity
+
+
+def main(argv=None) -> int:
+    from output_vm import QuietSink
+    from scheduler_vm import Scheduler
+
+    parser = argparse.ArgumentParser(
+        description="Run one controller per zone of a floor plan with heat exchange between rooms.")
+    parser.add_argument("program", help="assembly file each zone's controller runs")
+    parser.add_argument("--rows", type=int, default=4)
+    parser.add_argument("--cols", type=int, default=8)
+    parser.add_argument("--conductance", type=float, default=0.005,
+                        help="heat exchange between adjacent zones, per second")
+    parser.add_argument("--outdoor", type=float, default=32.0, help="mean outdoor temperature")
+    parser.add_argument("--swing", type=float, default=6.0,
+                        help="daily outdoor swing, peak to mean")
+    parser.add_argument("--dt", type=int, default=DEFAULT_DT)
+    parser.add_argument("--hours", type=float, default=6.0)
+    parser.add_argument("--every", type=int, default=0, metavar="N",
+                        help="run the controller only in every Nth zone (0: all)")
+    args = parser.parse_args(argv)
+
+    mean, swing = args.outdoor, args.swing
+    def outdoor(time: int) -> float:
+        # Peaks at 15:00, starting from 12:00
+        return mean + swing * np.cos(2 * np.pi * (time - 3 * 3600) / 86400)
+
+    building = Building.grid(args.rows, args.cols, args.conductance, outdoor=outdoor,
+                             dt=args.dt, temperature=mean)
+    with open(args.program) as f:
+        source = f.read()
+    scheduler = Scheduler()
+    for zone in range(building.zones):
+        if args.every and zone % args.every:
+            continue
+        vm = AirConditionerVM(output=QuietSink(), park_on_wait=True)
+        vm.load_program(source)
+        building.attach(vm, zone)
+        scheduler.add(vm, f"zone{zone}")
+    until = int(args.hours * 3600)
+    scheduler.run(until)
+    building.advance(until)
+    print(f"t={building.time}s outdoor={outdoor(building.time):.1f}")
+    for r in range(args.rows):
+        row = building.temperature[r * args.cols:(r + 1) * args.cols]
+        print(" ".join(f"{t:5.1f}" for t in row))
+    if scheduler.errors:
+        print(f"{len(scheduler.errors)} controller(s) stopped: {next(iter(scheduler.errors.values()))}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())